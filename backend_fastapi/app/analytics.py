@@ -0,0 +1,71 @@
+"""
+コホート集計の参照API。値は cohort_analytics.py のバッチが書き込んだ集計テーブルから読むだけです。
+
+読み取りのみなので非同期セッション（database.get_async_db）で処理し、
+DBの応答を待つ間もイベントループを塞がないようにしています。
+"""
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import get_async_db
+from models import (
+    AnalyticsCohortAdherence,
+    AnalyticsCohortBodyPart,
+    AnalyticsUserAdherence,
+    AnalyticsUserBodyPart,
+    AnalyticsUserExercise,
+)
+
+router = APIRouter(prefix="/analytics")
+
+
+@router.get("/cohort")
+async def cohort_summary(db: AsyncSession = Depends(get_async_db)):
+    body_parts = (await db.scalars(
+        select(AnalyticsCohortBodyPart).order_by(AnalyticsCohortBodyPart.body_part))).all()
+    adherence = (await db.scalars(
+        select(AnalyticsCohortAdherence).order_by(AnalyticsCohortAdherence.quantile))).all()
+    return {
+        "body_parts": [
+            {"body_part": b.body_part, "avg_weekly_volume": b.avg_weekly_volume,
+             "median_weekly_volume": b.median_weekly_volume, "users": b.users}
+            for b in body_parts
+        ],
+        "adherence": [
+            {"quantile": a.quantile, "sessions_per_week": a.sessions_per_week,
+             "active_week_ratio": a.active_week_ratio}
+            for a in adherence
+        ],
+    }
+
+
+@router.get("/users/{user_id}")
+async def user_summary(user_id: int, db: AsyncSession = Depends(get_async_db)):
+    adherence = await db.get(AnalyticsUserAdherence, user_id)
+    if adherence is None:
+        raise HTTPException(status_code=404, detail="集計データがありません")
+    exercises = (await db.scalars(
+        select(AnalyticsUserExercise).filter_by(user_id=user_id).order_by(AnalyticsUserExercise.exercise))).all()
+    cohort = dict((await db.execute(
+        select(AnalyticsCohortBodyPart.body_part, AnalyticsCohortBodyPart.avg_weekly_volume))).all())
+    body_parts = (await db.scalars(
+        select(AnalyticsUserBodyPart).filter_by(user_id=user_id).order_by(AnalyticsUserBodyPart.body_part))).all()
+    return {
+        "user_id": user_id,
+        "exercises": [
+            {"exercise": e.exercise, "best_weight": e.best_weight, "best_e1rm": e.best_e1rm,
+             "sets": e.sets, "percentile": e.percentile}
+            for e in exercises
+        ],
+        "body_parts": [
+            {"body_part": b.body_part, "avg_weekly_volume": b.avg_weekly_volume,
+             "cohort_avg_weekly_volume": cohort.get(b.body_part)}
+            for b in body_parts
+        ],
+        "adherence": {
+            "sessions_per_week": adherence.sessions_per_week,
+            "active_week_ratio": adherence.active_week_ratio,
+            "last_date": adherence.last_date,
+        },
+    }
@@ -0,0 +1,127 @@
+"""
+/chat エンドポイント（AIトレーナー）。
+
+応答は NDJSON（1行1JSON）でストリーミングします。
+
+    {"token": "ベンチプレスは"}
+    {"token": "週2回、"}
+    ...
+    {"done": true, "reply": "<全文>"}
+
+stream=false を指定すると従来どおり {"reply": "..."} を一括で返します。
+モデル呼び出しは chat_scheduler.ChatScheduler を経由し、接続元ごとのレート制限超過は 429、
+待ち行列が満杯のときは 503 を返します（どちらも DB を読む前に判定します）。
+
+トレーニング要約をプロンプトに入れるのは、`Authorization: Bearer <トークン>` ヘッダーで
+kintore_common.user_token の署名付きトークンを送ってきたときだけです。
+本文の user_id は誰でも書き換えられるので、他人の履歴を読めないよう使いません。
+"""
+import json
+import logging
+from typing import Dict, List, Optional
+
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+from chat_models import get_chat_model
+from chat_scheduler import ChatJob, ChatScheduler, QueueFull, RateLimitExceeded
+from database import SessionLocal
+from kintore_common import user_token
+from trainer_context import context_cache
+
+# モデルに渡すトレーニング要約のトークン上限
+CONTEXT_TOKEN_BUDGET = 400
+
+router = APIRouter()
+logger = logging.getLogger("kintore.chat")
+scheduler = ChatScheduler.from_env(get_chat_model)
+
+
+class ChatMessage(BaseModel):
+    role: str
+    content: str
+
+
+class ChatRequest(BaseModel):
+    message: str
+    history: List[ChatMessage] = []
+    stream: bool = True
+
+
+def _history(req: ChatRequest) -> List[Dict]:
+    return [m.model_dump() for m in req.history]
+
+
+def _load_context(user_id: int) -> str:
+    db = SessionLocal()
+    try:
+        return context_cache.build_context(db, user_id, CONTEXT_TOKEN_BUDGET)
+    finally:
+        db.close()
+
+
+async def _ndjson_stream(job: ChatJob):
+    parts = []
+    try:
+        async for token in job.tokens():
+            parts.append(token)
+            yield json.dumps({"token": token}, ensure_ascii=False) + "\n"
+    except Exception:
+        # 内部の例外メッセージはクライアントに出さず、ログにだけ残す
+        logger.exception("チャット応答の生成に失敗しました")
+        yield json.dumps({"error": "応答の生成に失敗しました。しばらくしてから再送してください。"},
+                         ensure_ascii=False) + "\n"
+        return
+    yield json.dumps({"done": True, "reply": "".join(parts)}, ensure_ascii=False) + "\n"
+
+
+def _authenticated_user(request: Request) -> Optional[int]:
+    """Authorization ヘッダーの署名付きトークンから分かるユーザーID（無い・不正なら None）。"""
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer":
+        return None
+    return user_token.verify(token.strip())
+
+
+def _client_key(request: Request) -> str:
+    # user_id はクライアントが自由に送れる値なので、レート制限には接続元アドレスを使う
+    # （本番は proxy_headers=True なので、信頼するプロキシ経由なら X-Forwarded-For の値になる）
+    return f"ip:{request.client.host if request.client else '-'}"
+
+
+@router.post("/chat")
+async def chat(req: ChatRequest, request: Request):
+    user_key = _client_key(request)
+    # DB を読む前に受付判定する（断るリクエストにはコンテキスト読み込みのコストをかけない）
+    try:
+        scheduler.admit(user_key)
+    except RateLimitExceeded as e:
+        raise HTTPException(status_code=429, detail="リクエストが多すぎます。少し待ってから再送してください。",
+                            headers={"Retry-After": str(max(1, round(e.retry_after)))})
+    except QueueFull:
+        raise HTTPException(status_code=503, detail="混雑しています。しばらくしてから再送してください。",
+                            headers={"Retry-After": "1"})
+    user_id = _authenticated_user(request)
+    try:
+        context = await run_in_threadpool(_load_context, user_id) if user_id else ""
+    except BaseException:
+        scheduler.release()
+        raise
+    job = scheduler.submit(user_key, req.message, _history(req), context, admitted=True)
+
+    if not req.stream:
+        return {"reply": "".join([token async for token in job.tokens()])}
+    return StreamingResponse(
+        _ndjson_stream(job),
+        media_type="application/x-ndjson",
+        # プロキシでバッファされると最初のトークンが届くのが遅れるため無効化
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/chat/stats")
+async def chat_stats():
+    """スケジューラの待ち行列長・バッチサイズ・拒否数など。"""
+    return scheduler.snapshot()
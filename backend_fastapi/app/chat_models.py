@@ -0,0 +1,164 @@
+"""
+AIトレーナー用のモデルバックエンド。
+
+ChatModel.stream() はトークン（文字列の断片）を順に yield する非同期ジェネレータです。
+stream_batch() は複数リクエストをまとめて処理し、(リクエスト番号, トークン) を yield します。
+バッチ推論に対応したバックエンドはこちらを上書きしてください。
+
+環境変数 CHAT_MODEL で差し替えられます。
+
+    CHAT_MODEL=local                       # 既定: 決定的なローカルモデル
+    CHAT_MODEL=mypackage.llm:MyChatModel   # 任意のクラスを "module:Class" で指定
+"""
+import asyncio
+import importlib
+import os
+import re
+from abc import ABC, abstractmethod
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+
+class ChatModel(ABC):
+    """モデルバックエンドの基底クラス。サブクラスは stream() を非同期ジェネレータとして実装する。"""
+
+    name = "base"
+
+    @abstractmethod
+    def stream(self, message: str, history: Optional[List[Dict]] = None,
+               context: str = "") -> AsyncIterator[str]:
+        """応答のトークンを順に yield する。"""
+
+    async def stream_batch(self, requests: List[Tuple[str, Optional[List[Dict]], str]]
+                           ) -> AsyncIterator[Tuple[int, str]]:
+        """既定の実装: 各リクエストの stream() を並行に動かし、届いた順に流す。"""
+        queue: asyncio.Queue = asyncio.Queue()
+        done = object()
+
+        async def pump(i, message, history, context):
+            try:
+                async for token in self.stream(message, history, context):
+                    await queue.put((i, token))
+            except Exception as e:
+                await queue.put((i, e))
+            finally:
+                await queue.put((i, done))
+
+        tasks = [asyncio.create_task(pump(i, *req)) for i, req in enumerate(requests)]
+        remaining = len(tasks)
+        try:
+            while remaining:
+                i, item = await queue.get()
+                if item is done:
+                    remaining -= 1
+                    continue
+                yield i, item
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def complete(self, message: str, history: Optional[List[Dict]] = None, context: str = "") -> str:
+        parts = []
+        async for token in self.stream(message, history, context):
+            parts.append(token)
+        return "".join(parts)
+
+
+# =========================
+# ローカルの決定的モデル（テスト・オフライン用）
+# =========================
+_RULES = [
+    (re.compile(r"デロード|deload|疲労|停滞"),
+     "停滞や疲労を感じるなら、1週間だけ重量を60〜70%に落とすデロードを入れましょう。"
+     "フォームを確認しつつ、翌週から元の重量に戻すのがおすすめです。"),
+    (re.compile(r"ベンチ|bench|胸"),
+     "ベンチプレスは週2回、5〜8回×3〜5セットを目安に。"
+     "前回より2.5kgか1回増やせたら順調な伸びです🔥"),
+    (re.compile(r"スクワット|squat|脚"),
+     "スクワットは深さとフォームを優先し、5回×5セットから始めましょう。"
+     "膝とつま先の向きをそろえるのがポイントです。"),
+    (re.compile(r"デッド|deadlift|背中"),
+     "デッドリフトは背中を丸めないことが最優先です。"
+     "高重量は週1回に抑え、回復を十分に取りましょう。"),
+]
+_DEFAULT_REPLY = "記録を続けることが一番の近道です。気になる種目や目標を教えてください💪"
+
+
+class LocalTrainerModel(ChatModel):
+    """
+    キーワードに応じた定型文を返す決定的なモデル。
+    token_delay 秒ごとに 1 トークンずつ返すので、ストリーミングの確認にも使えます。
+    call_latency は呼び出し（バッチ）1回ごとの固定遅延で、推論サーバーの往復を模擬します。
+    """
+
+    name = "local"
+
+    def __init__(self, token_delay: float = 0.0, call_latency: float = 0.0):
+        self.token_delay = token_delay
+        self.call_latency = call_latency
+
+    def reply_for(self, message: str, context: str = "") -> str:
+        text = message.lower()
+        reply = next((r for pattern, r in _RULES if pattern.search(text)), _DEFAULT_REPLY)
+        if context:
+            reply = f"{context.splitlines()[0]}\n{reply}"
+        return reply
+
+    @staticmethod
+    def tokenize(text: str) -> List[str]:
+        # 日本語は句読点・記号単位、英数字は単語単位で区切る
+        return re.findall(r"[A-Za-z0-9.%〜]+|[^A-Za-z0-9.%〜、。]+[、。]?|[、。]|\n", text)
+
+    async def stream(self, message: str, history: Optional[List[Dict]] = None,
+                     context: str = "") -> AsyncIterator[str]:
+        if self.call_latency:
+            await asyncio.sleep(self.call_latency)
+        for token in self.tokenize(self.reply_for(message, context)):
+            if self.token_delay:
+                await asyncio.sleep(self.token_delay)
+            yield token
+
+    async def stream_batch(self, requests: List[Tuple[str, Optional[List[Dict]], str]]
+                           ) -> AsyncIterator[Tuple[int, str]]:
+        # バッチ全体で遅延は1回だけ。各ステップで全リクエストのトークンを1つずつ返す
+        if self.call_latency:
+            await asyncio.sleep(self.call_latency)
+        streams = [self.tokenize(self.reply_for(message, context)) for message, _, context in requests]
+        for step in range(max((len(t) for t in streams), default=0)):
+            if self.token_delay:
+                await asyncio.sleep(self.token_delay)
+            for i, tokens in enumerate(streams):
+                if step < len(tokens):
+                    yield i, tokens[step]
+
+
+# =========================
+# バックエンドの選択
+# =========================
+_model: Optional[ChatModel] = None
+
+
+def load_model(spec: str) -> ChatModel:
+    if spec in ("", "local"):
+        return LocalTrainerModel(
+            token_delay=float(os.getenv("CHAT_TOKEN_DELAY", "0")),
+            call_latency=float(os.getenv("CHAT_CALL_LATENCY", "0")),
+        )
+    module_name, _, class_name = spec.partition(":")
+    if not class_name:
+        raise ValueError(f"CHAT_MODEL は 'module:Class' 形式で指定してください: {spec}")
+    cls = getattr(importlib.import_module(module_name), class_name)
+    return cls()
+
+
+def get_chat_model() -> ChatModel:
+    """プロセス内で共有するモデルを返す（FastAPI の依存関数としても使用）。"""
+    global _model
+    if _model is None:
+        _model = load_model(os.getenv("CHAT_MODEL", "local"))
+    return _model
+
+
+def set_chat_model(model: Optional[ChatModel]):
+    """モデルを差し替える（テストや起動時の初期化用）。None で環境変数から再読み込み。"""
+    global _model
+    _model = model
@@ -0,0 +1,259 @@
+"""
+/chat リクエストのスケジューラ。
+
+- クライアントごとのトークンバケットでレート制限（超過は RateLimitExceeded）
+- 同時に届いたリクエストを最大 max_batch_size 件・max_wait 秒までまとめて
+  ChatModel.stream_batch() に渡す（マイクロバッチ）
+- モデル呼び出しの同時実行数を max_concurrency に制限し、
+  待ち行列が max_queue を超えたら QueueFull で新規受付を断る（バックプレッシャー）
+- 受付判定（admit）は投入（submit）と分けられるので、DB からのコンテキスト読み込みなど
+  重い前処理は受付が通ってから行う。満杯で断るときはレート制限のトークンを消費しない
+
+各設定は環境変数 CHAT_MAX_BATCH / CHAT_BATCH_WAIT_MS / CHAT_MAX_CONCURRENCY /
+CHAT_MAX_QUEUE / CHAT_RATE_PER_MIN / CHAT_BURST で変更できます。
+"""
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+from chat_models import ChatModel
+
+_DONE = object()
+
+
+class RateLimitExceeded(Exception):
+    def __init__(self, retry_after: float):
+        super().__init__(f"rate limit exceeded, retry after {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+class QueueFull(Exception):
+    pass
+
+
+class TokenBucket:
+    """rate（個/秒）で補充され、capacity 個まで貯まるトークンバケット。"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, cost: float = 1.0) -> float:
+        """取得できれば 0.0、できなければ次に取得できるまでの秒数を返す。"""
+        self._refill(time.monotonic())
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        return (cost - self.tokens) / self.rate
+
+    def is_full(self) -> bool:
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity
+
+
+class ChatJob:
+    """スケジューラに投入された1リクエスト。tokens() でモデルの出力を受け取る。"""
+
+    def __init__(self, user_key: str, message: str, history: Optional[List[Dict]], context: str):
+        self.user_key = user_key
+        self.message = message
+        self.history = history
+        self.context = context
+        self.enqueued_at = time.monotonic()
+        self.started_at: Optional[float] = None
+        self._out: asyncio.Queue = asyncio.Queue()
+
+    def put(self, item):
+        self._out.put_nowait(item)
+
+    async def tokens(self):
+        while True:
+            item = await self._out.get()
+            if item is _DONE:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+
+class ChatScheduler:
+    def __init__(self, model_getter: Callable[[], ChatModel], max_batch_size: int = 8,
+                 max_wait: float = 0.02, max_concurrency: int = 4, max_queue: int = 256,
+                 rate_per_min: float = 20.0, burst: float = 5.0, max_buckets: int = 10000):
+        self.model_getter = model_getter
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.rate = rate_per_min / 60.0
+        self.burst = burst
+        self.max_buckets = max_buckets
+        # 接続元 -> バケット（最近使った順。max_buckets を超えたら古いものから捨てる）
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._pending: Optional[asyncio.Queue] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        # admit() を通って submit() 待ちの件数（待ち行列の空きとして予約済み）
+        self._reserved = 0
+        # 待ち行列から取り出したが、まだ実行を始めていないバッチ（まとめ中・実行枠の空き待ち）
+        self._held: List[ChatJob] = []
+        self._runner: Optional[asyncio.Task] = None
+        self._tasks: set = set()
+        self.stats = {
+            "submitted": 0,
+            "completed": 0,
+            "failed": 0,
+            "rejected_rate_limited": 0,
+            "rejected_queue_full": 0,
+            "batches": 0,
+            "batched_requests": 0,
+            "in_flight_batches": 0,
+            "queue_wait_seconds_total": 0.0,
+        }
+
+    @classmethod
+    def from_env(cls, model_getter: Callable[[], ChatModel]) -> "ChatScheduler":
+        return cls(
+            model_getter,
+            max_batch_size=int(os.getenv("CHAT_MAX_BATCH", "8")),
+            max_wait=float(os.getenv("CHAT_BATCH_WAIT_MS", "20")) / 1000,
+            max_concurrency=int(os.getenv("CHAT_MAX_CONCURRENCY", "4")),
+            max_queue=int(os.getenv("CHAT_MAX_QUEUE", "256")),
+            rate_per_min=float(os.getenv("CHAT_RATE_PER_MIN", "20")),
+            burst=float(os.getenv("CHAT_BURST", "5")),
+        )
+
+    # =========================
+    # 受付
+    # =========================
+    def _bucket(self, user_key: str) -> TokenBucket:
+        bucket = self._buckets.get(user_key)
+        if bucket is not None:
+            self._buckets.move_to_end(user_key)
+            return bucket
+        if len(self._buckets) >= self.max_buckets:
+            # 満タン（しばらく使われていない）バケットは捨てても挙動が変わらない
+            for key in [k for k, b in self._buckets.items() if b.is_full()]:
+                del self._buckets[key]
+            # それでも多ければ（接続元が多すぎる）最後に使われたのが古いものから捨てる
+            while len(self._buckets) >= self.max_buckets:
+                self._buckets.popitem(last=False)
+        bucket = self._buckets[user_key] = TokenBucket(self.rate, self.burst)
+        return bucket
+
+    def _ensure_started(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # イベントループごとにキュー・セマフォ・バッチ処理タスクを作り直す
+            self._loop = loop
+            self._pending = asyncio.Queue()
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+            self._reserved = 0
+            self._held = []
+            self._runner = loop.create_task(self._run())
+
+    def admit(self, user_key: str):
+        """
+        受付判定だけを行い、待ち行列の1枠を予約する。通ったら submit(..., admitted=True) で投入するか、
+        投入をやめるなら release() で枠を返す。満杯ならトークンを消費せずに QueueFull。
+        """
+        self._ensure_started()
+        if self.queue_depth() + self._reserved >= self.max_queue:
+            self.stats["rejected_queue_full"] += 1
+            raise QueueFull("chat queue is full")
+        retry_after = self._bucket(user_key).try_acquire()
+        if retry_after:
+            self.stats["rejected_rate_limited"] += 1
+            raise RateLimitExceeded(retry_after)
+        self._reserved += 1
+
+    def release(self):
+        """admit() で予約した枠を返す（投入前に失敗したとき）。"""
+        self._reserved = max(0, self._reserved - 1)
+
+    def submit(self, user_key: str, message: str, history: Optional[List[Dict]] = None,
+               context: str = "", admitted: bool = False) -> ChatJob:
+        if not admitted:
+            self.admit(user_key)
+        self.release()
+        job = ChatJob(user_key, message, history, context)
+        self._pending.put_nowait(job)
+        self.stats["submitted"] += 1
+        return job
+
+    # =========================
+    # バッチ処理
+    # =========================
+    async def _collect(self) -> List[ChatJob]:
+        batch = self._held = [await self._pending.get()]
+        deadline = self._loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - self._loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._pending.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            await self._slots.acquire()
+            # 空き待ちの間に溜まった分も同じバッチに載せる
+            while len(batch) < self.max_batch_size and not self._pending.empty():
+                batch.append(self._pending.get_nowait())
+            self._held = []
+            task = asyncio.create_task(self._execute(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _execute(self, batch: List[ChatJob]):
+        self.stats["batches"] += 1
+        self.stats["batched_requests"] += len(batch)
+        self.stats["in_flight_batches"] += 1
+        now = time.monotonic()
+        for job in batch:
+            job.started_at = now
+            self.stats["queue_wait_seconds_total"] += now - job.enqueued_at
+        try:
+            model = self.model_getter()
+            requests = [(job.message, job.history, job.context) for job in batch]
+            async for i, token in model.stream_batch(requests):
+                batch[i].put(token)
+            for job in batch:
+                job.put(_DONE)
+            self.stats["completed"] += len(batch)
+        except Exception as e:
+            for job in batch:
+                job.put(e)
+            self.stats["failed"] += len(batch)
+        finally:
+            self.stats["in_flight_batches"] -= 1
+            self._slots.release()
+
+    # =========================
+    # メトリクス
+    # =========================
+    def queue_depth(self) -> int:
+        """実行を待っている件数（待ち行列 + まとめ中・実行枠の空き待ちのバッチ）。"""
+        if self._pending is None:
+            return 0
+        return self._pending.qsize() + len(self._held)
+
+    def snapshot(self) -> Dict:
+        stats = dict(self.stats)
+        stats["queue_depth"] = self.queue_depth()
+        stats["avg_batch_size"] = stats["batched_requests"] / stats["batches"] if stats["batches"] else 0.0
+        started = stats["batched_requests"]
+        stats["avg_queue_wait_ms"] = stats["queue_wait_seconds_total"] / started * 1000 if started else 0.0
+        return stats
@@ -0,0 +1,250 @@
+"""
+ジム全体（コホート）の集計バッチ。
+
+training_records を user_id で分割し、複数プロセスでユーザーごとの集計を行ってから
+集計テーブル（models.py の Analytics*）に書き込みます。
+
+- 種目ごとの最大重量・推定1RM と、同じ種目を記録しているユーザー内でのパーセンタイル
+- 部位ごとの平均週間ボリューム（ユーザー別 / ジム全体）
+- 週あたりのトレーニング回数・継続率（ユーザー別 / ジム全体の分布）
+
+前回の実行から記録件数か最大IDが変わったユーザーだけを再集計します。
+集計期間は各ユーザーの最終記録日から遡った WINDOW_WEEKS 週なので、
+記録が変わっていないユーザーの値は再集計しなくても変わりません。
+
+    python cohort_analytics.py              # 変更のあったユーザーだけ
+    python cohort_analytics.py --full       # 全ユーザーを再集計
+    python cohort_analytics.py --workers 8 --chunk-size 200
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, delete, func, insert, select, update
+from sqlalchemy.pool import NullPool
+
+from database import DATABASE_URL, Base, SessionLocal, engine
+from models import (
+    AnalyticsCohortAdherence,
+    AnalyticsCohortBodyPart,
+    AnalyticsUserAdherence,
+    AnalyticsUserBodyPart,
+    AnalyticsUserExercise,
+    AnalyticsUserState,
+    TrainingRecord,
+)
+
+WINDOW_WEEKS = 12
+ADHERENCE_QUANTILES = (0.1, 0.25, 0.5, 0.75, 0.9)
+USER_TABLES = (AnalyticsUserExercise, AnalyticsUserBodyPart, AnalyticsUserAdherence)
+
+
+# =========================
+# 対象ユーザーの決定
+# =========================
+def find_changed_users(db, full: bool = False) -> Tuple[Dict[int, Tuple[int, int]], List[int]]:
+    """
+    (再集計するユーザー -> (件数, 最大ID), 記録が無くなったユーザー) を返す。
+    件数と最大IDは user_id インデックス上の1回の集約クエリで取る。
+    """
+    current = {
+        uid: (count, max_id)
+        for uid, count, max_id in db.query(
+            TrainingRecord.user_id, func.count(TrainingRecord.id), func.max(TrainingRecord.id)
+        ).group_by(TrainingRecord.user_id)
+    }
+    state = {
+        uid: (count, max_id)
+        for uid, count, max_id in db.query(
+            AnalyticsUserState.user_id, AnalyticsUserState.record_count, AnalyticsUserState.max_record_id
+        )
+    }
+    removed = [uid for uid in state if uid not in current]
+    if full:
+        return current, removed
+    return {uid: v for uid, v in current.items() if state.get(uid) != v}, removed
+
+
+# =========================
+# ユーザーごとの集計（ワーカープロセスで実行）
+# =========================
+def summarize_users(df: pd.DataFrame, window_weeks: int = WINDOW_WEEKS):
+    """user_id を含む記録から、(種目別, 部位別, 継続率) の3つの DataFrame を作る。"""
+    df = df.assign(date=pd.to_datetime(df["date"]))
+    e1rm = df["weight"].to_numpy(dtype=float) * (1 + df["reps"].to_numpy(dtype=float) / 30)
+
+    ex = (
+        df.assign(e1rm=e1rm)
+        .groupby(["user_id", "exercise"], sort=False)
+        .agg(best_weight=("weight", "max"), best_e1rm=("e1rm", "max"), sets=("weight", "size"))
+        .reset_index()
+    )
+
+    # 集計期間: 各ユーザーの最終記録日から window_weeks 週（履歴が短い人はその期間）
+    by_user = df.groupby("user_id", sort=False)["date"]
+    last = by_user.transform("max")
+    first = by_user.transform("min")
+    recent = df[df["date"] > last - pd.Timedelta(weeks=window_weeks)]
+    span_weeks = np.clip(np.ceil(((last - first).dt.days + 1) / 7), 1, window_weeks)
+    weeks = span_weeks.groupby(df["user_id"], sort=False).first()
+
+    bp = recent.groupby(["user_id", "body_part"], sort=False)["volume"].sum().reset_index()
+    bp["avg_weekly_volume"] = bp["volume"] / bp["user_id"].map(weeks)
+    bp = bp.drop(columns="volume")
+
+    recent_by_user = recent.groupby("user_id", sort=False)
+    iso = recent["date"].dt.isocalendar()
+    adh = pd.DataFrame({
+        "sessions": recent_by_user["date"].nunique(),
+        "active_weeks": (iso["year"] * 100 + iso["week"]).groupby(recent["user_id"], sort=False).nunique(),
+        "last_date": by_user.max().dt.date,
+    })
+    adh["sessions_per_week"] = adh["sessions"] / weeks
+    adh["active_week_ratio"] = np.minimum(adh["active_weeks"] / weeks, 1.0)
+    adh = adh.reset_index()[["user_id", "sessions_per_week", "active_week_ratio", "last_date"]]
+    return ex, bp, adh
+
+
+def _compute_chunk(args):
+    database_url, user_ids, window_weeks = args
+    # 子プロセスでは親のコネクションプールを共有しないよう専用のエンジンを作る
+    chunk_engine = create_engine(database_url, poolclass=NullPool)
+    try:
+        stmt = select(
+            TrainingRecord.user_id, TrainingRecord.date, TrainingRecord.body_part,
+            TrainingRecord.exercise, TrainingRecord.weight, TrainingRecord.reps, TrainingRecord.volume,
+        ).where(TrainingRecord.user_id.in_(user_ids))
+        with chunk_engine.connect() as conn:
+            df = pd.read_sql(stmt, conn)
+    finally:
+        chunk_engine.dispose()
+    return summarize_users(df, window_weeks)
+
+
+def _chunks(items: Sequence[int], size: int):
+    for i in range(0, len(items), size):
+        yield list(items[i:i + size])
+
+
+# =========================
+# 書き込み
+# =========================
+def _records(df: pd.DataFrame) -> List[Dict]:
+    return df.astype(object).where(df.notna(), None).to_dict("records")
+
+
+def _refresh_percentiles(db):
+    ex = pd.read_sql(
+        select(AnalyticsUserExercise.user_id, AnalyticsUserExercise.exercise,
+               AnalyticsUserExercise.best_e1rm, AnalyticsUserExercise.percentile),
+        db.connection(),
+    )
+    if ex.empty:
+        return 0
+    new_pct = ex.groupby("exercise")["best_e1rm"].rank(pct=True, method="max") * 100
+    changed = ex[~np.isclose(ex["percentile"].fillna(-1), new_pct)].assign(percentile=new_pct)
+    if not changed.empty:
+        db.execute(update(AnalyticsUserExercise), _records(changed[["user_id", "exercise", "percentile"]]))
+    return len(changed)
+
+
+def _refresh_cohort(db):
+    bp = pd.read_sql(select(AnalyticsUserBodyPart.body_part, AnalyticsUserBodyPart.avg_weekly_volume), db.connection())
+    adh = pd.read_sql(select(AnalyticsUserAdherence.sessions_per_week, AnalyticsUserAdherence.active_week_ratio),
+                      db.connection())
+    db.execute(delete(AnalyticsCohortBodyPart))
+    db.execute(delete(AnalyticsCohortAdherence))
+    if not bp.empty:
+        cohort_bp = bp.groupby("body_part")["avg_weekly_volume"].agg(["mean", "median", "size"]).reset_index()
+        cohort_bp.columns = ["body_part", "avg_weekly_volume", "median_weekly_volume", "users"]
+        db.execute(insert(AnalyticsCohortBodyPart), _records(cohort_bp))
+    if not adh.empty:
+        q = adh.quantile(list(ADHERENCE_QUANTILES)).rename_axis("quantile").reset_index()
+        db.execute(insert(AnalyticsCohortAdherence), _records(q))
+
+
+# =========================
+# 実行
+# =========================
+def run(full: bool = False, workers: int = None, chunk_size: int = 500,
+        window_weeks: int = WINDOW_WEEKS, database_url: str = DATABASE_URL) -> Dict:
+    timings = {}
+    t0 = time.perf_counter()
+    Base.metadata.create_all(bind=engine)
+
+    db = SessionLocal()
+    try:
+        changed, removed = find_changed_users(db, full)
+        timings["detect"] = time.perf_counter() - t0
+
+        t = time.perf_counter()
+        user_ids = sorted(changed)
+        jobs = [(database_url, chunk, window_weeks) for chunk in _chunks(user_ids, chunk_size)]
+        workers = workers or os.cpu_count() or 1
+        if workers <= 1 or len(jobs) <= 1:
+            results = [_compute_chunk(job) for job in jobs]
+        else:
+            with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as pool:
+                results = list(pool.map(_compute_chunk, jobs))
+        timings["compute"] = time.perf_counter() - t
+
+        t = time.perf_counter()
+        stale = user_ids + removed
+        for chunk in _chunks(stale, 900):  # SQLite の変数上限を避けて分割
+            for table in USER_TABLES + (AnalyticsUserState,):
+                db.execute(delete(table).where(table.user_id.in_(chunk)))
+        for ex, bp, adh in results:
+            if not ex.empty:
+                db.execute(insert(AnalyticsUserExercise), _records(ex))
+            if not bp.empty:
+                db.execute(insert(AnalyticsUserBodyPart), _records(bp))
+            if not adh.empty:
+                db.execute(insert(AnalyticsUserAdherence), _records(adh))
+        now = datetime.now()
+        if user_ids:
+            db.execute(insert(AnalyticsUserState), [
+                {"user_id": uid, "record_count": changed[uid][0], "max_record_id": changed[uid][1], "computed_at": now}
+                for uid in user_ids
+            ])
+        percentile_updates = _refresh_percentiles(db) if stale else 0
+        if stale:
+            _refresh_cohort(db)
+        db.commit()
+        timings["write"] = time.perf_counter() - t
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+    timings["total"] = time.perf_counter() - t0
+    return {
+        "changed_users": len(user_ids),
+        "removed_users": len(removed),
+        "chunks": len(jobs),
+        "percentile_updates": percentile_updates,
+        "timings": timings,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--full", action="store_true", help="全ユーザーを再集計する")
+    parser.add_argument("--workers", type=int, default=None, help="ワーカープロセス数（既定: CPU数）")
+    parser.add_argument("--chunk-size", type=int, default=500, help="1ワーカーが一度に扱うユーザー数")
+    parser.add_argument("--window-weeks", type=int, default=WINDOW_WEEKS)
+    args = parser.parse_args(argv)
+
+    result = run(args.full, args.workers, args.chunk_size, args.window_weeks)
+    timings = "  ".join(f"{k}={v:.2f}s" for k, v in result["timings"].items())
+    print(f"✅ 再集計 {result['changed_users']}人 / 削除 {result['removed_users']}人 "
+          f"（{result['chunks']}チャンク, パーセンタイル更新 {result['percentile_updates']}件）  {timings}")
+
+
+if __name__ == "__main__":
+    main()
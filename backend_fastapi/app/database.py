@@ -0,0 +1,93 @@
+# database.py
+
+import os
+from pathlib import Path
+
+from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker, declarative_base
+
+# ===========================================
+# 🔧 データベースURL設定
+# ===========================================
+# Streamlit 側と同じ DATABASE_URL を参照します（未設定ならローカルの SQLite）
+# 既定の SQLite はカレントディレクトリではなく backend_fastapi/kintore.db に固定する
+# （run_server.py・cohort_analytics.py・precompute.py をどこから起動しても同じファイルを使う）
+DEFAULT_SQLITE_PATH = Path(__file__).resolve().parent.parent / "kintore.db"
+DATABASE_URL = os.getenv("DATABASE_URL", f"sqlite:///{DEFAULT_SQLITE_PATH}")
+
+connect_args = {"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {}
+engine = create_engine(DATABASE_URL, echo=False, pool_pre_ping=True, connect_args=connect_args)
+
+# セッション作成設定
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# モデルのベースクラス
+Base = declarative_base()
+
+
+# ===========================================
+# 🔧 非同期エンジン（読み取り系APIから使用）
+# ===========================================
+# PostgreSQL は asyncpg、SQLite は aiosqlite で同じDBに接続します。
+# イベントループをブロックしないので、1ワーカーで多数のリクエストを同時に待てます。
+ASYNC_DRIVERS = {"postgresql": "postgresql+asyncpg", "postgres": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+# SQL 文のキャッシュ件数（asyncpg のプリペアドステートメント / sqlite3 の cached_statements）
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "500"))
+
+
+def async_url(url: str):
+    """同期用の DATABASE_URL を非同期ドライバのURLに変換する。"""
+    u = make_url(url)
+    backend = u.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"非同期接続に未対応のDBです: {backend}")
+    u = u.set(drivername=ASYNC_DRIVERS[backend])
+    if backend != "sqlite":
+        u = u.update_query_dict({"prepared_statement_cache_size": str(DB_STATEMENT_CACHE_SIZE)})
+    return u
+
+
+def _create_async_engine(url: str):
+    u = async_url(url)
+    options = {"echo": False, "query_cache_size": DB_STATEMENT_CACHE_SIZE}
+    if u.get_backend_name() == "sqlite":
+        # ファイルDBの接続は切れないので pre_ping の往復は省く
+        options["connect_args"] = {"cached_statements": DB_STATEMENT_CACHE_SIZE}
+        if u.database in (None, "", ":memory:"):
+            # インメモリDBは接続ごとに別のDBになるため、プール設定は SQLAlchemy の既定に任せる
+            return create_async_engine(u, **options)
+    else:
+        options["pool_pre_ping"] = True
+    return create_async_engine(u, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, **options)
+
+
+async_engine = _create_async_engine(DATABASE_URL)
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False, autoflush=False)
+
+
+# ===========================================
+# 🔧 DBセッション取得用の依存関数
+# ===========================================
+def get_db():
+    """
+    FastAPI の依存関数。
+    APIリクエストごとにDBセッションを生成・クローズします。
+    """
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def get_async_db():
+    """
+    非同期版の依存関数。
+    `async def` のエンドポイントから `db: AsyncSession = Depends(get_async_db)` で使います。
+    """
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -1,9 +1,36 @@
+import logging
+import time
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI, UploadFile, File
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 import pandas as pd
 import os
 
-app = FastAPI()
+from analytics import router as analytics_router
+import observability
+import precompute
+from chat import router as chat_router, scheduler as chat_scheduler
+from precompute import router as precompute_router, start_scheduler, stop_scheduler
+from database import Base, async_engine, engine
+from kintore_common.csv_import import import_training_csv
+import models  # noqa: F401  テーブル定義の登録
+
+Base.metadata.create_all(bind=engine)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # ダッシュボード事前計算のワーカーループを起動（PRECOMPUTE_SCHEDULER=0 で無効）
+    await start_scheduler()
+    yield
+    await stop_scheduler()
+    await async_engine.dispose()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # CORS許可
 app.add_middleware(
@@ -14,21 +41,63 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# /metrics とトレースID（CORS より外側で計測する）
+observability.install(app, executors={
+    "chat": chat_scheduler.queue_depth,
+    "precompute": lambda: precompute.scheduler.snapshot()["queue_depth"] if precompute.scheduler else 0,
+}, engines={"sync": engine, "async": async_engine})
+logger = logging.getLogger("kintore.api")
+
+app.include_router(chat_router)
+app.include_router(analytics_router)
+app.include_router(precompute_router)
+
 UPLOAD_DIR = "uploaded_files"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
+def _describe(df: pd.DataFrame) -> dict:
+    # 文字列列と数値列が混ざると NaN が入るので、JSON にできる None に置き換える
+    summary = df.describe(include="all")
+    return summary.astype(object).where(summary.notna(), None).to_dict()
+
+
 @app.post("/upload_csv")
 async def upload_csv(file: UploadFile = File(...)):
     # ファイル保存
-    file_path = os.path.join(UPLOAD_DIR, file.filename)
+    data = await file.read()
+    file_path = os.path.join(UPLOAD_DIR, os.path.basename(file.filename))
     with open(file_path, "wb") as f:
-        f.write(await file.read())
+        f.write(data)
+
+    # 列の役割を推定して共通の列（日付, 部位, 種目, 重量(kg), 回数, ボリューム）に読み替える
+    start = time.perf_counter()
+    try:
+        df, mapping, cache_hit = await run_in_threadpool(import_training_csv, data)
+    except ValueError as e:
+        # トレーニングログとして読めない CSV はこれまで通りそのまま集計する
+        observability.CSV_ERRORS.inc()
+        logger.warning("CSV の列を推定できませんでした: %s", e, extra={"fields": {"bytes": len(data)}})
+        df = pd.read_csv(file_path)
+        return {"message": "ファイルを受信しました", "summary": _describe(df),
+                "mapping": None, "detail": str(e)}
+
+    elapsed = time.perf_counter() - start
+    observability.observe_csv(len(data), len(df), elapsed)
+    logger.info("CSV を読み込みました", extra={"fields": {
+        "bytes": len(data), "rows": len(df), "parse_ms": round(elapsed * 1000, 1), "schema_cache_hit": cache_hit,
+    }})
+    return {
+        "message": "ファイルを受信しました",
+        "summary": _describe(df),
+        "rows": len(df),
+        "mapping": mapping,
+        "schema_cache_hit": cache_hit,
+    }
 
-    # pandasでCSV読み込み
-    df = pd.read_csv(file_path)
-    summary = df.describe(include="all").to_dict()
 
-    return {"message": "ファイルを受信しました", "summary": summary}
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return PlainTextResponse(observability.render_metrics(), media_type="text/plain; version=0.0.4")
 
 
 @app.get("/")
@@ -0,0 +1,122 @@
+# models.py
+# Streamlit 側（app_firebase_login.py）と同じテーブル定義
+
+from sqlalchemy import Boolean, Column, Date, DateTime, Float, Integer, String, Text
+
+from database import Base
+
+
+class User(Base):
+    __tablename__ = "users"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    email = Column(String, unique=True, nullable=False, index=True)
+    password_hash = Column(String, nullable=False)
+    is_admin = Column(Boolean, default=False)
+
+
+class TrainingRecord(Base):
+    __tablename__ = "training_records"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, index=True, nullable=False)
+    date = Column(Date, index=True, nullable=False)
+    body_part = Column(String, index=True, nullable=False)
+    exercise = Column(String, index=True, nullable=False)
+    # 種目名辞書（frontend_streamlit/exercise_dictionary.py）の ID
+    exercise_id = Column(Integer, index=True)
+    weight = Column(Float, nullable=False)
+    reps = Column(Integer, nullable=False)
+    volume = Column(Float, nullable=False)
+
+
+# ===========================================
+# 📊 集計テーブル（cohort_analytics.py が書き込む）
+# ===========================================
+class AnalyticsUserState(Base):
+    """ユーザーごとの最終集計時点。記録件数と最大IDが変わったユーザーだけ再集計する。"""
+    __tablename__ = "analytics_user_state"
+    user_id = Column(Integer, primary_key=True)
+    record_count = Column(Integer, nullable=False)
+    max_record_id = Column(Integer, nullable=False)
+    computed_at = Column(DateTime, nullable=False)
+
+
+class AnalyticsUserExercise(Base):
+    __tablename__ = "analytics_user_exercise"
+    user_id = Column(Integer, primary_key=True)
+    exercise = Column(String, primary_key=True)
+    best_weight = Column(Float, nullable=False)
+    best_e1rm = Column(Float, nullable=False)
+    sets = Column(Integer, nullable=False)
+    # 同じ種目を記録しているユーザーの中での推定1RMのパーセンタイル（0〜100）
+    percentile = Column(Float)
+
+
+class AnalyticsUserBodyPart(Base):
+    __tablename__ = "analytics_user_bodypart"
+    user_id = Column(Integer, primary_key=True)
+    body_part = Column(String, primary_key=True)
+    avg_weekly_volume = Column(Float, nullable=False)
+
+
+class AnalyticsUserAdherence(Base):
+    __tablename__ = "analytics_user_adherence"
+    user_id = Column(Integer, primary_key=True)
+    sessions_per_week = Column(Float, nullable=False)
+    active_week_ratio = Column(Float, nullable=False)
+    last_date = Column(Date, nullable=False)
+
+
+class AnalyticsCohortBodyPart(Base):
+    __tablename__ = "analytics_cohort_bodypart"
+    body_part = Column(String, primary_key=True)
+    avg_weekly_volume = Column(Float, nullable=False)
+    median_weekly_volume = Column(Float, nullable=False)
+    users = Column(Integer, nullable=False)
+
+
+class AnalyticsCohortAdherence(Base):
+    """ジム全体の週あたりトレーニング回数の分布（分位点）。"""
+    __tablename__ = "analytics_cohort_adherence"
+    quantile = Column(Float, primary_key=True)
+    sessions_per_week = Column(Float, nullable=False)
+    active_week_ratio = Column(Float, nullable=False)
+
+
+# ===========================================
+# 🗂 ダッシュボードの事前計算（precompute.py）
+# ===========================================
+class DashboardCache(Base):
+    """ユーザーごとのダッシュボード表示用データ（JSON）。記録件数・最大IDで鮮度を判定する。"""
+    __tablename__ = "dashboard_cache"
+    user_id = Column(Integer, primary_key=True)
+    record_count = Column(Integer, nullable=False)
+    max_record_id = Column(Integer, nullable=False)
+    payload = Column(Text, nullable=False)
+    computed_at = Column(DateTime, nullable=False)
+    duration_ms = Column(Float, nullable=False)
+
+
+class PrecomputeJob(Base):
+    """事前計算ジョブの実行記録。"""
+    __tablename__ = "precompute_jobs"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, index=True, nullable=False)
+    trigger = Column(String, nullable=False)
+    queued_at = Column(DateTime, nullable=False)
+    started_at = Column(DateTime)
+    wait_ms = Column(Float)
+    duration_ms = Column(Float)
+    status = Column(String, nullable=False)
+    error = Column(Text)
+
+
+class PrecomputeRequest(Base):
+    """
+    API ワーカーから事前計算スケジューラへの投入依頼（マルチワーカー時は別プロセスのスケジューラがポーリングする）。
+    user_id が空なら、アクティブユーザー全員の再計算。
+    """
+    __tablename__ = "precompute_requests"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer)
+    trigger = Column(String, nullable=False)
+    requested_at = Column(DateTime, nullable=False)
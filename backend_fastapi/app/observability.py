@@ -0,0 +1,361 @@
+"""
+API の計測（Prometheus 形式の /metrics）とリクエストごとのトレースID。
+
+- ObservabilityMiddleware: ルート（パスのテンプレート）ごとのレイテンシのヒストグラム、
+  処理中リクエスト数、ステータス別の件数、受信バイト数を記録する
+- トレースID は W3C traceparent / X-Request-ID ヘッダーがあれば引き継ぎ、無ければ生成する。
+  レスポンスヘッダー（X-Trace-Id）とログ行（JSON の trace_id）に入る
+- CSV の取り込み量・解析時間、チャットと事前計算のキュー長、スレッドプールの待ち数は
+  スクレイプ時に読み出す
+
+マルチワーカー（gunicorn / uvicorn --workers）ではワーカーごとの値になります。
+Prometheus からは各ワーカーを個別のターゲットとして見るか、合計して扱ってください。
+
+    LOG_FORMAT=plain   ログを JSON ではなく通常の1行形式で出す
+    LOG_LEVEL=INFO
+"""
+import contextvars
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from starlette.routing import Match
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+trace_id_var: contextvars.ContextVar = contextvars.ContextVar("trace_id", default="-")
+
+
+# =========================
+# メトリクス
+# =========================
+def _escape_label(value) -> str:
+    """Prometheus のテキスト形式で必要なエスケープ（バックスラッシュ・二重引用符・改行）。"""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _fmt_labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape_label(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _fmt_value(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if not float(v).is_integer() else str(int(v))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1.0, *labels):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return self.header() + [f"{self.name}{_fmt_labels(self.label_names, k)} {_fmt_value(v)}" for k, v in items]
+
+
+class Gauge(_Metric):
+    """値を set/inc するか、set_function() でスクレイプ時に読み出す。"""
+    kind = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple, float] = {}
+        self._functions: Dict[Tuple, Callable[[], float]] = {}
+
+    def inc(self, amount: float = 1.0, *labels):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, *labels):
+        self.inc(-amount, *labels)
+
+    def set(self, value: float, *labels):
+        with self._lock:
+            self._values[labels] = float(value)
+
+    def set_function(self, fn: Callable[[], float], *labels):
+        self._functions[labels] = fn
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = dict(self._values)
+        for labels, fn in list(self._functions.items()):
+            try:
+                items[labels] = float(fn())
+            except Exception:
+                continue
+        return self.header() + [f"{self.name}{_fmt_labels(self.label_names, k)} {_fmt_value(v)}"
+                                for k, v in items.items()]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._counts: Dict[Tuple, List[int]] = {}
+        self._sums: Dict[Tuple, float] = {}
+
+    def observe(self, value: float, *labels):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._counts.get(labels)
+            if counts is None:
+                counts = self._counts[labels] = [0] * (len(self.buckets) + 1)
+                self._sums[labels] = 0.0
+            counts[i] += 1
+            self._sums[labels] += value
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = [(k, list(v), self._sums[k]) for k, v in self._counts.items()]
+        lines = self.header()
+        for labels, counts, total in items:
+            cumulative = 0
+            for bound, c in zip(self.buckets + (float("inf"),), counts):
+                cumulative += c
+                le = 'le="' + _fmt_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_fmt_labels(self.label_names, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_fmt_labels(self.label_names, labels)} {_fmt_value(total)}")
+            lines.append(f"{self.name}_count{_fmt_labels(self.label_names, labels)} {cumulative}")
+        return lines
+
+
+REGISTRY: List[_Metric] = []
+
+REQUESTS = Counter("http_requests_total", "処理したリクエスト数", ("method", "route", "status"))
+LATENCY = Histogram("http_request_duration_seconds", "リクエストの処理時間（ストリーミングは送信完了まで）",
+                    ("method", "route"))
+IN_FLIGHT = Gauge("http_requests_in_flight", "処理中のリクエスト数", ("method", "route"))
+EXCEPTIONS = Counter("http_request_exceptions_total", "未処理の例外で終わったリクエスト数", ("route",))
+BYTES_IN = Counter("http_request_body_bytes_total", "受信したリクエストボディのバイト数", ("route",))
+
+CSV_BYTES = Counter("csv_ingested_bytes_total", "/upload_csv で受け取った CSV のバイト数")
+CSV_ROWS = Counter("csv_rows_parsed_total", "読み取った CSV の行数")
+CSV_PARSE = Histogram("csv_parse_duration_seconds", "CSV の列推定と読み込みにかかった時間")
+CSV_ROWS_PER_SEC = Gauge("csv_parse_rows_per_second", "直近の CSV 読み込みの速度（行/秒）")
+CSV_ERRORS = Counter("csv_parse_failures_total", "トレーニングログとして読めなかった CSV の数")
+
+QUEUE_DEPTH = Gauge("executor_queue_depth", "実行待ちの件数", ("executor",))
+THREADPOOL_BUSY = Gauge("threadpool_busy_threads", "run_in_threadpool で使用中のスレッド数")
+
+
+def observe_csv(nbytes: int, rows: int, seconds: float):
+    CSV_BYTES.inc(nbytes)
+    CSV_ROWS.inc(rows)
+    CSV_PARSE.observe(seconds)
+    if seconds > 0:
+        CSV_ROWS_PER_SEC.set(rows / seconds)
+
+
+def _threadpool_stats() -> Tuple[float, float]:
+    from anyio import to_thread
+    limiter = to_thread.current_default_thread_limiter()
+    stats = limiter.statistics()
+    return stats.borrowed_tokens, stats.tasks_waiting
+
+
+DB_POOL = Gauge("db_pool_connections", "DB コネクションプールの接続数", ("engine", "state"))
+
+
+def register_executor(name: str, depth: Callable[[], float]):
+    """キュー長をスクレイプ時に読み出す関数を登録する。"""
+    QUEUE_DEPTH.set_function(depth, name)
+
+
+def register_pool(name: str, engine):
+    """QueuePool の使用中・待機中の接続数とプールサイズをスクレイプ時に読み出す。"""
+    # AsyncEngine は内部の同期エンジンがプールを持っている
+    pool = getattr(engine, "sync_engine", engine).pool
+    for state, attr in (("checked_out", "checkedout"), ("idle", "checkedin"), ("pool_size", "size")):
+        if hasattr(pool, attr):
+            DB_POOL.set_function(getattr(pool, attr), name, state)
+
+
+def render_metrics() -> str:
+    try:
+        busy, waiting = _threadpool_stats()
+        THREADPOOL_BUSY.set(busy)
+        QUEUE_DEPTH.set(waiting, "threadpool")
+    except Exception:
+        pass  # イベントループ外（スレッドから呼ばれた）ときは前回の値のまま
+    lines: List[str] = []
+    for metric in REGISTRY:
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
+
+
+# =========================
+# トレースID とログ
+# =========================
+_TRACEPARENT = re.compile(r"^[0-9a-f]{2}-([0-9a-f]{32})-[0-9a-f]{16}-[0-9a-f]{2}$")
+
+
+def _trace_id_from_headers(headers: Dict[bytes, bytes]) -> str:
+    m = _TRACEPARENT.match(headers.get(b"traceparent", b"").decode("latin-1").strip().lower())
+    if m and m.group(1) != "0" * 32:
+        return m.group(1)
+    request_id = headers.get(b"x-request-id", b"").decode("latin-1").strip()
+    if request_id and len(request_id) <= 128:
+        return request_id
+    return f"{random.getrandbits(128):032x}"
+
+
+class TraceIdFilter(logging.Filter):
+    def filter(self, record):
+        record.trace_id = trace_id_var.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        payload = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "trace_id": getattr(record, "trace_id", "-"),
+            "message": record.getMessage(),
+        }
+        payload.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+def setup_logging():
+    """アプリのロガー（kintore.*）にトレースID付きのハンドラーを付ける（2回目以降は何もしない）。"""
+    logger = logging.getLogger("kintore")
+    if getattr(logger, "_kintore_configured", False):
+        return logger
+    handler = logging.StreamHandler()
+    handler.addFilter(TraceIdFilter())
+    if os.getenv("LOG_FORMAT", "json") == "plain":
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(trace_id)s] %(name)s: %(message)s"))
+    else:
+        handler.setFormatter(JsonFormatter())
+    logger.addHandler(handler)
+    logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+    logger.propagate = False
+    logger._kintore_configured = True
+    return logger
+
+
+access_log = logging.getLogger("kintore.access")
+
+
+# =========================
+# ミドルウェア
+# =========================
+class ObservabilityMiddleware:
+    """純粋な ASGI ミドルウェア（/chat のストリーミングをバッファしない）。"""
+
+    def __init__(self, app):
+        self.app = app
+
+    @classmethod
+    def _route_template(cls, routes, scope) -> Optional[str]:
+        # ラベルはパスのテンプレート（/analytics/users/{user_id}）にして、系列が増えすぎないようにする
+        for route in routes:
+            match, _ = route.matches(scope)
+            if match != Match.FULL:
+                continue
+            inner = getattr(route, "original_router", None)  # include_router() で追加したルーター
+            if inner is not None:
+                found = cls._route_template(inner.routes, scope)
+                if found:
+                    return found
+            path = getattr(route, "path", None)
+            if path:
+                return path
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        trace_id = _trace_id_from_headers(headers)
+        token = trace_id_var.set(trace_id)
+        method = scope["method"]
+        router = scope["app"].router if "app" in scope else None
+        route = self._route_template(getattr(router, "routes", ()), scope) or "unmatched"
+        status = {"code": 500}
+        received = {"bytes": 0}
+
+        async def receive_wrapper():
+            message = await receive()
+            if message["type"] == "http.request":
+                received["bytes"] += len(message.get("body", b""))
+            return message
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [
+                    (b"x-trace-id", trace_id.encode("latin-1")),
+                ]
+            await send(message)
+
+        IN_FLIGHT.inc(1, method, route)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        except Exception:
+            EXCEPTIONS.inc(1, route)
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            IN_FLIGHT.dec(1, method, route)
+            LATENCY.observe(elapsed, method, route)
+            REQUESTS.inc(1, method, route, str(status["code"]))
+            if received["bytes"]:
+                BYTES_IN.inc(received["bytes"], route)
+            access_log.info("%s %s %s %.1fms", method, scope["path"], status["code"], elapsed * 1000, extra={
+                "fields": {"method": method, "route": route, "status": status["code"],
+                           "duration_ms": round(elapsed * 1000, 2), "bytes_in": received["bytes"]},
+            })
+            trace_id_var.reset(token)
+
+
+def install(app, executors: Optional[Dict[str, Callable[[], float]]] = None, engines: Optional[Dict] = None):
+    """アプリにミドルウェアとキュー長・コネクションプールの読み出しを登録する。"""
+    setup_logging()
+    app.add_middleware(ObservabilityMiddleware)
+    for name, depth in (executors or {}).items():
+        register_executor(name, depth)
+    for name, engine in (engines or {}).items():
+        register_pool(name, engine)
@@ -0,0 +1,478 @@
+"""
+ダッシュボード用データ（ヒートマップ・週間ボリューム・PR・伸びの傾向）の事前計算。
+
+PrecomputeScheduler はアプリ内で動く簡単なワーカーループです。
+
+- 毎晩 PRECOMPUTE_AT（既定 03:00）に、直近 PRECOMPUTE_ACTIVE_DAYS 日に記録のあるユーザーを投入
+- PRECOMPUTE_SWEEP_SECONDS ごとに「記録件数・最大IDがキャッシュと違うユーザー」を検出して投入
+  （CSV復元などの一括インポート後もここで拾われる）
+- 最近トレーニングしたユーザーほど先に処理し、同時実行数は PRECOMPUTE_MAX_PARALLEL まで
+- 各ジョブの待ち時間・処理時間は precompute_jobs テーブルに記録
+
+ログイン後の表示は GET /dashboard/{user_id} でキャッシュを読むだけになります
+（保存直後などで記録とキャッシュがずれていれば、そのときだけ計算し直します）。
+マルチワーカー構成では run_server.py が各ワーカーのスケジューラを止め、
+`python precompute.py` を別プロセスで1つだけ起動します（自前で起動する場合は PRECOMPUTE_SCHEDULER=0）。
+このときワーカーには PRECOMPUTE_SIDECAR=1 が渡り、POST /precompute/run などは
+precompute_requests テーブルに依頼を書くだけになります。スケジューラは PRECOMPUTE_POLL_SECONDS
+（既定 5 秒）ごとに依頼を取り出して投入します。
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from fastapi import APIRouter, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import delete, func, select
+from sqlalchemy.exc import IntegrityError
+
+from database import Base, SessionLocal, engine
+from models import DashboardCache, PrecomputeJob, PrecomputeRequest, TrainingRecord
+
+router = APIRouter()
+logger = logging.getLogger("kintore.precompute")
+
+
+# =========================
+# ダッシュボードデータの計算
+# =========================
+def _load_user_df(db, user_id: int) -> pd.DataFrame:
+    stmt = select(
+        TrainingRecord.id, TrainingRecord.date, TrainingRecord.body_part, TrainingRecord.exercise,
+        TrainingRecord.weight, TrainingRecord.reps, TrainingRecord.volume,
+    ).where(TrainingRecord.user_id == user_id)
+    return pd.read_sql(stmt, db.connection())
+
+
+def build_dashboard(df: pd.DataFrame) -> Dict:
+    """1ユーザー分の記録から表示用データを作る（JSON にそのまま出せる形）。"""
+    if df.empty:
+        return {"heatmap": [], "weekly_volume": [], "prs": [], "trends": []}
+    dates = pd.to_datetime(df["date"])
+    iso = dates.dt.isocalendar()
+
+    heat = (
+        df.groupby([iso["year"].to_numpy(), iso["week"].to_numpy(), iso["day"].to_numpy()])["volume"].sum()
+    )
+    heatmap = [{"year": int(y), "week": int(w), "weekday": int(d), "volume": float(v)}
+               for (y, w, d), v in heat.items()]
+
+    week_start = (dates - pd.to_timedelta(dates.dt.weekday, unit="D")).dt.date
+    weekly = df.groupby([week_start.to_numpy(), df["body_part"].to_numpy()])["volume"].sum()
+    weekly_volume = [{"week_start": str(w), "body_part": p, "volume": float(v)} for (w, p), v in weekly.items()]
+
+    e1rm = df["weight"] * (1 + df["reps"] / 30)
+    best_idx = df.groupby("exercise")["weight"].idxmax()
+    best_rm = e1rm.groupby(df["exercise"]).max()
+    prs = [
+        {"exercise": row.exercise, "best_weight": float(row.weight), "date": str(row.date),
+         "best_e1rm": float(best_rm[row.exercise])}
+        for row in df.loc[best_idx].itertuples()
+    ]
+
+    # 日別最大重量を経過日数で回帰した傾き
+    day_codes = dates.to_numpy(dtype="datetime64[D]").astype(np.int64)
+    daily = pd.DataFrame({"exercise": df["exercise"], "day": day_codes, "weight": df["weight"]}) \
+        .groupby(["exercise", "day"])["weight"].max().reset_index()
+    trends = []
+    for exercise, grp in daily.groupby("exercise"):
+        if len(grp) < 2:
+            continue
+        x = grp["day"].to_numpy(dtype=float)
+        y = grp["weight"].to_numpy(dtype=float)
+        sxx = ((x - x.mean()) ** 2).sum()
+        slope = float(((x - x.mean()) * (y - y.mean())).sum() / sxx) if sxx > 0 else 0.0
+        trends.append({"exercise": exercise, "slope_kg_per_week": slope * 7, "sessions": int(len(grp))})
+
+    return {"heatmap": heatmap, "weekly_volume": weekly_volume, "prs": prs, "trends": trends}
+
+
+def _version(db, user_id: int) -> Tuple[int, int]:
+    count, max_id = db.query(func.count(TrainingRecord.id), func.max(TrainingRecord.id)) \
+        .filter(TrainingRecord.user_id == user_id).one()
+    return int(count or 0), int(max_id or 0)
+
+
+def refresh_user(user_id: int, force: bool = False) -> Tuple[str, float]:
+    """キャッシュが古ければ再計算して保存する。戻り値は (status, 処理時間ms)。"""
+    start = time.perf_counter()
+    db = SessionLocal()
+    try:
+        version = _version(db, user_id)
+        cached = db.get(DashboardCache, user_id)
+        if not force and cached is not None and (cached.record_count, cached.max_record_id) == version:
+            return "fresh", (time.perf_counter() - start) * 1000
+        payload = json.dumps(build_dashboard(_load_user_df(db, user_id)), ensure_ascii=False)
+        duration = (time.perf_counter() - start) * 1000
+        if cached is None:
+            cached = DashboardCache(user_id=user_id)
+            db.add(cached)
+        cached.record_count, cached.max_record_id = version
+        cached.payload = payload
+        cached.computed_at = datetime.now()
+        cached.duration_ms = duration
+        db.commit()
+        return "computed", duration
+    except IntegrityError:
+        # 初回表示の同時リクエストなどで、別の処理が先に同じユーザーのキャッシュを作った
+        db.rollback()
+        return "fresh", (time.perf_counter() - start) * 1000
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def active_users(db, days: int, today: Optional[date] = None) -> List[Tuple[int, date]]:
+    """直近 days 日に記録のあるユーザーを、最終記録日の新しい順に返す。"""
+    since = (today or date.today()) - timedelta(days=days)
+    rows = db.query(TrainingRecord.user_id, func.max(TrainingRecord.date)) \
+        .group_by(TrainingRecord.user_id).having(func.max(TrainingRecord.date) >= since).all()
+    return sorted(rows, key=lambda r: r[1], reverse=True)
+
+
+def stale_users(db) -> List[Tuple[int, date]]:
+    """記録件数・最大IDがキャッシュと一致しないユーザー（最終記録日の新しい順）。"""
+    current = db.query(
+        TrainingRecord.user_id, func.count(TrainingRecord.id), func.max(TrainingRecord.id), func.max(TrainingRecord.date)
+    ).group_by(TrainingRecord.user_id).all()
+    cached = {u: (c, m) for u, c, m in db.query(DashboardCache.user_id, DashboardCache.record_count,
+                                                DashboardCache.max_record_id)}
+    rows = [(uid, last) for uid, count, max_id, last in current if cached.get(uid) != (count, max_id)]
+    return sorted(rows, key=lambda r: r[1], reverse=True)
+
+
+# =========================
+# 別プロセスのスケジューラへの依頼
+# =========================
+def request_precompute(user_id: Optional[int] = None, trigger: str = "manual") -> int:
+    """precompute_requests に依頼を書く（user_id が None ならアクティブユーザー全員）。依頼の ID を返す。"""
+    db = SessionLocal()
+    try:
+        req = PrecomputeRequest(user_id=user_id, trigger=trigger, requested_at=datetime.now())
+        db.add(req)
+        db.commit()
+        return req.id
+    finally:
+        db.close()
+
+
+def take_requests(db) -> List[PrecomputeRequest]:
+    """未処理の依頼を古い順に取り出して削除する（取り出すのはスケジューラ1つだけの前提）。"""
+    rows = db.query(PrecomputeRequest).order_by(PrecomputeRequest.id).all()
+    if rows:
+        db.execute(delete(PrecomputeRequest).where(PrecomputeRequest.id <= rows[-1].id))
+        db.commit()
+    return rows
+
+
+def request_stats(db) -> Dict:
+    """依頼の滞留数と、スケジューラが最後にジョブを終えた時刻（別プロセスの稼働確認用）。"""
+    pending = db.query(func.count(PrecomputeRequest.id)).scalar()
+    last_job = db.query(func.max(PrecomputeJob.started_at)).scalar()
+    return {"pending_requests": int(pending or 0),
+            "last_job_started_at": last_job.isoformat(timespec="seconds") if last_job else None}
+
+
+# =========================
+# スケジューラ
+# =========================
+def _seconds_until(hhmm: str, now: Optional[datetime] = None) -> float:
+    now = now or datetime.now()
+    hour, minute = (int(v) for v in hhmm.split(":"))
+    target = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if target <= now:
+        target += timedelta(days=1)
+    return (target - now).total_seconds()
+
+
+class PrecomputeScheduler:
+    def __init__(self, max_parallel: int = 2, nightly_at: str = "03:00", active_days: int = 30,
+                 sweep_seconds: float = 300.0, poll_seconds: float = 5.0):
+        self.max_parallel = max_parallel
+        self.nightly_at = nightly_at
+        self.active_days = active_days
+        self.sweep_seconds = sweep_seconds
+        self.poll_seconds = poll_seconds
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._pending: Dict[int, str] = {}
+        self._seq = itertools.count()
+        self._tasks: List[asyncio.Task] = []
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self.stats = {"queued": 0, "computed": 0, "fresh": 0, "failed": 0, "running": 0, "last_nightly": None}
+
+    @classmethod
+    def from_env(cls) -> "PrecomputeScheduler":
+        return cls(
+            max_parallel=int(os.getenv("PRECOMPUTE_MAX_PARALLEL", "2")),
+            nightly_at=os.getenv("PRECOMPUTE_AT", "03:00"),
+            active_days=int(os.getenv("PRECOMPUTE_ACTIVE_DAYS", "30")),
+            sweep_seconds=float(os.getenv("PRECOMPUTE_SWEEP_SECONDS", "300")),
+            poll_seconds=float(os.getenv("PRECOMPUTE_POLL_SECONDS", "5")),
+        )
+
+    # ---------- 投入 ----------
+    def enqueue(self, user_id: int, last_active: Optional[date] = None, trigger: str = "manual"):
+        """最終記録日が新しいユーザーほど優先度が高い（小さい値が先に取り出される）。"""
+        if user_id in self._pending:
+            return
+        priority = -(last_active.toordinal() if last_active else date.today().toordinal())
+        self._pending[user_id] = trigger
+        self._queue.put_nowait((priority, next(self._seq), user_id, datetime.now()))
+        self.stats["queued"] += 1
+
+    def enqueue_many(self, rows: List[Tuple[int, date]], trigger: str):
+        for user_id, last_active in rows:
+            self.enqueue(user_id, last_active, trigger)
+
+    async def enqueue_active(self, trigger: str = "nightly"):
+        rows = await run_in_threadpool(self._query, active_users, self.active_days)
+        self.enqueue_many(rows, trigger)
+        return len(rows)
+
+    async def enqueue_stale(self, trigger: str = "sweep"):
+        rows = await run_in_threadpool(self._query, stale_users)
+        self.enqueue_many(rows, trigger)
+        return len(rows)
+
+    async def enqueue_requests(self) -> int:
+        """API ワーカーが precompute_requests に書いた依頼を投入する。"""
+        requests = await run_in_threadpool(self._query, take_requests)
+        for req in requests:
+            if req.user_id is None:
+                await self.enqueue_active(req.trigger)
+            else:
+                self.enqueue(req.user_id, date.today(), req.trigger)
+        return len(requests)
+
+    @staticmethod
+    def _query(fn, *args):
+        db = SessionLocal()
+        try:
+            return fn(db, *args)
+        finally:
+            db.close()
+
+    # ---------- 実行 ----------
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            _, _, user_id, queued_at = await self._queue.get()
+            # 1件の失敗（DBの一時的なエラーなど）でワーカーごと止まらないよう、1ジョブずつ例外を受け止める
+            try:
+                trigger = self._pending.pop(user_id, "manual")
+                started_at = datetime.now()
+                self.stats["running"] += 1
+                status, duration, error = "failed", None, None
+                try:
+                    status, duration = await loop.run_in_executor(self._executor, refresh_user, user_id)
+                except Exception as e:
+                    logger.exception("ダッシュボードの事前計算に失敗しました: user_id=%s", user_id)
+                    error = str(e)
+                finally:
+                    self.stats["running"] -= 1
+                    self.stats[status] += 1
+                await loop.run_in_executor(self._executor, self._log_job, user_id, trigger, queued_at,
+                                           started_at, duration, status, error)
+            except Exception:
+                logger.exception("事前計算ジョブの記録に失敗しました: user_id=%s", user_id)
+
+    @staticmethod
+    def _log_job(user_id, trigger, queued_at, started_at, duration, status, error):
+        db = SessionLocal()
+        try:
+            db.add(PrecomputeJob(
+                user_id=user_id, trigger=trigger, queued_at=queued_at, started_at=started_at,
+                wait_ms=(started_at - queued_at).total_seconds() * 1000, duration_ms=duration,
+                status=status, error=error,
+            ))
+            db.commit()
+        finally:
+            db.close()
+
+    async def _nightly_loop(self):
+        while True:
+            await asyncio.sleep(_seconds_until(self.nightly_at))
+            try:
+                await self.enqueue_active("nightly")
+                self.stats["last_nightly"] = datetime.now().isoformat(timespec="seconds")
+            except Exception:
+                logger.exception("夜間の事前計算の投入に失敗しました")
+
+    async def _sweep_loop(self):
+        while True:
+            try:
+                await self.enqueue_stale("sweep")
+            except Exception:
+                logger.exception("古いキャッシュの検出に失敗しました")
+            await asyncio.sleep(self.sweep_seconds)
+
+    async def _request_loop(self):
+        while True:
+            try:
+                await self.enqueue_requests()
+            except Exception:
+                logger.exception("事前計算の依頼の取り出しに失敗しました")
+            await asyncio.sleep(self.poll_seconds)
+
+    async def start(self):
+        self._queue = asyncio.PriorityQueue()
+        self._executor = ThreadPoolExecutor(max_workers=self.max_parallel, thread_name_prefix="precompute")
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.max_parallel)]
+        self._tasks.append(asyncio.create_task(self._nightly_loop()))
+        if self.sweep_seconds > 0:
+            self._tasks.append(asyncio.create_task(self._sweep_loop()))
+        if self.poll_seconds > 0:
+            self._tasks.append(asyncio.create_task(self._request_loop()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+
+    async def drain(self):
+        """投入済みのジョブがすべて終わるまで待つ（CLI の一回実行用）。"""
+        while self._pending or self.stats["running"]:
+            await asyncio.sleep(0.05)
+
+    def snapshot(self) -> Dict:
+        return dict(self.stats, queue_depth=self._queue.qsize() if self._queue else 0)
+
+
+scheduler: Optional[PrecomputeScheduler] = None
+
+
+def _sidecar() -> bool:
+    """このプロセスのスケジューラは止め、別プロセス（run_server.py のサイドカー）に任せているか。"""
+    return scheduler is None and os.getenv("PRECOMPUTE_SIDECAR", "0") == "1"
+
+
+# =========================
+# API
+# =========================
+def _read_cache(user_id: int, fresh_only: bool = True) -> Optional[DashboardCache]:
+    """キャッシュを読む。fresh_only なら記録件数・最大IDが一致しない（古い）ときも None。"""
+    db = SessionLocal()
+    try:
+        cached = db.get(DashboardCache, user_id)
+        if fresh_only and cached is not None \
+                and (cached.record_count, cached.max_record_id) != _version(db, user_id):
+            return None
+        return cached
+    finally:
+        db.close()
+
+
+@router.get("/dashboard/{user_id}")
+async def dashboard(user_id: int):
+    """事前計算済みのダッシュボードデータ。未計算・保存後で古ければその場で計算し直して保存する。"""
+    cached = await run_in_threadpool(_read_cache, user_id)
+    if cached is None:
+        await run_in_threadpool(refresh_user, user_id)
+        # 計算直後にさらに記録が増えていても、いま計算した分を返す
+        cached = await run_in_threadpool(_read_cache, user_id, False)
+    if cached is None:
+        raise HTTPException(status_code=404, detail="ユーザーが見つかりません")
+    return {
+        "user_id": user_id,
+        "computed_at": cached.computed_at,
+        "record_count": cached.record_count,
+        **json.loads(cached.payload),
+    }
+
+
+@router.post("/precompute/users/{user_id}")
+async def precompute_user(user_id: int):
+    """一括インポート直後などに、そのユーザーの再計算を優先投入する。"""
+    if _sidecar():
+        await run_in_threadpool(request_precompute, user_id, "import")
+        return {"status": "requested"}
+    if scheduler is None:
+        status, duration = await run_in_threadpool(refresh_user, user_id)
+        return {"status": status, "duration_ms": duration}
+    scheduler.enqueue(user_id, date.today(), trigger="import")
+    return {"status": "queued"}
+
+
+@router.post("/precompute/run")
+async def precompute_run():
+    """アクティブユーザー全員の再計算を投入する（サイドカー構成では依頼を書くだけで、件数は返らない）。"""
+    if _sidecar():
+        return {"status": "requested", "request_id": await run_in_threadpool(request_precompute, None, "manual")}
+    if scheduler is None:
+        raise HTTPException(status_code=503, detail="スケジューラが無効です")
+    return {"status": "queued", "queued": await scheduler.enqueue_active("manual")}
+
+
+@router.get("/precompute/stats")
+async def precompute_stats():
+    if _sidecar():
+        return dict(await run_in_threadpool(PrecomputeScheduler._query, request_stats), enabled=True, mode="sidecar")
+    if scheduler is None:
+        return {"enabled": False}
+    return dict(scheduler.snapshot(), enabled=True, mode="in_process")
+
+
+async def start_scheduler():
+    global scheduler
+    if os.getenv("PRECOMPUTE_SCHEDULER", "1") == "0":
+        return
+    scheduler = PrecomputeScheduler.from_env()
+    await scheduler.start()
+
+
+async def stop_scheduler():
+    global scheduler
+    if scheduler is not None:
+        await scheduler.stop()
+        scheduler = None
+
+
+# =========================
+# CLI（アプリとは別プロセスで動かす場合）
+# =========================
+async def _main(args):
+    s = PrecomputeScheduler(max_parallel=args.parallel, nightly_at=args.at,
+                            active_days=args.active_days, sweep_seconds=args.sweep_seconds,
+                            poll_seconds=args.poll_seconds)
+    await s.start()
+    try:
+        if args.once:
+            n = await (s.enqueue_active("manual") if args.all_active else s.enqueue_stale("manual"))
+            await s.drain()
+            print(f"✅ {n}人分を処理しました: {s.snapshot()}")
+        else:
+            await asyncio.Event().wait()
+    finally:
+        await s.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--once", action="store_true", help="今すぐ1回だけ実行して終了する")
+    parser.add_argument("--all-active", action="store_true", help="--once 時に古いキャッシュだけでなくアクティブ全員を対象にする")
+    parser.add_argument("--parallel", type=int, default=int(os.getenv("PRECOMPUTE_MAX_PARALLEL", "2")))
+    parser.add_argument("--at", default=os.getenv("PRECOMPUTE_AT", "03:00"))
+    parser.add_argument("--active-days", type=int, default=int(os.getenv("PRECOMPUTE_ACTIVE_DAYS", "30")))
+    parser.add_argument("--sweep-seconds", type=float, default=float(os.getenv("PRECOMPUTE_SWEEP_SECONDS", "300")))
+    parser.add_argument("--poll-seconds", type=float, default=float(os.getenv("PRECOMPUTE_POLL_SECONDS", "5")))
+    args = parser.parse_args(argv)
+    Base.metadata.create_all(bind=engine)
+    asyncio.run(_main(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+"""
+AIトレーナーに渡すユーザーごとのトレーニング要約（コンテキスト）のキャッシュ。
+
+ユーザーごとに TrainingDigest を保持し、前回読み込んだ最大IDより新しい記録だけを
+差分で取り込みます。チャット1回あたりの DB アクセスはユーザーの記録件数と
+`WHERE user_id = ? AND id > ?` の2クエリだけで、履歴全体の再集計は行いません。
+
+記録は Streamlit 側から書かれるので、このプロセスには変更の通知が来ません。
+- 削除・CSV復元などで「取り込み済みの件数 + 新しい行数」が DB の件数と合わなくなったら作り直す
+- 種目名の付け替えなど件数もIDも変わらない更新は、ttl 秒ごとに作り直して反映する
+"""
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import func
+
+from models import TrainingRecord
+
+# (id, date, body_part, exercise, weight, reps, volume)
+Row = Tuple[int, date, str, str, float, int, float]
+
+
+def epley_1rm(weight: float, reps: int) -> float:
+    return weight * (1 + reps / 30)
+
+
+def estimate_tokens(text: str) -> int:
+    """ざっくりしたトークン数の見積もり（英数字は4文字で1、日本語は1文字で1）。"""
+    ascii_chars = sum(1 for c in text if ord(c) < 128)
+    return (ascii_chars + 3) // 4 + (len(text) - ascii_chars)
+
+
+def _week_start(d: date) -> date:
+    return d - timedelta(days=d.weekday())
+
+
+class TrainingDigest:
+    """1ユーザー分の要約。add() で1セットずつ取り込み、サイズは期間で上限が決まる。"""
+
+    def __init__(self, weeks: int = 8, trend_days: int = 56, built_at: float = 0.0):
+        self.weeks = weeks
+        self.trend_days = trend_days
+        self.built_at = built_at
+        self.last_id = 0
+        self.total_sets = 0
+        self.last_date: Optional[date] = None
+        # 種目 -> (最大重量, 回数, 日付) / (最大推定1RM, 日付)
+        self.weight_prs: Dict[str, Tuple[float, int, date]] = {}
+        self.e1rm_prs: Dict[str, Tuple[float, date]] = {}
+        # 週の開始日 -> 部位 -> ボリューム
+        self.weekly_volume: Dict[date, Dict[str, float]] = {}
+        # 種目 -> 日付 -> その日の最大推定1RM（トレンド計算用）
+        self.daily_e1rm: Dict[str, Dict[date, float]] = {}
+
+    def add(self, row: Row):
+        rec_id, d, part, exercise, weight, reps, volume = row
+        self.last_id = max(self.last_id, rec_id)
+        self.total_sets += 1
+        if self.last_date is None or d > self.last_date:
+            self.last_date = d
+
+        best = self.weight_prs.get(exercise)
+        if best is None or weight > best[0]:
+            self.weight_prs[exercise] = (weight, reps, d)
+
+        e1rm = epley_1rm(weight, reps)
+        best_e1rm = self.e1rm_prs.get(exercise)
+        if best_e1rm is None or e1rm > best_e1rm[0]:
+            self.e1rm_prs[exercise] = (e1rm, d)
+
+        week = self.weekly_volume.setdefault(_week_start(d), {})
+        week[part] = week.get(part, 0.0) + (volume if volume is not None else weight * reps)
+
+        days = self.daily_e1rm.setdefault(exercise, {})
+        if e1rm > days.get(d, 0.0):
+            days[d] = e1rm
+
+    def prune(self):
+        """保持期間より古い週次・日次データを捨てる。"""
+        if self.last_date is None:
+            return
+        oldest_week = _week_start(self.last_date) - timedelta(weeks=self.weeks - 1)
+        for week in [w for w in self.weekly_volume if w < oldest_week]:
+            del self.weekly_volume[week]
+        oldest_day = self.last_date - timedelta(days=self.trend_days)
+        for exercise, days in list(self.daily_e1rm.items()):
+            for d in [d for d in days if d < oldest_day]:
+                del days[d]
+            if not days:
+                del self.daily_e1rm[exercise]
+
+    def trend_slopes(self) -> Dict[str, float]:
+        """種目ごとの推定1RMの傾き（kg/週）。実際の経過日数で回帰する。"""
+        slopes = {}
+        for exercise, days in self.daily_e1rm.items():
+            if len(days) < 3:
+                continue
+            xs = [(d - self.last_date).days for d in days]
+            ys = list(days.values())
+            n = len(xs)
+            mx, my = sum(xs) / n, sum(ys) / n
+            sxx = sum((x - mx) ** 2 for x in xs)
+            if sxx == 0:
+                continue
+            sxy = sum((x - mx) * (y - my) for x, y in zip(xs, ys))
+            slopes[exercise] = sxy / sxx * 7
+        return slopes
+
+    def render(self, max_tokens: int = 400) -> str:
+        """優先度の高い行から順に、max_tokens に収まるところまで要約文を組み立てる。"""
+        if self.last_date is None:
+            return ""
+
+        lines = [f"最終トレーニング日: {self.last_date}（累計 {self.total_sets} セット）"]
+
+        for week in sorted(self.weekly_volume, reverse=True)[:4]:
+            parts = self.weekly_volume[week]
+            detail = "、".join(f"{p} {v:,.0f}kg" for p, v in sorted(parts.items(), key=lambda kv: -kv[1]))
+            lines.append(f"{week}週のボリューム: {detail}")
+
+        for exercise, slope in sorted(self.trend_slopes().items(), key=lambda kv: -abs(kv[1])):
+            lines.append(f"{exercise} 推定1RMの傾向: {slope:+.1f}kg/週")
+
+        recent_prs = sorted(self.weight_prs.items(), key=lambda kv: kv[1][2], reverse=True)
+        for exercise, (weight, reps, d) in recent_prs:
+            e1rm = self.e1rm_prs[exercise][0]
+            lines.append(f"{exercise} PR: {weight:g}kg×{reps}回（{d}）推定1RM {e1rm:.1f}kg")
+
+        out, used = [], 0
+        for line in lines:
+            cost = estimate_tokens(line) + 1
+            if used + cost > max_tokens:
+                break
+            out.append(line)
+            used += cost
+        return "\n".join(out)
+
+
+class TrainerContextCache:
+    """ユーザーID -> TrainingDigest の LRU キャッシュ。要約は作ってから ttl 秒で作り直す。"""
+
+    def __init__(self, max_users: int = 1024, weeks: int = 8, trend_days: int = 56,
+                 ttl: float = 300.0, clock=time.monotonic):
+        self.max_users = max_users
+        self.weeks = weeks
+        self.trend_days = trend_days
+        self.ttl = ttl
+        self.clock = clock
+        self._digests: "OrderedDict[int, TrainingDigest]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, user_id: int) -> TrainingDigest:
+        digest = self._digests.get(user_id)
+        if digest is not None and self.clock() - digest.built_at > self.ttl:
+            del self._digests[user_id]
+            digest = None
+        if digest is None:
+            digest = TrainingDigest(self.weeks, self.trend_days, built_at=self.clock())
+            self._digests[user_id] = digest
+            while len(self._digests) > self.max_users:
+                self._digests.popitem(last=False)
+        else:
+            self._digests.move_to_end(user_id)
+        return digest
+
+    def apply_records(self, user_id: int, rows: Iterable[Row]):
+        """新しい記録を取り込む（同一プロセスで保存した直後などに呼ぶ）。"""
+        with self._lock:
+            digest = self._get(user_id)
+            for row in rows:
+                if row[0] > digest.last_id:
+                    digest.add(row)
+            digest.prune()
+
+    def invalidate(self, user_id: Optional[int] = None):
+        with self._lock:
+            if user_id is None:
+                self._digests.clear()
+            else:
+                self._digests.pop(user_id, None)
+
+    def count_rows(self, db, user_id: int) -> int:
+        return db.query(func.count(TrainingRecord.id)).filter(TrainingRecord.user_id == user_id).scalar()
+
+    def fetch_new_rows(self, db, user_id: int, last_id: int) -> List[Row]:
+        return db.query(
+            TrainingRecord.id, TrainingRecord.date, TrainingRecord.body_part, TrainingRecord.exercise,
+            TrainingRecord.weight, TrainingRecord.reps, TrainingRecord.volume,
+        ).filter(
+            TrainingRecord.user_id == user_id, TrainingRecord.id > last_id
+        ).order_by(TrainingRecord.id).all()
+
+    def build_context(self, db, user_id: int, max_tokens: int = 400) -> str:
+        """差分だけを DB から取り込み、トークン上限内の要約文を返す。"""
+        with self._lock:
+            digest = self._get(user_id)
+            last_id, seen = digest.last_id, digest.total_sets
+        count = self.count_rows(db, user_id)
+        rows = self.fetch_new_rows(db, user_id, last_id)
+        if seen + len(rows) != count:
+            # 取り込み済みの記録が削除・差し替えされている（件数が合わない）ので全件から作り直す
+            self.invalidate(user_id)
+            rows = self.fetch_new_rows(db, user_id, 0)
+        if rows:
+            self.apply_records(user_id, rows)
+        with self._lock:
+            return self._get(user_id).render(max_tokens)
+
+
+context_cache = TrainerContextCache()
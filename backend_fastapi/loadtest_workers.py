@@ -0,0 +1,102 @@
+"""
+ワーカー数ごとのスループット計測スクリプト。
+
+run_server.py を prod モードで 1, 2, 4 ... ワーカーと起動し直し、
+httpx の非同期クライアントで一定時間リクエストを投げ続けて req/s を比較します。
+
+    python loadtest_workers.py --workers 1 2 4 --duration 10 --concurrency 64
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import httpx
+
+BASE_DIR = Path(__file__).resolve().parent
+
+
+def wait_until_ready(url: str, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url, timeout=1.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"サーバーが起動しませんでした: {url}")
+
+
+async def hammer(url: str, duration: float, concurrency: int):
+    """duration 秒間 concurrency 本の並列ループでリクエストを送り、(成功数, 失敗数, レイテンシ一覧) を返す。"""
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    ok, failed, latencies = 0, 0, []
+    deadline = time.monotonic() + duration
+
+    async with httpx.AsyncClient(limits=limits, timeout=10.0) as client:
+        async def worker():
+            nonlocal ok, failed
+            while time.monotonic() < deadline:
+                start = time.perf_counter()
+                try:
+                    res = await client.get(url)
+                    if res.status_code == 200:
+                        ok += 1
+                    else:
+                        failed += 1
+                except httpx.HTTPError:
+                    failed += 1
+                latencies.append(time.perf_counter() - start)
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return ok, failed, latencies
+
+
+def run_one(workers: int, args):
+    env = dict(os.environ, SERVER_MODE="prod")
+    cmd = [
+        sys.executable, str(BASE_DIR / "run_server.py"),
+        "--mode", "prod", "--host", "127.0.0.1", "--port", str(args.port),
+        "--workers", str(workers), "--server", args.server,
+    ]
+    proc = subprocess.Popen(cmd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{args.port}{args.path}"
+    try:
+        wait_until_ready(url)
+        asyncio.run(hammer(url, 1.0, args.concurrency))  # ウォームアップ
+        ok, failed, latencies = asyncio.run(hammer(url, args.duration, args.concurrency))
+    finally:
+        proc.terminate()
+        proc.wait(timeout=args.duration + 30)
+
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] * 1000 if latencies else 0.0
+    p99 = latencies[int(len(latencies) * 0.99) - 1] * 1000 if latencies else 0.0
+    return {"workers": workers, "rps": ok / args.duration, "failed": failed, "p50_ms": p50, "p99_ms": p99}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--path", default="/")
+    parser.add_argument("--server", choices=["auto", "uvicorn", "gunicorn"], default="auto")
+    args = parser.parse_args(argv)
+
+    print(f"{'workers':>8} {'req/s':>10} {'x1':>6} {'p50(ms)':>9} {'p99(ms)':>9} {'failed':>7}")
+    baseline = None
+    for w in args.workers:
+        r = run_one(w, args)
+        baseline = baseline or r["rps"] or 1.0
+        print(f"{r['workers']:>8} {r['rps']:>10.1f} {r['rps'] / baseline:>6.2f} "
+              f"{r['p50_ms']:>9.2f} {r['p99_ms']:>9.2f} {r['failed']:>7}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,194 @@
-import uvicorn
+import argparse
+import importlib.util
+import os
+import subprocess
 import sys
 from pathlib import Path
 
+import uvicorn
+
 # ======== 重要: appディレクトリを絶対パスで追加 ========
 APP_DIR = Path(__file__).resolve().parent / "app"
 sys.path.insert(0, str(APP_DIR))
+# フロントエンドと共有するパッケージ（kintore_common）はリポジトリ直下
+ROOT_DIR = APP_DIR.parents[1]
+sys.path.insert(1, str(ROOT_DIR))
 
-if __name__ == "__main__":
+
+# =========================
+# 起動設定（環境変数 → CLI引数の順で上書き）
+# =========================
+def _has_module(name: str) -> bool:
+    return importlib.util.find_spec(name) is not None
+
+
+def default_workers() -> int:
+    """本番モードのワーカー数。WEB_CONCURRENCY があればそれを優先、なければ CPU コア数。"""
+    env = os.getenv("WEB_CONCURRENCY")
+    if env:
+        return max(1, int(env))
+    return max(1, os.cpu_count() or 1)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="筋トレ成果トラッカーAPI 起動スクリプト")
+    parser.add_argument("--mode", choices=["dev", "prod"], default=os.getenv("SERVER_MODE", "dev"),
+                        help="dev: 単一プロセス＋リロード / prod: マルチワーカー")
+    parser.add_argument("--host", default=os.getenv("HOST"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=None, help="prodモードのワーカー数（既定: WEB_CONCURRENCY または CPU数）")
+    parser.add_argument("--server", choices=["auto", "uvicorn", "gunicorn"], default=os.getenv("SERVER_BACKEND", "auto"),
+                        help="prodモードのプロセスマネージャ（auto: gunicorn があれば使用）")
+    parser.add_argument("--loop", choices=["auto", "asyncio", "uvloop"], default=os.getenv("UVICORN_LOOP", "auto"))
+    parser.add_argument("--http", choices=["auto", "h11", "httptools"], default=os.getenv("UVICORN_HTTP", "auto"))
+    parser.add_argument("--keep-alive", type=int, default=int(os.getenv("KEEP_ALIVE", "5")),
+                        help="Keep-Alive タイムアウト（秒）")
+    parser.add_argument("--graceful-timeout", type=int, default=int(os.getenv("GRACEFUL_TIMEOUT", "30")),
+                        help="シャットダウン時に処理中リクエストを待つ秒数")
+    parser.add_argument("--backlog", type=int, default=int(os.getenv("BACKLOG", "2048")))
+    args = parser.parse_args(argv)
+
+    if args.host is None:
+        args.host = "0.0.0.0" if args.mode == "prod" else "127.0.0.1"
+    if args.workers is None:
+        args.workers = default_workers() if args.mode == "prod" else 1
+    # auto の場合は uvloop / httptools が入っていれば使う
+    if args.loop == "auto":
+        args.loop = "uvloop" if _has_module("uvloop") else "asyncio"
+    if args.http == "auto":
+        args.http = "httptools" if _has_module("httptools") else "h11"
+    if args.server == "auto":
+        args.server = "gunicorn" if _has_module("gunicorn") and os.name != "nt" else "uvicorn"
+    return args
+
+
+# =========================
+# 開発モード
+# =========================
+def run_dev(args):
     uvicorn.run(
         "main:app",
-        host="127.0.0.1",
-        port=8000,
+        host=args.host,
+        port=args.port,
         reload=True,
         reload_dirs=[str(APP_DIR)]  # この行も重要
     )
+
+
+# =========================
+# 本番モード（uvicorn --workers）
+# =========================
+def run_uvicorn_workers(args):
+    uvicorn.run(
+        "main:app",
+        app_dir=str(APP_DIR),
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        loop=args.loop,
+        http=args.http,
+        timeout_keep_alive=args.keep_alive,
+        timeout_graceful_shutdown=args.graceful_timeout,
+        backlog=args.backlog,
+        access_log=False,
+        proxy_headers=True,
+    )
+
+
+# =========================
+# 本番モード（gunicorn + UvicornWorker）
+# =========================
+def post_fork(server, worker):
+    """
+    fork 直後のワーカーで、マスター（preload_app）から引き継いだ DB 接続プールを捨てる。
+    マスターで main を import した時点（create_all）で接続がプールに入っており、そのままだと
+    全ワーカーが同じソケットを共有してしまう。close=False なので親の接続は閉じずに手放すだけ。
+    """
+    import database
+    database.engine.dispose(close=False)
+    database.async_engine.sync_engine.dispose(close=False)
+
+
+def gunicorn_options(args) -> dict:
+    worker_class = "uvicorn.workers.UvicornWorker"
+    if args.loop == "asyncio" or args.http == "h11":
+        # uvloop/httptools が無い環境では H11 ワーカーを使う
+        worker_class = "uvicorn.workers.UvicornH11Worker"
+
+    options = {
+        "bind": f"{args.host}:{args.port}",
+        "workers": args.workers,
+        "worker_class": worker_class,
+        "keepalive": args.keep_alive,
+        "graceful_timeout": args.graceful_timeout,
+        "timeout": max(60, args.graceful_timeout * 2),
+        "backlog": args.backlog,
+        # マスターで main を先に import し、読み込み済みの共有状態を fork 後のワーカーと共有する
+        # （DB 接続だけは共有できないので post_fork で捨てる）
+        "preload_app": True,
+        "chdir": str(APP_DIR),
+        "post_fork": post_fork,
+    }
+    return options
+
+
+def run_gunicorn(args):
+    from gunicorn.app.base import BaseApplication
+
+    options = gunicorn_options(args)
+
+    class TrainingAPIServer(BaseApplication):
+        def load_config(self):
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            from main import app
+            return app
+
+    TrainingAPIServer().run()
+
+
+# =========================
+# 事前計算スケジューラ（マルチワーカー時は別プロセスで1つだけ）
+# =========================
+def start_precompute_sidecar(args):
+    """
+    ワーカーが複数なら各ワーカー内のスケジューラを止め（PRECOMPUTE_SCHEDULER=0 はワーカーに引き継がれる）、
+    代わりに precompute.py を1プロセスだけ起動する。PRECOMPUTE_SCHEDULER=0 なら何もしない。
+    ワーカーは PRECOMPUTE_SIDECAR=1 を見て、実行の依頼を precompute_requests テーブル経由で渡す。
+    """
+    if args.workers <= 1 or os.getenv("PRECOMPUTE_SCHEDULER", "1") == "0":
+        return None
+    os.environ["PRECOMPUTE_SCHEDULER"] = "0"
+    os.environ["PRECOMPUTE_SIDECAR"] = "1"
+    return subprocess.Popen([sys.executable, str(APP_DIR / "precompute.py")], cwd=str(APP_DIR))
+
+
+def stop_precompute_sidecar(proc):
+    if proc is None or proc.poll() is not None:
+        return
+    proc.terminate()
+    try:
+        proc.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.mode == "dev":
+        run_dev(args)
+        return
+    sidecar = start_precompute_sidecar(args)
+    try:
+        if args.server == "gunicorn":
+            run_gunicorn(args)
+        else:
+            run_uvicorn_workers(args)
+    finally:
+        stop_precompute_sidecar(sidecar)
+
+
+if __name__ == "__main__":
+    main()
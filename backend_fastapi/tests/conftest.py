@@ -0,0 +1,14 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# database.py は import 時に DATABASE_URL からエンジンを作るので、アプリを import する前に設定する
+_TMP = tempfile.mkdtemp(prefix="kintore-test-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_TMP}/test.db")
+os.environ.setdefault("PRECOMPUTE_SCHEDULER", "0")
+
+APP_DIR = Path(__file__).resolve().parents[1] / "app"
+sys.path.insert(0, str(APP_DIR))
+sys.path.insert(1, str(APP_DIR.parents[1]))
+sys.path.insert(2, str(APP_DIR.parent))  # run_server.py
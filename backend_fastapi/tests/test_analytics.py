@@ -0,0 +1,55 @@
+from datetime import date, timedelta
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import analytics
+import cohort_analytics
+from database import Base, SessionLocal, engine
+from models import (
+    AnalyticsCohortAdherence,
+    AnalyticsCohortBodyPart,
+    AnalyticsUserState,
+    TrainingRecord,
+)
+
+
+@pytest.fixture
+def client():
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    for uid, weight in [(1, 60.0), (2, 80.0)]:
+        for week in range(3):
+            db.add(TrainingRecord(user_id=uid, date=date(2026, 1, 5) + timedelta(weeks=week), body_part="胸",
+                                  exercise="ベンチプレス", weight=weight + week, reps=5, volume=(weight + week) * 5))
+    db.commit()
+    cohort_analytics.run(workers=1)
+    app = FastAPI()
+    app.include_router(analytics.router)
+    # エンドポイントは database.get_async_db（sqlite+aiosqlite の非同期エンジン）で同じDBを読む
+    with TestClient(app) as c:
+        yield c
+    for table in (TrainingRecord, AnalyticsUserState, AnalyticsCohortBodyPart, AnalyticsCohortAdherence) \
+            + cohort_analytics.USER_TABLES:
+        db.query(table).delete()
+    db.commit()
+    db.close()
+
+
+def test_cohort_summary_reads_through_aiosqlite(client):
+    body = client.get("/analytics/cohort").json()
+    # 週平均ボリューム: ユーザー1 = 915kg / 3週, ユーザー2 = 1215kg / 3週
+    assert body["body_parts"] == [{"body_part": "胸", "avg_weekly_volume": 355.0,
+                                   "median_weekly_volume": 355.0, "users": 2}]
+    assert [a["quantile"] for a in body["adherence"]] == list(cohort_analytics.ADHERENCE_QUANTILES)
+
+
+def test_user_summary(client):
+    body = client.get("/analytics/users/2").json()
+    assert body["user_id"] == 2
+    assert body["exercises"] == [{"exercise": "ベンチプレス", "best_weight": 82.0, "best_e1rm": pytest.approx(82 * 7 / 6),
+                                  "sets": 3, "percentile": 100.0}]
+    assert body["body_parts"] == [{"body_part": "胸", "avg_weekly_volume": 405.0, "cohort_avg_weekly_volume": 355.0}]
+    assert body["adherence"]["last_date"] == "2026-01-19"
+    assert client.get("/analytics/users/99").status_code == 404
@@ -0,0 +1,78 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import chat
+from chat_models import LocalTrainerModel
+from chat_scheduler import ChatScheduler
+from kintore_common import user_token
+
+
+def _auth(user_id):
+    return {"Authorization": f"Bearer {user_token.sign(user_id)}"}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setenv(user_token.SECRET_ENV, "test-secret")
+    loads = []
+
+    def fake_context(user_id):
+        loads.append(user_id)
+        return f"user {user_id}"
+
+    monkeypatch.setattr(chat, "_load_context", fake_context)
+    app = FastAPI()
+    app.include_router(chat.router)
+
+    def make(**kw):
+        scheduler = ChatScheduler(lambda: LocalTrainerModel(), **kw)
+        monkeypatch.setattr(chat, "scheduler", scheduler)
+        return TestClient(app), scheduler, loads
+
+    return make
+
+
+def test_streams_ndjson_with_local_model(client):
+    c, _, loads = client()
+    res = c.post("/chat", json={"message": "ベンチプレス"},
+                 headers=_auth(7))
+    lines = [line for line in res.text.splitlines() if line]
+    assert res.headers["content-type"].startswith("application/x-ndjson")
+    assert lines[-1].startswith('{"done": true')
+    assert "user 7" in lines[-1]
+    assert loads == [7]
+
+
+def test_rate_limit_is_checked_before_loading_context(client):
+    c, scheduler, loads = client(rate_per_min=0.001, burst=1)
+    assert c.post("/chat", json={"message": "a", "stream": False}, headers=_auth(1)).status_code == 200
+    # ユーザーを変えても同じ接続元なので制限される
+    res = c.post("/chat", json={"message": "a", "stream": False}, headers=_auth(2))
+    assert res.status_code == 429
+    assert "Retry-After" in res.headers
+    assert loads == [1]
+    assert scheduler.stats["rejected_rate_limited"] == 1
+
+
+def test_queue_full_does_not_load_context_or_spend_tokens(client):
+    c, scheduler, loads = client(max_queue=0, rate_per_min=0.001, burst=1)
+    for _ in range(3):
+        assert c.post("/chat", json={"message": "a"}, headers=_auth(1)).status_code == 503
+    assert loads == []
+    assert scheduler.stats["rejected_rate_limited"] == 0
+    assert scheduler._bucket("ip:testclient").tokens == 1
+
+
+def test_context_comes_from_signed_token_not_request_body(client):
+    c, _, loads = client()
+    # 本文の user_id だけでは他人の要約は読めない
+    res = c.post("/chat", json={"message": "a", "user_id": 7, "stream": False})
+    assert res.status_code == 200
+    forged = user_token.sign(7, secret="other-secret")
+    c.post("/chat", json={"message": "a", "stream": False}, headers={"Authorization": f"Bearer {forged}"})
+    assert loads == []
+
+    res = c.post("/chat", json={"message": "a", "user_id": 8, "stream": False}, headers=_auth(7))
+    assert "user 7" in res.json()["reply"]
+    assert loads == [7]
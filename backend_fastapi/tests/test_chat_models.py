@@ -0,0 +1,58 @@
+import asyncio
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import chat
+from chat_models import ChatModel, LocalTrainerModel
+from chat_scheduler import ChatScheduler
+
+
+def _collect(agen):
+    async def run():
+        return [item async for item in agen]
+    return asyncio.run(run())
+
+
+def test_chat_model_is_abstract():
+    with pytest.raises(TypeError):
+        ChatModel()
+
+
+def test_local_model_is_deterministic():
+    model = LocalTrainerModel()
+    first = asyncio.run(model.complete("ベンチプレスを伸ばしたい"))
+    assert first == asyncio.run(model.complete("ベンチプレスを伸ばしたい"))
+    assert first.startswith("ベンチプレスは週2回")
+    assert "".join(_collect(model.stream("ベンチプレスを伸ばしたい"))) == first
+
+
+def test_local_model_prepends_first_context_line():
+    reply = asyncio.run(LocalTrainerModel().complete("こんにちは", context="直近4週: 12回\n詳細"))
+    assert reply.splitlines()[0] == "直近4週: 12回"
+
+
+def test_stream_batch_matches_individual_streams():
+    model = LocalTrainerModel()
+    requests = [("スクワット", None, ""), ("デッドリフト", None, ""), ("hello", None, "")]
+    out = {i: "" for i in range(len(requests))}
+    for i, token in _collect(model.stream_batch(requests)):
+        out[i] += token
+    assert [out[i] for i in range(len(requests))] == [model.reply_for(m, c) for m, _, c in requests]
+
+
+class FailingModel(ChatModel):
+    async def stream(self, message, history=None, context=""):
+        yield "途中まで"
+        raise RuntimeError("secret connection string")
+
+
+def test_stream_error_is_not_leaked_to_client(monkeypatch):
+    monkeypatch.setattr(chat, "scheduler", ChatScheduler(lambda: FailingModel()))
+    app = FastAPI()
+    app.include_router(chat.router)
+    res = TestClient(app).post("/chat", json={"message": "hi"})
+    assert res.status_code == 200
+    assert "secret" not in res.text
+    assert '"error"' in res.text.splitlines()[-1]
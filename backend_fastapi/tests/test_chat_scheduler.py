@@ -0,0 +1,93 @@
+import asyncio
+
+from chat_models import ChatModel
+from chat_scheduler import ChatScheduler
+
+
+class FakeLatencyModel(ChatModel):
+    """1回の呼び出しに latency 秒かかるモデル。受け取ったバッチと同時実行数を記録する。"""
+
+    def __init__(self, latency=0.05):
+        self.latency = latency
+        self.batches = []
+        self.active = 0
+        self.max_active = 0
+
+    async def stream(self, message, history=None, context=""):
+        yield message
+
+    async def stream_batch(self, requests):
+        self.batches.append([message for message, _, _ in requests])
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(self.latency)
+            for i, (message, _, _) in enumerate(requests):
+                yield i, message
+        finally:
+            self.active -= 1
+
+
+async def _reply(job):
+    return "".join([token async for token in job.tokens()])
+
+
+def _run(scheduler, messages, gap=0.0):
+    async def main():
+        jobs = []
+        for i, message in enumerate(messages):
+            jobs.append(scheduler.submit(f"ip:{i}", message))
+            if gap:
+                await asyncio.sleep(gap)
+        return await asyncio.gather(*[_reply(job) for job in jobs])
+    return asyncio.run(main())
+
+
+def test_batches_are_capped_at_max_batch_size():
+    model = FakeLatencyModel()
+    scheduler = ChatScheduler(lambda: model, max_batch_size=4, max_wait=0.05, max_concurrency=8)
+    messages = [f"m{i}" for i in range(10)]
+    assert _run(scheduler, messages) == messages
+    assert [len(b) for b in model.batches] == [4, 4, 2]
+    assert scheduler.stats["completed"] == 10
+
+
+def test_partial_batch_is_flushed_after_max_wait():
+    model = FakeLatencyModel(latency=0.0)
+    scheduler = ChatScheduler(lambda: model, max_batch_size=8, max_wait=0.01, max_concurrency=8)
+    # 投入間隔が max_wait より長いので、満杯を待たずに1件ずつ流れる
+    assert _run(scheduler, ["a", "b", "c"], gap=0.05) == ["a", "b", "c"]
+    assert model.batches == [["a"], ["b"], ["c"]]
+
+
+def test_in_flight_batches_never_exceed_slots():
+    model = FakeLatencyModel(latency=0.03)
+    scheduler = ChatScheduler(lambda: model, max_batch_size=1, max_wait=0.0, max_concurrency=2)
+    assert len(_run(scheduler, [f"m{i}" for i in range(8)])) == 8
+    assert model.max_active == 2
+    assert len(model.batches) == 8
+
+
+def test_queue_depth_counts_batch_waiting_for_a_slot():
+    model = FakeLatencyModel(latency=0.1)
+    scheduler = ChatScheduler(lambda: model, max_batch_size=1, max_wait=0.0, max_concurrency=1, max_queue=2)
+
+    async def main():
+        jobs = [scheduler.submit("ip:a", "m0"), scheduler.submit("ip:b", "m1")]
+        await asyncio.sleep(0.03)
+        # m0 は実行中、m1 は待ち行列から取り出されて実行枠の空き待ち
+        depth = scheduler.queue_depth()
+        await asyncio.gather(*[_reply(job) for job in jobs])
+        return depth
+
+    assert asyncio.run(main()) == 1
+    assert scheduler.queue_depth() == 0
+
+
+def test_buckets_are_evicted_least_recently_used_first():
+    scheduler = ChatScheduler(lambda: FakeLatencyModel(), rate_per_min=1, burst=5, max_buckets=3)
+    for key in ["a", "b", "c"]:
+        scheduler._bucket(key).try_acquire()  # 満タンではないので使用中扱い
+    scheduler._bucket("a")
+    scheduler._bucket("d")
+    assert list(scheduler._buckets) == ["c", "a", "d"]
@@ -0,0 +1,102 @@
+from datetime import date, timedelta
+from pathlib import Path
+
+import pytest
+
+import cohort_analytics
+from cohort_analytics import USER_TABLES, run
+from database import DATABASE_URL, DEFAULT_SQLITE_PATH, Base, SessionLocal, engine
+from models import (
+    AnalyticsCohortAdherence,
+    AnalyticsCohortBodyPart,
+    AnalyticsUserExercise,
+    AnalyticsUserState,
+    TrainingRecord,
+)
+
+START = date(2026, 1, 5)
+
+
+@pytest.fixture
+def db():
+    Base.metadata.create_all(bind=engine)
+    session = SessionLocal()
+    yield session
+    for table in (TrainingRecord, AnalyticsUserState, AnalyticsCohortBodyPart, AnalyticsCohortAdherence) + USER_TABLES:
+        session.query(table).delete()
+    session.commit()
+    session.close()
+
+
+def _add(db, user_id, weight, day=0, exercise="ベンチプレス", part="胸"):
+    db.add(TrainingRecord(user_id=user_id, date=START + timedelta(days=day), body_part=part, exercise=exercise,
+                          weight=weight, reps=5, volume=weight * 5))
+    db.commit()
+
+
+def _snapshot(db):
+    rows = db.query(AnalyticsUserExercise).order_by(AnalyticsUserExercise.user_id, AnalyticsUserExercise.exercise)
+    return [(r.user_id, r.exercise, r.best_weight, r.sets, r.percentile) for r in rows]
+
+
+def _seed(db, users=6):
+    for uid in range(1, users + 1):
+        for week in range(4):
+            _add(db, uid, 50.0 + uid * 5 + week, day=week * 7)
+            _add(db, uid, 80.0 + uid * 10, day=week * 7 + 2, exercise="スクワット", part="脚")
+
+
+def test_chunked_multiprocess_run_matches_single_process(db):
+    _seed(db)
+    parallel = run(full=True, workers=2, chunk_size=2, database_url=DATABASE_URL)
+    assert parallel["changed_users"] == 6
+    assert parallel["chunks"] == 3
+    expected = _snapshot(db)
+    single = run(full=True, workers=1, chunk_size=500, database_url=DATABASE_URL)
+    assert single["chunks"] == 1
+    assert _snapshot(db) == expected
+    assert len(expected) == 12
+
+
+def test_only_changed_users_are_recomputed(db):
+    _seed(db, users=3)
+    assert run(workers=1)["changed_users"] == 3
+    assert run(workers=1)["changed_users"] == 0
+
+    _add(db, 2, 200.0, day=30)
+    result = run(workers=1)
+    assert (result["changed_users"], result["removed_users"]) == (1, 0)
+    assert db.get(AnalyticsUserState, 2).record_count == 9
+
+    # 件数が同じでも最大IDが変われば（削除して追加）再集計する
+    db.query(TrainingRecord).filter_by(user_id=3, weight=65.0).delete()
+    db.commit()
+    _add(db, 3, 66.0, day=7)
+    assert run(workers=1)["changed_users"] == 1
+
+    db.query(TrainingRecord).filter_by(user_id=1).delete()
+    db.commit()
+    result = run(workers=1)
+    assert (result["changed_users"], result["removed_users"]) == (0, 1)
+    assert db.query(AnalyticsUserExercise).filter_by(user_id=1).count() == 0
+
+
+def test_percentiles_are_refreshed_for_unchanged_users(db):
+    for uid, weight in [(1, 60.0), (2, 80.0), (3, 100.0), (4, 120.0)]:
+        _add(db, uid, weight)
+    run(workers=1)
+    before = {r[0]: r[4] for r in _snapshot(db)}
+    assert before == {1: 25.0, 2: 50.0, 3: 75.0, 4: 100.0}
+
+    # ユーザー1だけが記録を伸ばしても、ほかのユーザーの順位も更新される
+    _add(db, 1, 130.0, day=7)
+    result = run(workers=1)
+    assert result["changed_users"] == 1
+    assert result["percentile_updates"] == 4
+    assert {r[0]: r[4] for r in _snapshot(db)} == {1: 100.0, 2: 25.0, 3: 50.0, 4: 75.0}
+    assert db.query(AnalyticsCohortBodyPart).filter_by(body_part="胸").one().users == 4
+
+
+def test_default_sqlite_path_does_not_depend_on_cwd():
+    # backend_fastapi/kintore.db（README どおり backend_fastapi で起動したときと同じ場所）
+    assert DEFAULT_SQLITE_PATH == Path(cohort_analytics.__file__).resolve().parents[1] / "kintore.db"
@@ -0,0 +1,26 @@
+from kintore_common.csv_import import DEFAULT_BODY_PART, SchemaCache, import_training_csv
+
+CSV = (
+    "日付,部位,種目,重量(kg),回数\n"
+    "2024-01-01,胸,ベンチプレス,60,10\n"
+    "2024-01-02,,スクワット,80,5\n"
+    "2024-01-03,その他,ファーマーズウォーク,40,1\n"
+).encode("utf-8")
+
+
+def test_blank_body_part_gets_default(tmp_path):
+    df, _, _ = import_training_csv(CSV, cache=SchemaCache(tmp_path / "cache.json"))
+    assert list(df["部位"]) == ["胸", DEFAULT_BODY_PART, "その他"]
+
+
+def test_blank_body_part_left_blank_without_default(tmp_path):
+    df, _, _ = import_training_csv(CSV, cache=SchemaCache(tmp_path / "cache.json"), default_body_part=None)
+    # 空欄だけが None になり、CSV に書かれた「その他」はそのまま残る
+    assert list(df["部位"]) == ["胸", None, "その他"]
+
+
+def test_missing_body_part_column(tmp_path):
+    csv = "date,exercise,weight,reps\n2024-01-01,Bench Press,60,10\n".encode("utf-8")
+    cache = SchemaCache(tmp_path / "cache.json")
+    assert list(import_training_csv(csv, cache=cache)[0]["部位"]) == [DEFAULT_BODY_PART]
+    assert list(import_training_csv(csv, cache=cache, default_body_part=None)[0]["部位"]) == [None]
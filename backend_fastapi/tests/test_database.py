@@ -0,0 +1,51 @@
+import pytest
+
+import database
+from database import async_url
+
+
+@pytest.mark.parametrize("url", [
+    "postgresql://u:p@db:5432/kintore",
+    "postgres://u:p@db:5432/kintore",
+    "postgresql+psycopg2://u:p@db:5432/kintore",
+])
+def test_postgres_maps_to_asyncpg_with_statement_cache(url):
+    u = async_url(url)
+    assert u.drivername == "postgresql+asyncpg"
+    assert (u.host, u.port, u.database, u.username) == ("db", 5432, "kintore", "u")
+    assert u.query == {"prepared_statement_cache_size": str(database.DB_STATEMENT_CACHE_SIZE)}
+
+
+def test_postgres_keeps_existing_query_parameters():
+    u = async_url("postgresql://u:p@db/kintore?application_name=kintore-api")
+    assert u.query["application_name"] == "kintore-api"
+    assert u.query["prepared_statement_cache_size"] == str(database.DB_STATEMENT_CACHE_SIZE)
+
+
+@pytest.mark.parametrize("url, path", [
+    ("sqlite:///./kintore.db", "./kintore.db"),
+    ("sqlite:////var/lib/kintore.db", "/var/lib/kintore.db"),
+    ("sqlite://", None),
+])
+def test_sqlite_maps_to_aiosqlite(url, path):
+    u = async_url(url)
+    assert u.drivername == "sqlite+aiosqlite"
+    assert u.database == path
+    assert u.query == {}
+
+
+def test_sqlite_query_is_passed_through():
+    u = async_url("sqlite:///kintore.db?timeout=30")
+    assert u.drivername == "sqlite+aiosqlite"
+    assert u.query == {"timeout": "30"}
+
+
+@pytest.mark.parametrize("url", ["mysql://u:p@db/kintore", "oracle://u:p@db/kintore"])
+def test_unsupported_backends_are_rejected(url):
+    with pytest.raises(ValueError):
+        async_url(url)
+
+
+def test_app_async_engine_uses_aiosqlite():
+    assert database.async_engine.url.drivername == "sqlite+aiosqlite"
+    assert database.async_engine.url.database == database.engine.url.database
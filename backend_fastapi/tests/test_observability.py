@@ -0,0 +1,30 @@
+import re
+
+from fastapi.testclient import TestClient
+
+import main
+import observability
+
+# Prometheus テキスト形式の1サンプル行: 名前{ラベル="値",...} 数値
+_SAMPLE = re.compile(r'^[a-zA-Z_:][a-zA-Z0-9_:]*(\{([a-zA-Z_]\w*="(\\.|[^"\\\n])*",?)*\})? \S+$')
+
+
+def test_label_values_are_escaped():
+    assert observability._fmt_labels(("route", "q"), ('/a"b\\c', "x\ny")) == '{route="/a\\"b\\\\c",q="x\\ny"}'
+
+
+def test_metrics_endpoint_renders_valid_exposition():
+    client = TestClient(main.app)
+    assert client.get("/chat/stats").status_code == 200
+    # 改行や引用符を含むラベル値でも1サンプル1行のまま
+    observability.EXCEPTIONS.inc(1, 'odd\n"route"')
+
+    res = client.get("/metrics")
+    assert res.status_code == 200
+    assert res.headers["content-type"].startswith("text/plain; version=0.0.4")
+    lines = res.text.splitlines()
+    for line in lines:
+        assert line.startswith("# ") or _SAMPLE.match(line), line
+    assert 'http_requests_total{method="GET",route="/chat/stats",status="200"} 1' in lines
+    assert 'http_request_exceptions_total{route="odd\\n\\"route\\""} 1' in lines
+    assert any(line.startswith('executor_queue_depth{executor="chat"}') for line in lines)
@@ -0,0 +1,120 @@
+import asyncio
+from datetime import date
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import precompute
+from database import Base, SessionLocal, engine
+from models import DashboardCache, PrecomputeJob, PrecomputeRequest, TrainingRecord
+
+
+@pytest.fixture
+def db():
+    Base.metadata.create_all(bind=engine)
+    session = SessionLocal()
+    yield session
+    session.query(TrainingRecord).delete()
+    session.query(DashboardCache).delete()
+    session.query(PrecomputeJob).delete()
+    session.query(PrecomputeRequest).delete()
+    session.commit()
+    session.close()
+
+
+def _add(db, user_id, weight, day=date(2026, 1, 5)):
+    db.add(TrainingRecord(user_id=user_id, date=day, body_part="胸", exercise="ベンチプレス",
+                          weight=weight, reps=5, volume=weight * 5))
+    db.commit()
+
+
+def test_dashboard_recomputes_stale_cache(db):
+    app = FastAPI()
+    app.include_router(precompute.router)
+    client = TestClient(app)
+    _add(db, 1, 60.0)
+    first = client.get("/dashboard/1").json()
+    assert first["record_count"] == 1
+    _add(db, 1, 80.0)
+    second = client.get("/dashboard/1").json()
+    assert second["record_count"] == 2
+    assert second["prs"][0]["best_weight"] == 80.0
+
+
+def test_worker_survives_job_log_failures(db, monkeypatch):
+    _add(db, 1, 60.0)
+    _add(db, 2, 70.0)
+    logged = []
+
+    def flaky_log(user_id, *args):
+        logged.append(user_id)
+        if len(logged) == 1:
+            raise RuntimeError("db hiccup")
+
+    monkeypatch.setattr(precompute.PrecomputeScheduler, "_log_job", staticmethod(flaky_log))
+
+    async def run():
+        s = precompute.PrecomputeScheduler(max_parallel=1, sweep_seconds=0)
+        await s.start()
+        try:
+            s.enqueue(1)
+            s.enqueue(2)
+            await asyncio.wait_for(s.drain(), 5)
+            # drain は実行数しか見ないので、記録まで終わるのを待つ
+            for _ in range(100):
+                if len(logged) == 2:
+                    break
+                await asyncio.sleep(0.01)
+            return s.snapshot()
+        finally:
+            await s.stop()
+
+    stats = asyncio.run(run())
+    assert sorted(logged) == [1, 2]
+    assert stats["computed"] == 2
+
+
+def _api():
+    app = FastAPI()
+    app.include_router(precompute.router)
+    return TestClient(app)
+
+
+def test_run_without_scheduler_or_sidecar_is_unavailable(db, monkeypatch):
+    monkeypatch.delenv("PRECOMPUTE_SIDECAR", raising=False)
+    client = _api()
+    assert client.post("/precompute/run").status_code == 503
+    assert client.get("/precompute/stats").json() == {"enabled": False}
+
+
+def test_sidecar_workers_hand_runs_to_the_scheduler_process(db, monkeypatch):
+    # マルチワーカー構成のワーカー: 自前のスケジューラは無く、依頼をテーブルに書く
+    monkeypatch.setenv("PRECOMPUTE_SIDECAR", "1")
+    _add(db, 1, 60.0, day=date.today())
+    _add(db, 2, 70.0, day=date.today())
+    client = _api()
+    res = client.post("/precompute/run")
+    assert res.status_code == 200 and res.json()["status"] == "requested"
+    assert client.post("/precompute/users/2").json() == {"status": "requested"}
+    stats = client.get("/precompute/stats").json()
+    assert (stats["enabled"], stats["mode"], stats["pending_requests"]) == (True, "sidecar", 2)
+
+    # サイドカーのスケジューラがポーリングで依頼を取り出して計算する
+    async def run():
+        s = precompute.PrecomputeScheduler(max_parallel=1, sweep_seconds=0, poll_seconds=0.01)
+        await s.start()
+        try:
+            for _ in range(200):
+                if s.stats["computed"] + s.stats["fresh"] >= 2 and not s._pending and not s.stats["running"]:
+                    break
+                await asyncio.sleep(0.01)
+            return s.snapshot()
+        finally:
+            await s.stop()
+
+    stats = asyncio.run(run())
+    assert stats["computed"] == 2
+    assert db.query(PrecomputeRequest).count() == 0
+    assert db.query(DashboardCache).count() == 2
+    assert client.get("/precompute/stats").json()["pending_requests"] == 0
@@ -0,0 +1,20 @@
+from sqlalchemy import text
+
+import database
+import run_server
+
+
+def test_gunicorn_resets_db_pools_after_fork():
+    options = run_server.gunicorn_options(run_server.parse_args(["--mode", "prod", "--workers", "2"]))
+    assert options["preload_app"] is True
+    assert options["post_fork"] is run_server.post_fork
+
+    # マスターの import 時に接続がプールに入った状態を作る
+    with database.engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+    pool = database.engine.pool
+    assert pool.checkedin() >= 1
+    run_server.post_fork(server=None, worker=None)
+    # 引き継いだプールは捨てられ、ワーカーは新しい接続を作る
+    assert database.engine.pool is not pool
+    assert database.engine.pool.checkedin() == 0
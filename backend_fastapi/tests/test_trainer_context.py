@@ -0,0 +1,91 @@
+from datetime import date, timedelta
+
+import pytest
+
+from database import Base, SessionLocal, engine
+from models import TrainingRecord
+from trainer_context import TrainerContextCache, TrainingDigest, estimate_tokens
+
+
+@pytest.fixture
+def db():
+    Base.metadata.create_all(bind=engine)
+    session = SessionLocal()
+    yield session
+    session.query(TrainingRecord).delete()
+    session.commit()
+    session.close()
+
+
+def _add(db, user_id, weight, day, exercise="ベンチプレス", reps=5):
+    rec = TrainingRecord(user_id=user_id, date=day, body_part="胸", exercise=exercise,
+                         weight=weight, reps=reps, volume=weight * reps)
+    db.add(rec)
+    db.commit()
+    return rec
+
+
+def test_digest_tracks_prs_weekly_volume_and_trend():
+    digest = TrainingDigest()
+    start = date(2026, 1, 5)  # 月曜
+    for i, weight in enumerate([60.0, 62.5, 65.0, 67.5]):
+        digest.add((i + 1, start + timedelta(weeks=i), "胸", "ベンチプレス", weight, 5, weight * 5))
+    digest.add((5, start + timedelta(weeks=3, days=2), "脚", "スクワット", 100.0, 3, 300.0))
+
+    assert digest.last_id == 5
+    assert digest.total_sets == 5
+    assert digest.weight_prs["ベンチプレス"] == (67.5, 5, start + timedelta(weeks=3))
+    assert digest.e1rm_prs["スクワット"][0] == pytest.approx(110.0)
+    assert digest.weekly_volume[start + timedelta(weeks=3)] == {"胸": 337.5, "脚": 300.0}
+    # 週 2.5kg ずつ伸びている（推定1RMは ×(1 + 5/30)）
+    assert digest.trend_slopes()["ベンチプレス"] == pytest.approx(2.5 * 7 / 6)
+
+
+def test_render_keeps_priority_lines_within_token_budget():
+    digest = TrainingDigest()
+    for i in range(30):
+        digest.add((i + 1, date(2026, 1, 1) + timedelta(days=i), "胸", f"種目{i}", 50.0 + i, 5, 250.0))
+    full = digest.render(max_tokens=10_000)
+    short = digest.render(max_tokens=60)
+    assert full.startswith(short)
+    assert short.splitlines()[0].startswith("最終トレーニング日: 2026-01-30")
+    assert sum(estimate_tokens(line) + 1 for line in short.splitlines()) <= 60
+    assert TrainingDigest().render() == ""
+
+
+def test_build_context_reads_only_new_rows(db):
+    cache = TrainerContextCache()
+    _add(db, 1, 60.0, date(2026, 1, 5))
+    _add(db, 2, 200.0, date(2026, 1, 5))
+    assert "60kg×5回" in cache.build_context(db, 1)
+    calls = []
+    original = cache.fetch_new_rows
+    cache.fetch_new_rows = lambda db, user_id, last_id: calls.append(last_id) or original(db, user_id, last_id)
+    latest = _add(db, 1, 70.0, date(2026, 1, 7))
+    text = cache.build_context(db, 1)
+    assert "70kg×5回" in text and "200kg" not in text
+    assert calls == [latest.id - 2]
+
+
+def test_build_context_rebuilds_after_delete(db):
+    cache = TrainerContextCache()
+    _add(db, 1, 60.0, date(2026, 1, 5))
+    wrong = _add(db, 1, 600.0, date(2026, 1, 6))
+    assert "600kg" in cache.build_context(db, 1)
+    db.delete(wrong)
+    db.commit()
+    text = cache.build_context(db, 1)
+    assert "600kg" not in text and "60kg×5回" in text
+
+
+def test_build_context_refreshes_in_place_updates_after_ttl(db):
+    now = [0.0]
+    cache = TrainerContextCache(ttl=300.0, clock=lambda: now[0])
+    rec = _add(db, 1, 60.0, date(2026, 1, 5), exercise="ベンチ")
+    assert "ベンチ PR" in cache.build_context(db, 1)
+    # 種目名の付け替えは件数もIDも変わらないので、期限までは前の要約のまま
+    rec.exercise = "ベンチプレス"
+    db.commit()
+    assert "ベンチ PR" in cache.build_context(db, 1)
+    now[0] = 301.0
+    assert "ベンチプレス PR" in cache.build_context(db, 1)
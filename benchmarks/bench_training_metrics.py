@@ -0,0 +1,85 @@
+"""
+training_metrics の一括計算と、app.py で使っていた種目タブごとのループの比較。
+
+    python benchmarks/bench_training_metrics.py --rows 100000 --exercises 40
+"""
+import argparse
+import sys
+import time
+import warnings
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "frontend_streamlit"))
+import training_metrics as tm  # noqa: E402
+
+PARTS = ["胸", "背中", "脚", "肩", "腕", "その他"]
+
+
+def make_df(rows: int, exercises: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    ex_idx = rng.zipf(1.6, rows) % exercises
+    weight = np.round(rng.uniform(20, 180, rows) / 2.5) * 2.5
+    reps = rng.integers(1, 16, rows)
+    dates = pd.Timestamp("2022-01-01") + pd.to_timedelta(rng.integers(0, 1000, rows), unit="D")
+    return pd.DataFrame({
+        "ID": np.arange(rows),
+        "日付": dates.date,
+        "部位": np.array(PARTS)[ex_idx % len(PARTS)],
+        "種目": np.char.add("種目", ex_idx.astype(str)),
+        "重量(kg)": weight,
+        "回数": reps,
+        "ボリューム": weight * reps,
+    })
+
+
+def legacy_loop(df: pd.DataFrame):
+    """変更前の app.py と同じ処理（部位→種目ごとにスライスして計算）。"""
+    results = []
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        for part in df["部位"].unique().tolist():
+            part_df = df[df["部位"] == part]
+            for ex in part_df["種目"].unique().tolist():
+                ex_df = part_df[part_df["種目"] == ex]
+                max_df = ex_df.groupby("日付")["重量(kg)"].max().reset_index()
+                ex_df["1RM"] = ex_df["重量(kg)"] * (1 + ex_df["回数"] / 30)
+                rm_df = ex_df.groupby("日付")["1RM"].max().reset_index()
+                pr = ex_df.loc[ex_df["重量(kg)"].idxmax()]
+                results.append((max_df, rm_df, pr))
+    return results
+
+
+def vectorised(df: pd.DataFrame):
+    metrics_df = tm.compute_set_metrics(df)
+    return tm.daily_max(metrics_df), tm.pr_table(metrics_df), tm.session_summary(metrics_df)
+
+
+def timeit(fn, *args, repeat: int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--exercises", type=int, default=40)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    print(f"{'rows':>10} {'legacy(s)':>10} {'metrics(s)':>11} {'speedup':>8}")
+    for rows in args.rows:
+        df = make_df(rows, args.exercises)
+        t_legacy = timeit(legacy_loop, df, repeat=args.repeat)
+        t_new = timeit(vectorised, df, repeat=args.repeat)
+        print(f"{rows:>10} {t_legacy:>10.3f} {t_new:>11.3f} {t_legacy / t_new:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+"""
+ベンチマーク用の training_records 合成データ（シード固定）。
+
+- ユーザーごとの記録数はパレート分布（ごく一部のヘビーユーザーが大半の記録を持つ）
+- 各ユーザーは数年分の履歴を持ち、2〜4日おきのセッションに記録がまとまる
+- 種目の出現頻度は Zipf 分布（ベンチプレス・スクワットが多く、マイナー種目は少ない）
+- 重量はユーザーの筋力 × 種目の基準重量に、期間中の伸びとノイズを加えて 2.5kg 単位に丸める
+
+    python benchmarks/datagen.py --rows 1000000 --url sqlite:///benchmarks/.data/bench.db
+
+書き込み先の training_records は作り直す（DROP TABLE）ので、既定では benchmarks/.data・
+loadtest/.data の SQLite にしか書き込みません。それ以外（PostgreSQL など）はベンチ専用のDBで、
+--i-know-this-drops を付けたときだけ書き込みます。
+"""
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import (Column, Date, Float, Integer, MetaData, String, Table, create_engine, func, insert,
+                        make_url, select)
+
+DATA_DIR = Path(__file__).resolve().parent / ".data"
+# 確認なしで作り直してよい DB の置き場所（ベンチマーク・負荷試験の作業用）
+SCRATCH_DIRS = [DATA_DIR, DATA_DIR.parents[1] / "loadtest" / ".data"]
+
+# (種目, 部位, 基準重量kg)。並び順がそのまま人気順
+CATALOG = [
+    ("ベンチプレス", "胸", 70), ("スクワット", "脚", 90), ("デッドリフト", "背中", 110),
+    ("ラットプルダウン", "背中", 50), ("ショルダープレス", "肩", 35), ("アームカール", "腕", 15),
+    ("レッグプレス", "脚", 140), ("インクラインベンチプレス", "胸", 55), ("サイドレイズ", "肩", 8),
+    ("ベントオーバーロウ", "背中", 60), ("ダンベルフライ", "胸", 14), ("懸垂", "背中", 10),
+    ("トライセプスエクステンション", "腕", 20), ("ルーマニアンデッドリフト", "脚", 80),
+    ("レッグカール", "脚", 40), ("ケーブルクロスオーバー", "胸", 20), ("フェイスプル", "肩", 20),
+    ("ハンマーカール", "腕", 14), ("カーフレイズ", "脚", 60), ("アブローラー", "その他", 0),
+]
+
+metadata = MetaData()
+training_records = Table(
+    "training_records", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("user_id", Integer, index=True, nullable=False),
+    Column("date", Date, index=True, nullable=False),
+    Column("body_part", String, index=True, nullable=False),
+    Column("exercise", String, index=True, nullable=False),
+    Column("exercise_id", Integer, index=True),
+    Column("weight", Float, nullable=False),
+    Column("reps", Integer, nullable=False),
+    Column("volume", Float, nullable=False),
+)
+
+
+def make_records(rows: int, users: int = None, years: float = 3.0, seed: int = 0,
+                 end: str = "2025-12-31") -> pd.DataFrame:
+    """training_records と同じ列の DataFrame を作る（user_id, date 順、id は 1 から連番）。"""
+    rng = np.random.default_rng(seed)
+    users = users or max(rows // 1500, 1)
+
+    # ユーザーごとの記録数（パレート）
+    share = rng.pareto(1.2, users) + 1
+    per_user = rng.multinomial(rows, share / share.sum())
+    user_id = np.repeat(np.arange(1, users + 1), per_user)
+
+    # ユーザーごとの属性: 履歴の長さ・セッション間隔・筋力・伸び率
+    span = np.maximum(rng.uniform(0.1, 1.0, users) * years * 365, 14).astype(np.int64)
+    gap = rng.integers(2, 5, users)
+    strength = rng.lognormal(0, 0.25, users)
+    progress = rng.uniform(0.0, 0.4, users)
+
+    u = user_id - 1
+    t = rng.random(rows)
+    day_offset = (t * span[u]).astype(np.int64) // gap[u] * gap[u]
+    end_day = np.datetime64(end, "D")
+    dates = end_day - span[u] + day_offset
+
+    ex = (rng.zipf(1.5, rows) - 1) % len(CATALOG)
+    names = np.array([c[0] for c in CATALOG], dtype=object)
+    parts = np.array([c[1] for c in CATALOG], dtype=object)
+    base = np.array([c[2] for c in CATALOG], dtype=float)
+
+    reps = np.clip(np.rint(rng.normal(8, 3, rows)), 1, 20).astype(np.int64)
+    weight = base[ex] * strength[u] * (1 + progress[u] * day_offset / span[u]) * (1.1 - reps / 60)
+    weight = np.maximum(np.round(weight * rng.normal(1, 0.04, rows) / 2.5) * 2.5, 0.0)
+
+    df = pd.DataFrame({
+        "user_id": user_id,
+        "date": dates,
+        "body_part": parts[ex],
+        "exercise": names[ex],
+        "weight": weight,
+        "reps": reps,
+        "volume": weight * reps,
+    })
+    df = df.sort_values(["user_id", "date"], kind="stable").reset_index(drop=True)
+    df.insert(0, "id", np.arange(1, rows + 1))
+    return df
+
+
+def to_app_df(records: pd.DataFrame) -> pd.DataFrame:
+    """load_df() が返すのと同じ日本語列の DataFrame にする。"""
+    return pd.DataFrame({
+        "ID": records["id"].to_numpy(),
+        "日付": records["date"].dt.date.to_numpy(),
+        "部位": records["body_part"].to_numpy(),
+        "種目": records["exercise"].to_numpy(),
+        "重量(kg)": records["weight"].to_numpy(),
+        "回数": records["reps"].to_numpy(),
+        "ボリューム": records["volume"].to_numpy(),
+    })
+
+
+def is_scratch_url(url: str) -> bool:
+    """作業用の置き場所（SCRATCH_DIRS）にある SQLite か、メモリ上の SQLite か。"""
+    parsed = make_url(url)
+    if parsed.get_backend_name() != "sqlite":
+        return False
+    if not parsed.database or parsed.database == ":memory:":
+        return True
+    path = Path(parsed.database).resolve()
+    return any(path.is_relative_to(d.resolve()) for d in SCRATCH_DIRS)
+
+
+def check_droppable(url: str, allow_drop: bool = False):
+    """training_records を作り直してよい DB でなければ ValueError。"""
+    if not allow_drop and not is_scratch_url(url):
+        raise ValueError(
+            f"{make_url(url).render_as_string(hide_password=True)} の training_records を作り直そうとしました。"
+            "ベンチマーク専用のDBなら allow_drop=True（コマンドでは --i-know-this-drops）を指定してください"
+        )
+
+
+def write_db(url: str, records: pd.DataFrame, chunk_size: int = 50_000, allow_drop: bool = False):
+    """training_records を作り直して書き込む（作り直してよい DB かは check_droppable で確認）。"""
+    check_droppable(url, allow_drop)
+    engine = create_engine(url)
+    metadata.drop_all(engine, tables=[training_records])
+    metadata.create_all(engine)
+    with engine.begin() as conn:
+        for start in range(0, len(records), chunk_size):
+            chunk = records.iloc[start:start + chunk_size]
+            rows = chunk.assign(date=chunk["date"].dt.date).to_dict("records")
+            conn.execute(insert(training_records), rows)
+    engine.dispose()
+
+
+def ensure_db(url: str, rows: int, seed: int = 0, users: int = None, allow_drop: bool = False) -> str:
+    """url の DB に同じ件数の記録が入っていなければ生成して書き込む。url を返す。"""
+    engine = create_engine(url)
+    try:
+        with engine.connect() as conn:
+            count = conn.execute(select(func.count()).select_from(training_records)).scalar()
+    except Exception:
+        count = None
+    finally:
+        engine.dispose()
+    if count != rows:
+        write_db(url, make_records(rows, users=users, seed=seed), allow_drop=allow_drop)
+    return url
+
+
+def sqlite_url(rows: int, seed: int = 0) -> str:
+    DATA_DIR.mkdir(exist_ok=True)
+    return f"sqlite:///{DATA_DIR / f'bench_{rows}_{seed}.db'}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--users", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--url", default=None, help="書き込み先（既定: benchmarks/.data の SQLite）")
+    parser.add_argument("--i-know-this-drops", dest="allow_drop", action="store_true",
+                        help="--url の training_records を作り直してよい（ベンチ専用のDBのときだけ）")
+    args = parser.parse_args(argv)
+
+    url = args.url or sqlite_url(args.rows, args.seed)
+    try:
+        check_droppable(url, args.allow_drop)
+    except ValueError as e:
+        parser.error(str(e))
+    start = time.perf_counter()
+    records = make_records(args.rows, users=args.users, seed=args.seed)
+    generated = time.perf_counter() - start
+    write_db(url, records, allow_drop=args.allow_drop)
+    print(f"✅ {len(records):,}件 / {records['user_id'].nunique():,}人 "
+          f"（生成 {generated:.1f}s, 書き込み {time.perf_counter() - start - generated:.1f}s） → {url}")
+
+
+if __name__ == "__main__":
+    main()
@@ -20,27 +20,58 @@ export default function ChatPage() {
     if (!input.trim()) return;
 
     const userMsg: Message = { role: 'user', content: input };
-    setMessages((prev) => [...prev, userMsg]);
+    // 空のアシスタントメッセージを先に追加し、届いたトークンを順に追記する
+    setMessages((prev) => [...prev, userMsg, { role: 'assistant', content: '' }]);
     setInput('');
 
+    const appendToken = (token: string) =>
+      setMessages((prev) => {
+        const next = [...prev];
+        const last = next[next.length - 1];
+        next[next.length - 1] = { ...last, content: last.content + token };
+        return next;
+      });
+
     try {
       const res = await fetch('http://127.0.0.1:8000/chat', {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ message: input }),
+        body: JSON.stringify({
+          message: input,
+          history: messages,
+          stream: true,
+        }),
       });
 
-      if (!res.ok) throw new Error('FastAPIからの応答がありません');
-      const data = await res.json();
+      if (!res.ok || !res.body) throw new Error('FastAPIからの応答がありません');
 
-      const aiMsg: Message = { role: 'assistant', content: data.reply };
-      setMessages((prev) => [...prev, aiMsg]);
+      // NDJSON（1行1JSON）を逐次パースする
+      const reader = res.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split('\n');
+        buffer = lines.pop() ?? '';
+        for (const line of lines) {
+          if (!line.trim()) continue;
+          const event = JSON.parse(line);
+          if (event.error) throw new Error(event.error);
+          if (event.token) appendToken(event.token);
+        }
+      }
     } catch (error) {
       console.error(error);
-      setMessages((prev) => [
-        ...prev,
-        { role: 'assistant', content: 'サーバーとの通信でエラーが発生しました。' },
-      ]);
+      setMessages((prev) => {
+        const next = [...prev];
+        next[next.length - 1] = {
+          role: 'assistant',
+          content: 'サーバーとの通信でエラーが発生しました。',
+        };
+        return next;
+      });
     }
   };
 
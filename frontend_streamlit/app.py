@@ -1,5 +1,6 @@
 # app.py
 import os
+import sys
 import platform
 from datetime import date
 import re
@@ -12,10 +13,26 @@ import seaborn as sns
 import plotly.express as px
 import streamlit as st
 from dotenv import load_dotenv
-from sklearn.linear_model import LinearRegression
-from sqlalchemy import Column, Date, Float, Integer, String, create_engine
+from sqlalchemy import Column, Date, Float, ForeignKey, Integer, String, create_engine
 from sqlalchemy.orm import declarative_base, sessionmaker
 
+import calendar_heatmap as ch
+import db_routing
+import exercise_dictionary
+import instrumentation as obs
+import progression_forecast as pf
+import save_journal
+import training_metrics as tm
+
+# 記録の読み込み・CSV復元（training_records）は、バックエンドの /upload_csv と共有の kintore_common を使う
+# （追加するのはリポジトリ直下だけなので、backend_fastapi/app の database・models などは見えない）
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import training_records  # noqa: E402
+
+# 計測（KINTORE_TRACE=1 のときだけ記録。スクリプト1回の実行 = 1トレース）
+# このアプリにはログインが無く管理者を判定できないので、計測パネルは出さない（KINTORE_TRACE_FILE や OTLP で見る）
+obs.start_run("app.py")
+
 # =========================
 # 日本語フォント設定
 # =========================
@@ -41,7 +58,7 @@ if not DATABASE_URL:
     st.error("❌ .env に DATABASE_URL がありません。")
     st.stop()
 
-engine = create_engine(DATABASE_URL, echo=False, pool_pre_ping=True)
+engine = obs.instrument_engine(create_engine(DATABASE_URL, echo=False, pool_pre_ping=True))
 Base = declarative_base()
 SessionLocal = sessionmaker(bind=engine)
 
@@ -51,12 +68,41 @@ class TrainingRecord(Base):
     date = Column(Date, index=True)
     body_part = Column(String, index=True)
     exercise = Column(String, index=True)
+    exercise_id = Column(Integer, ForeignKey(exercise_dictionary.Exercise.id), index=True)
     weight = Column(Float)
     reps = Column(Integer)
     volume = Column(Float)
 
+# exercise_id の参照先（種目名辞書のテーブル）を先に作る
+exercise_dictionary.create_tables(engine)
 Base.metadata.create_all(bind=engine)
 
+# 種目名辞書（起動時に1回だけスキーマ確認・既存記録の移行・インデックス構築）
+@st.cache_resource(show_spinner=False)
+def get_exercise_index():
+    s = SessionLocal()
+    try:
+        return exercise_dictionary.setup(engine, s, TrainingRecord)
+    finally:
+        s.close()
+
+exercise_index = get_exercise_index()
+
+# 読み取りのレプリカ振り分け（DATABASE_READ_URLS 未設定なら常にプライマリ）
+@st.cache_resource(show_spinner=False)
+def get_db_router():
+    return db_routing.ReadRouter(engine, os.getenv("DATABASE_READ_URLS"), instrument=obs.instrument_engine)
+
+db_router = get_db_router()
+
+# 記録保存のライトビハインド（保存はローカルのジャーナルに書いてすぐ戻り、DBへはバックグラウンドで反映）
+@st.cache_resource(show_spinner=False)
+def get_save_journal():
+    return save_journal.start(engine, TrainingRecord.__table__, exercise_index.resolve,
+                              on_applied=db_router.note_applied)
+
+journal, flusher = get_save_journal()
+
 # =========================
 # Streamlit設定
 # =========================
@@ -70,18 +116,17 @@ session = SessionLocal()
 # 共通関数
 # =========================
 def load_df():
-    recs = session.query(TrainingRecord).all()
-    if not recs:
-        return pd.DataFrame(columns=["ID", "日付", "部位", "種目", "重量(kg)", "回数", "ボリューム"])
-    return pd.DataFrame([{
-        "ID": r.id,
-        "日付": r.date,
-        "部位": r.body_part,
-        "種目": r.exercise,
-        "重量(kg)": r.weight,
-        "回数": r.reps,
-        "ボリューム": r.volume
-    } for r in recs])
+    # 全件読み込みは重いのでレプリカがあればそちらから（保存直後はプライマリ）
+    # まだDBに反映されていない保存（ジャーナル）も重ねて表示する
+    return training_records.load_df(db_router, TrainingRecord, exercise_index, journal=journal)
+
+FORECAST_MODELS = {
+    "linear": "直線（最小二乗）",
+    "huber": "直線（外れ値に強い: Huber）",
+    "theil_sen": "直線（外れ値に強い: Theil–Sen）",
+    "log": "対数（伸びが鈍化）",
+    "plateau": "頭打ち（上限に漸近）",
+}
 
 def validate_numeric_input(value: str, field_name: str):
     if not re.match(r'^[0-9]+(\.[0-9]+)?$', value.strip()):
@@ -89,7 +134,13 @@ def validate_numeric_input(value: str, field_name: str):
         return None
     return float(value)
 
-df = load_df()
+def use_suggestion(i, name):
+    """「もしかして」の候補を選んだとき: 入力欄をその正規名に置き換える。"""
+    st.session_state.exercises[i]["name"] = name
+    st.session_state.pop(f"name_{i}", None)
+
+with obs.span("load_df"):
+    df = load_df()
 
 # =========================
 # タブ構成
@@ -101,7 +152,7 @@ tab_calendar, tab_manage, tab_analysis, tab_settings = st.tabs(
 # =========================
 # 📅 カレンダー
 # =========================
-with tab_calendar:
+with tab_calendar, obs.span("tab.calendar"):
     st.subheader("📅 トレーニングカレンダー")
 
     unique_dates = sorted(df["日付"].unique().tolist()) if not df.empty else []
@@ -121,31 +172,29 @@ with tab_calendar:
     if df.empty:
         st.info("記録がまだありません。")
     else:
-        df_copy = df.copy()
-        df_copy["日付"] = pd.to_datetime(df_copy["日付"])
-        df_copy["週"] = df_copy["日付"].dt.isocalendar().week
-        df_copy["曜日"] = df_copy["日付"].dt.day_name(locale="ja_JP")
-        df_copy["曜日"] = pd.Categorical(
-            df_copy["曜日"],
-            categories=["月曜日", "火曜日", "水曜日", "木曜日", "金曜日", "土曜日", "日曜日"],
-            ordered=True
-        )
-
-        heat_df = df_copy.groupby(["週", "曜日"])["ボリューム"].sum().reset_index()
-
-        fig = px.density_heatmap(
-            heat_df, x="週", y="曜日", z="ボリューム",
-            color_continuous_scale="YlOrRd",
-            labels={"ボリューム": "総ボリューム(kg)"},
-            title="週間トレーニング負荷ヒートマップ"
-        )
-        fig.update_layout(height=400, margin=dict(l=30, r=30, t=50, b=30))
-        st.plotly_chart(fig, use_container_width=True)
+        c_year, c_part = st.columns(2)
+        with obs.span("heatmap"):
+            grid = ch.CalendarGrid(df)
+            parts, part_grids = grid.by("部位")
+        heat_year = c_year.selectbox("年", grid.years[::-1].tolist(), key="heatmap_year")
+        heat_part = c_part.selectbox("部位", ["全体"] + parts.tolist(), key="heatmap_part")
+        heat = grid.year_matrix(heat_year, grid.total() if heat_part == "全体"
+                                else part_grids[parts.tolist().index(heat_part)])
+
+        with obs.span("heatmap.render"):
+            fig = px.imshow(
+                heat, x=list(range(1, ch.WEEKS + 1)), y=ch.WEEKDAY_LABELS,
+                color_continuous_scale="YlOrRd", aspect="auto",
+                labels={"x": "週", "y": "曜日", "color": "総ボリューム(kg)"},
+                title=f"週間トレーニング負荷ヒートマップ（{heat_year}年）"
+            )
+            fig.update_layout(height=400, margin=dict(l=30, r=30, t=50, b=30))
+            st.plotly_chart(fig, use_container_width=True)
 
 # =========================
 # 🏋️ 記録管理
 # =========================
-with tab_manage:
+with tab_manage, obs.span("tab.manage"):
     selected_date = st.session_state.get("selected_date", date.today())
     st.header(f"🗓 {selected_date} の記録管理")
 
@@ -165,6 +214,9 @@ with tab_manage:
             c1, c2 = st.columns([1, 1])
             name = c1.text_input("種目名", value=ex["name"], key=f"name_{i}")
             part = c2.selectbox("部位", ["胸", "背中", "脚", "肩", "腕", "その他"], key=f"part_{i}")
+            # 似た名前の登録済み種目は候補として出すだけ（押したときだけその名前で保存する）
+            for j, (cand, _) in enumerate(exercise_index.suggest(name) if name else []):
+                c1.button(f"もしかして: {cand}", key=f"suggest_{i}_{j}", on_click=use_suggestion, args=(i, cand))
 
             sets = st.number_input("セット数", min_value=1, max_value=10, value=int(ex["sets"]), key=f"sets_{i}")
             set_data = []
@@ -195,38 +247,69 @@ with tab_manage:
                 continue
             for (w, r) in ex.get("data", []):
                 if w > 0 and r > 0:
-                    new_records.append(
-                        TrainingRecord(
-                            date=selected_date,
-                            body_part=ex["part"],
-                            exercise=ex["name"],
-                            weight=w,
-                            reps=r,
-                            volume=w * r
-                        )
-                    )
+                    new_records.append({
+                        "date": selected_date,
+                        "body_part": ex["part"],
+                        "exercise": ex["name"],
+                        "weight": w,
+                        "reps": r,
+                        "volume": w * r
+                    })
         try:
             if new_records:
-                session.add_all(new_records)
-                session.commit()
+                # 種目名の正規化とDBへの書き込みはフラッシャー側で行う（反映までは load_df がジャーナルを重ねて表示）
+                journal.append(new_records)
+                flusher.notify()
                 st.success("✅ 記録を保存しました。")
                 st.session_state.exercises = [{"name": "", "part": "胸", "sets": 3}]
                 st.rerun()
             else:
                 st.warning("⚠️ 入力内容を確認してください。")
         except Exception as e:
-            session.rollback()
-            st.error(f"❌ データベースエラー: {e}")
+            st.error(f"❌ 記録保存エラー: {e}")
+
+    pending = journal.pending_records()
+    if pending:
+        st.caption(f"⏳ DBへの反映待ち: {len(pending)} セット"
+                   + (f"（再試行中: {flusher.last_error}）" if flusher.last_error else ""))
+
+    # 何度やっても反映できなかった保存（dead_letter）は、内容を見て再送か破棄を選んでもらう
+    dead = journal.dead_letters()
+    if dead:
+        st.warning(f"⚠️ DBに反映できなかった保存が {len(dead)} 件あります。再送するか破棄してください。")
+        for d in dead:
+            c1, c2, c3 = st.columns([6, 1, 1])
+            c1.caption(f"{d['created_at']:%Y-%m-%d %H:%M} の保存（{len(d['records'])} セット）: {d['last_error']}")
+            c2.button("再送", key=f"retry_{d['key']}", on_click=flusher.retry, args=(d["key"],))
+            c3.button("破棄", key=f"discard_{d['key']}", on_click=journal.discard, args=(d["key"],))
 
 # =========================
 # 📈 分析（回帰分析＋1RM）
 # =========================
-with tab_analysis:
+with tab_analysis, obs.span("tab.analysis"):
     st.subheader("📈 部位→種目ごとの重量推移分析")
 
     if df.empty:
         st.info("記録がありません。")
     else:
+        # 1RM・PR・日別最大値は全種目まとめて1回で計算しておく
+        with obs.span("analysis.metrics"):
+            metrics_df = tm.compute_set_metrics(df)
+            ex_groups = dict(tuple(metrics_df.groupby(["部位", "種目"], sort=False)))
+            daily_groups = dict(tuple(
+                metrics_df.groupby(["部位", "種目", "日付"], sort=True)
+                .agg(**{"重量(kg)": ("重量(kg)", "max"), "1RM": ("1RM", "max")})
+                .reset_index()
+                .groupby(["部位", "種目"], sort=False)
+            ))
+
+        forecast_model = st.selectbox(
+            "予測モデル", list(FORECAST_MODELS), format_func=FORECAST_MODELS.get, key="forecast_model"
+        )
+
+        with st.expander("🏆 自己ベスト一覧"):
+            st.dataframe(tm.pr_table(metrics_df), use_container_width=True, hide_index=True)
+
         body_parts = df["部位"].unique().tolist()
         part_tabs = st.tabs(body_parts)
         for part_tab, part in zip(part_tabs, body_parts):
@@ -236,53 +319,59 @@ with tab_analysis:
                 ex_tabs = st.tabs(exercises)
                 for ex_tab, ex in zip(ex_tabs, exercises):
                     with ex_tab:
-                        ex_df = part_df[part_df["種目"] == ex]
-                        if ex_df.empty:
+                        ex_df = ex_groups.get((part, ex))
+                        if ex_df is None or ex_df.empty:
                             st.info("記録なし")
                             continue
 
-                        max_df = ex_df.groupby("日付")["重量(kg)"].max().reset_index()
-                        if len(max_df) >= 2:
-                            X = np.arange(len(max_df)).reshape(-1, 1)
-                            y = max_df["重量(kg)"].values
-                            model = LinearRegression().fit(X, y)
-                            y_pred = model.predict(X)
-                            next_pred = model.predict([[len(max_df)]])[0]
-                            slope = model.coef_[0]
-                        else:
-                            y_pred = max_df["重量(kg)"].values
-                            next_pred = None
-                            slope = 0
-
-                        ex_df["1RM"] = ex_df["重量(kg)"] * (1 + ex_df["回数"] / 30)
-                        rm_df = ex_df.groupby("日付")["1RM"].max().reset_index()
-
-                        fig, ax = plt.subplots(figsize=(8, 4))
-                        sns.lineplot(data=max_df, x="日付", y="重量(kg)", marker="o", label="最大重量", ax=ax)
-                        if len(max_df) >= 2:
-                            sns.lineplot(x=max_df["日付"], y=y_pred, label="回帰予測", ax=ax, linestyle="--")
-                        plt.xticks(rotation=45)
-                        st.pyplot(fig, use_container_width=True)
-
-                        fig2, ax2 = plt.subplots(figsize=(8, 3))
-                        sns.lineplot(data=rm_df, x="日付", y="1RM", marker="s", color="orange", ax=ax2)
-                        plt.xticks(rotation=45)
-                        st.pyplot(fig2, use_container_width=True)
+                        day_df = daily_groups[(part, ex)]
+                        max_df = day_df[["日付", "重量(kg)"]].reset_index(drop=True)
+                        # 経過日数で回帰し、次回の予定日（過去の間隔の中央値）時点を予測する
+                        with obs.span("analysis.forecast"):
+                            forecast = pf.fit_cached((part, ex), max_df["日付"].to_numpy(),
+                                                     max_df["重量(kg)"].to_numpy(), model=forecast_model)
+                            if forecast is not None:
+                                y_pred = forecast.predict(max_df["日付"].to_numpy())
+                                next_date = pf.next_session_date(max_df["日付"].to_numpy())
+                                next_pred, next_lo, next_hi = (v[0] for v in forecast.predict(next_date, interval=True))
+                                slope = forecast.slope_at(next_date)
+                            else:
+                                y_pred = max_df["重量(kg)"].values
+                                next_pred = None
+                                slope = 0
+
+                        rm_df = day_df[["日付", "1RM"]]
+
+                        with obs.span("analysis.plot"):
+                            fig, ax = plt.subplots(figsize=(8, 4))
+                            sns.lineplot(data=max_df, x="日付", y="重量(kg)", marker="o", label="最大重量", ax=ax)
+                            if len(max_df) >= 2:
+                                sns.lineplot(x=max_df["日付"], y=y_pred, label="回帰予測", ax=ax, linestyle="--")
+                            plt.xticks(rotation=45)
+                            st.pyplot(fig, use_container_width=True)
+
+                            fig2, ax2 = plt.subplots(figsize=(8, 3))
+                            sns.lineplot(data=rm_df, x="日付", y="1RM", marker="s", color="orange", ax=ax2)
+                            plt.xticks(rotation=45)
+                            st.pyplot(fig2, use_container_width=True)
 
                         latest_row = ex_df.loc[ex_df["日付"].idxmax()]
                         c1, c2, c3 = st.columns(3)
                         c1.metric("🏋️ 最新最大重量", f"{latest_row['重量(kg)']} kg")
                         c2.metric("💪 最新1RM", f"{latest_row['1RM']:.1f} kg")
-                        if next_pred:
+                        if next_pred is not None:
                             trend = "📈 上昇" if slope > 0 else "📉 下降"
-                            c3.metric(f"🔮 次回予測（傾向: {trend}）", f"{next_pred:.1f} kg")
+                            c3.metric(f"🔮 次回予測（傾向: {trend}）", f"{next_pred:.1f} kg",
+                                      delta=f"{slope:+.1f} kg/週", delta_color="off")
+                            if not np.isnan(next_lo):
+                                c3.caption(f"{next_date} 時点・95%予測区間 {next_lo:.1f}〜{next_hi:.1f} kg")
                         else:
                             c3.metric("🔮 次回予測", "データ不足")
 
 # =========================
 # ⚙️ 設定・バックアップ
 # =========================
-with tab_settings:
+with tab_settings, obs.span("tab.settings"):
     st.subheader("⚙️ 設定・バックアップ")
 
     try:
@@ -308,26 +397,17 @@ with tab_settings:
     st.markdown("### 📤 CSVから復元")
     uploaded = st.file_uploader("CSVファイルを選択", type=["csv"])
     if uploaded:
-        try:
-            new_df = pd.read_csv(uploaded)
-            new_df["日付"] = pd.to_datetime(new_df["日付"]).dt.date
-            records = [
-                TrainingRecord(
-                    date=row["日付"],
-                    body_part=row["部位"],
-                    exercise=row["種目"],
-                    weight=row["重量(kg)"],
-                    reps=row["回数"],
-                    volume=row["ボリューム"]
-                )
-                for _, row in new_df.iterrows()
-            ]
-            session.add_all(records)
-            session.commit()
-            st.success(f"✅ {len(records)}件の記録を復元しました。")
-        except Exception as e:
-            session.rollback()
-            st.error(f"❌ 復元エラー: {e}")
+        with obs.span("csv_restore"):
+            try:
+                # 列名が違う CSV（date,exercise,weight,reps など）も共通の列に読み替える
+                records, mapping = training_records.restore_csv(session, TrainingRecord, exercise_index, uploaded)
+                session.commit()
+                db_router.note_applied()
+                st.success(f"✅ {len(records)}件の記録を復元しました。")
+                st.caption("列の対応: " + ", ".join(f"{src} → {role}" for role, src in mapping.items()))
+            except Exception as e:
+                session.rollback()
+                st.error(f"❌ 復元エラー: {e}")
 
 # =========================
 # 📱 スマホ対応CSS
@@ -349,3 +429,5 @@ input, select, textarea {
 """, unsafe_allow_html=True)
 
 st.caption("AI Kintore v2.5 © 2025 | All devices responsive version")
+
+obs.finish_run()
@@ -1,7 +1,7 @@
 import os
+import sys
 import platform
 from datetime import date
-import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
@@ -9,10 +9,26 @@ import plotly.express as px
 import bcrypt
 import streamlit as st
 from dotenv import load_dotenv
-from sklearn.linear_model import LinearRegression
-from sqlalchemy import Column, Date, Float, Integer, String, Boolean, create_engine
+from sqlalchemy import Column, Date, Float, ForeignKey, Integer, String, Boolean, create_engine
 from sqlalchemy.orm import declarative_base, sessionmaker
 
+import calendar_heatmap as ch
+import dashboard_client
+import db_routing
+import exercise_dictionary
+import instrumentation as obs
+import progression_forecast as pf
+import save_journal
+
+# 記録の読み込み（training_records）は、バックエンドと共有の kintore_common を使う（リポジトリ直下だけを追加）
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import training_records  # noqa: E402
+
+from training_load import ALL_PARTS, TrainingLoadEngine
+
+# 計測（KINTORE_TRACE=1 のときだけ記録。スクリプト1回の実行 = 1トレース）
+obs.start_run("app_firebase_login.py")
+
 # =========================
 # Streamlit 基本設定
 # =========================
@@ -46,7 +62,7 @@ if not DATABASE_URL:
     st.error("❌ DATABASE_URL が見つかりません。")
     st.stop()
 
-engine = create_engine(DATABASE_URL, echo=False, pool_pre_ping=True)
+engine = obs.instrument_engine(create_engine(DATABASE_URL, echo=False, pool_pre_ping=True))
 Base = declarative_base()
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
 session = SessionLocal()
@@ -68,12 +84,41 @@ class TrainingRecord(Base):
     date = Column(Date, index=True, nullable=False)
     body_part = Column(String, index=True, nullable=False)
     exercise = Column(String, index=True, nullable=False)
+    exercise_id = Column(Integer, ForeignKey(exercise_dictionary.Exercise.id), index=True)
     weight = Column(Float, nullable=False)
     reps = Column(Integer, nullable=False)
     volume = Column(Float, nullable=False)
 
+# exercise_id の参照先（種目名辞書のテーブル）を先に作る
+exercise_dictionary.create_tables(engine)
 Base.metadata.create_all(bind=engine)
 
+# 種目名辞書（起動時に1回だけスキーマ確認・既存記録の移行・インデックス構築）
+@st.cache_resource(show_spinner=False)
+def get_exercise_index():
+    s = SessionLocal()
+    try:
+        return exercise_dictionary.setup(engine, s, TrainingRecord)
+    finally:
+        s.close()
+
+exercise_index = get_exercise_index()
+
+# 読み取りのレプリカ振り分け（DATABASE_READ_URLS 未設定なら常にプライマリ）
+@st.cache_resource(show_spinner=False)
+def get_db_router():
+    return db_routing.ReadRouter(engine, st.secrets.get("DATABASE_READ_URLS", None) or os.getenv("DATABASE_READ_URLS"), instrument=obs.instrument_engine)
+
+db_router = get_db_router()
+
+# 記録保存のライトビハインド（保存はローカルのジャーナルに書いてすぐ戻り、DBへはバックグラウンドで反映）
+@st.cache_resource(show_spinner=False)
+def get_save_journal():
+    return save_journal.start(engine, TrainingRecord.__table__, exercise_index.resolve,
+                              on_applied=db_router.note_applied)
+
+journal, flusher = get_save_journal()
+
 # =========================
 # パスワード関連関数
 # =========================
@@ -99,6 +144,7 @@ def login_view():
             if user and verify_password(password, user.password_hash):
                 st.session_state["user_id"] = user.id
                 st.session_state["user_email"] = user.email
+                st.session_state["is_admin"] = bool(user.is_admin)
                 st.success(f"ようこそ {user.email} さん！")
                 st.rerun()
             else:
@@ -150,31 +196,37 @@ if "user_id" not in st.session_state:
 def load_df():
     uid = st.session_state.get("user_id")
     if not uid:
-        return pd.DataFrame(columns=["ID", "日付", "部位", "種目", "重量(kg)", "回数", "ボリューム"])
-    recs = session.query(TrainingRecord).filter_by(user_id=uid).order_by(TrainingRecord.date.asc()).all()
-    if not recs:
-        return pd.DataFrame(columns=["ID", "日付", "部位", "種目", "重量(kg)", "回数", "ボリューム"])
-    return pd.DataFrame([{
-        "ID": r.id,
-        "日付": r.date,
-        "部位": r.body_part,
-        "種目": r.exercise,
-        "重量(kg)": r.weight,
-        "回数": r.reps,
-        "ボリューム": r.volume
-    } for r in recs])
+        return pd.DataFrame(columns=training_records.COLUMNS)
+    # まだDBに反映されていない保存（ジャーナル）も重ねて表示する
+    return training_records.load_df(db_router, TrainingRecord, exercise_index, uid, journal=journal)
+
+@st.cache_data(show_spinner=False)
+def load_curve(uid, last_id, row_count, _df):
+    """負荷推移グラフ用の日次データ（記録が増えたときだけ再計算）。"""
+    return TrainingLoadEngine.backfill(_df, user_id=uid)[1]
+
+# 自己ベスト・伸びの傾向は API の事前計算キャッシュを読む（KINTORE_API_URL 未設定なら表示しない）
+@st.cache_data(ttl=60, show_spinner=False)
+def load_dashboard(uid, record_count):
+    return dashboard_client.fetch_dashboard(uid, st.secrets.get("KINTORE_API_URL", None) or None)
 
 # =========================
 # 本体UI
 # =========================
 st.title(f"🏋️‍♂️ AI Kintore - {st.session_state['user_email']} さんのダッシュボード")
 
-df = load_df()
+def use_suggestion(i, name):
+    """「もしかして」の候補を選んだとき: 入力欄をその正規名に置き換える。"""
+    st.session_state.exercises[i]["name"] = name
+    st.session_state.pop(f"name_{i}", None)
+
+with obs.span("load_df"):
+    df = load_df()
 
 tab1, tab2, tab3, tab4 = st.tabs(["📅 カレンダー", "🏋️ 記録管理", "📈 分析", "⚙️ 設定"])
 
 # 📅 カレンダー
-with tab1:
+with tab1, obs.span("tab.calendar"):
     st.subheader("📅 トレーニングカレンダー")
     if not df.empty:
         df_dates = pd.to_datetime(df["日付"]).dt.date
@@ -192,28 +244,58 @@ with tab1:
         st.info(f"ℹ️ {selected_date} の記録はまだありません。")
 
     if not df.empty:
-        df_copy = df.copy()
-        df_copy["日付"] = pd.to_datetime(df_copy["日付"])
-        df_copy["週"] = df_copy["日付"].dt.isocalendar().week
-        try:
-            df_copy["曜日"] = df_copy["日付"].dt.day_name(locale="ja_JP")
-        except Exception:
-            df_copy["曜日"] = df_copy["日付"].dt.day_name()
-        df_copy["曜日"] = pd.Categorical(
-            df_copy["曜日"],
-            categories=["月曜日", "火曜日", "水曜日", "木曜日", "金曜日", "土曜日", "日曜日"],
-            ordered=True
-        )
-        heat_df = df_copy.groupby(["週", "曜日"])["ボリューム"].sum().reset_index()
-        fig = px.density_heatmap(
-            heat_df, x="週", y="曜日", z="ボリューム",
-            color_continuous_scale="YlOrRd",
-            labels={"ボリューム": "総ボリューム(kg)"}
+        grid = ch.CalendarGrid(df)
+        parts, part_grids = grid.by("部位")
+        c_year, c_part = st.columns(2)
+        heat_year = c_year.selectbox("年", grid.years[::-1].tolist(), key="heatmap_year")
+        heat_part = c_part.selectbox("部位", ["全体"] + parts.tolist(), key="heatmap_part")
+        heat = grid.year_matrix(heat_year, grid.total() if heat_part == "全体"
+                                else part_grids[parts.tolist().index(heat_part)])
+        fig = px.imshow(
+            heat, x=list(range(1, ch.WEEKS + 1)), y=ch.WEEKDAY_LABELS,
+            color_continuous_scale="YlOrRd", aspect="auto",
+            labels={"x": "週", "y": "曜日", "color": "総ボリューム(kg)"}
         )
         st.plotly_chart(fig, use_container_width=True)
 
+        dash = load_dashboard(st.session_state["user_id"], len(df))
+        if dash and dash.get("prs"):
+            st.markdown("### 🏆 自己ベストと伸び")
+            st.dataframe(dashboard_client.pr_table(dash), use_container_width=True, hide_index=True)
+
+        # トレーニング負荷（ACWR・疲労/体力）: 初回だけ全履歴から計算し、以降は新しい記録のみ反映
+        # （ID で差分を取るので、ID の無い未反映の保存は DB に反映されてから取り込む）
+        uid = st.session_state["user_id"]
+        applied_df = df[df["ID"].notna()]
+        load_engine = st.session_state.get("load_engine")
+        if load_engine is None or st.session_state.get("load_engine_user") != uid:
+            load_engine, _ = TrainingLoadEngine.backfill(applied_df, user_id=uid)
+            st.session_state["load_engine"] = load_engine
+            st.session_state["load_engine_user"] = uid
+        else:
+            load_engine.sync(applied_df, user_id=uid)
+
+        st.markdown("### 📊 トレーニング負荷（ACWR）")
+        load_parts = [ALL_PARTS] + df["部位"].unique().tolist()
+        load_part = st.selectbox("部位", load_parts, key="load_part")
+        m = load_engine.metrics(uid, load_part, as_of=date.today())
+        if m:
+            c1, c2, c3, c4 = st.columns(4)
+            c1.metric("急性:慢性 負荷比", f"{m['acwr']:.2f}" if m["chronic"] > 0 else "-")
+            c2.metric("疲労（7日EWMA）", f"{m['fatigue']:,.0f}")
+            c3.metric("体力（42日EWMA）", f"{m['fitness']:,.0f}")
+            c4.metric("コンディション", f"{m['form']:+,.0f}")
+            if m["chronic"] > 0 and m["acwr"] > 1.5:
+                st.warning("⚠️ 急性負荷が慢性負荷の1.5倍を超えています。ケガのリスクに注意しましょう。")
+
+            curve = load_curve(uid, load_engine.last_id, len(load_engine.ids), applied_df)
+            curve = curve[curve["部位"] == load_part].tail(180)
+            fig_load = px.line(curve, x="日付", y=["fatigue", "chronic", "fitness"],
+                               labels={"value": "負荷(kg)", "variable": "指標"})
+            st.plotly_chart(fig_load, use_container_width=True)
+
 # 🏋️ 記録管理
-with tab2:
+with tab2, obs.span("tab.manage"):
     st.subheader("🏋️ トレーニング記録の追加/一覧")
 
     selected_date = st.session_state.get("selected_date", date.today())
@@ -240,6 +322,9 @@ with tab2:
             c1, c2, c3 = st.columns([2, 1, 1])
             name = c1.text_input("種目名", value=ex["name"], key=f"name_{i}")
             part = c2.selectbox("部位", ["胸", "背中", "脚", "肩", "腕", "その他"], key=f"part_{i}")
+            # 似た名前の登録済み種目は候補として出すだけ（押したときだけその名前で保存する）
+            for j, (cand, _) in enumerate(exercise_index.suggest(name) if name else []):
+                c1.button(f"もしかして: {cand}", key=f"suggest_{i}_{j}", on_click=use_suggestion, args=(i, cand))
             sets = c3.number_input("セット数", min_value=1, max_value=10, value=int(ex.get("sets", 3)), key=f"sets_{i}")
 
             set_data = []
@@ -254,38 +339,52 @@ with tab2:
                 st.session_state.exercises.pop(i)
                 st.rerun()
 
+    uid = st.session_state["user_id"]
     if st.button("💾 保存"):
         try:
-            uid = st.session_state["user_id"]
             new_records = []
             for ex in st.session_state.exercises:
                 if not ex["name"]:
                     continue
                 for (w, r) in ex["data"]:
                     if w > 0 and r > 0:
-                        new_records.append(TrainingRecord(
-                            user_id=uid,
-                            date=selected_date,
-                            body_part=ex["part"],
-                            exercise=ex["name"],
-                            weight=float(w),
-                            reps=int(r),
-                            volume=float(w) * int(r)
-                        ))
+                        new_records.append({
+                            "date": selected_date,
+                            "body_part": ex["part"],
+                            "exercise": ex["name"],
+                            "weight": float(w),
+                            "reps": int(r),
+                            "volume": float(w) * int(r)
+                        })
             if new_records:
-                session.add_all(new_records)
-                session.commit()
+                # 種目名の正規化とDBへの書き込みはフラッシャー側で行う（反映までは load_df がジャーナルを重ねて表示）
+                journal.append(new_records, user_id=uid)
+                flusher.notify()
                 st.success("✅ 保存しました。")
                 st.session_state.exercises = [{"name": "", "part": "胸", "sets": 3, "data": []}]
                 st.rerun()
             else:
                 st.info("入力がありません。重量・回数を1以上で入力してください。")
         except Exception as e:
-            session.rollback()
             st.error(f"記録保存エラー: {e}")
 
+    pending = journal.pending_records(uid)
+    if pending:
+        st.caption(f"⏳ DBへの反映待ち: {len(pending)} セット"
+                   + (f"（再試行中: {flusher.last_error}）" if flusher.last_error else ""))
+
+    # 何度やっても反映できなかった保存（dead_letter）は、内容を見て再送か破棄を選んでもらう
+    dead = journal.dead_letters(uid)
+    if dead:
+        st.warning(f"⚠️ DBに反映できなかった保存が {len(dead)} 件あります。再送するか破棄してください。")
+        for d in dead:
+            c1, c2, c3 = st.columns([6, 1, 1])
+            c1.caption(f"{d['created_at']:%Y-%m-%d %H:%M} の保存（{len(d['records'])} セット）: {d['last_error']}")
+            c2.button("再送", key=f"retry_{d['key']}", on_click=flusher.retry, args=(d["key"],))
+            c3.button("破棄", key=f"discard_{d['key']}", on_click=journal.discard, args=(d["key"],))
+
 # 📈 分析
-with tab3:
+with tab3, obs.span("tab.analysis"):
     st.subheader("📈 部位・種目別分析")
 
     if df.empty:
@@ -300,18 +399,18 @@ with tab3:
                     st.markdown(f"#### 🏋️ {ex}")
                     ex_df = part_df[part_df["種目"] == ex]
                     max_df = ex_df.groupby("日付")["重量(kg)"].max().reset_index()
-                    if len(max_df) >= 2:
-                        X = np.arange(len(max_df)).reshape(-1, 1)
-                        y = max_df["重量(kg)"].values
-                        model = LinearRegression().fit(X, y)
-                        y_pred = model.predict(X)
+                    # 記録の通し番号ではなく経過日数で回帰する
+                    forecast = pf.fit_cached((st.session_state["user_id"], ex), max_df["日付"].to_numpy(),
+                                             max_df["重量(kg)"].to_numpy())
+                    if forecast is not None:
+                        y_pred = forecast.predict(max_df["日付"].to_numpy())
                         fig, ax = plt.subplots(figsize=(8, 3))
                         sns.lineplot(x=max_df["日付"], y=max_df["重量(kg)"], ax=ax, marker="o", label="実績")
                         sns.lineplot(x=max_df["日付"], y=y_pred, ax=ax, linestyle="--", label="トレンド")
                         st.pyplot(fig, use_container_width=True)
 
 # ⚙️ 設定
-with tab4:
+with tab4, obs.span("tab.settings"):
     st.subheader("⚙️ アカウント設定")
     st.write(f"ログイン中: {st.session_state['user_email']}")
     if st.button("🚪 ログアウト"):
@@ -319,4 +418,12 @@ with tab4:
         st.success("ログアウトしました。")
         st.rerun()
 
+    if st.session_state.get("is_admin"):
+        obs.render_panel(st)
+        if db_router.replicas:
+            st.markdown("#### 🗄 読み取りレプリカ")
+            st.dataframe(pd.DataFrame(db_router.status()), use_container_width=True, hide_index=True)
+
 st.caption("AI Kintore v3.0 © 2025 | Local Auth + DB + Analysis")
+
+obs.finish_run()
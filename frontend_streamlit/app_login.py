@@ -1,9 +1,9 @@
 import os
+import sys
 import platform
 from datetime import date
 import re
 import io
-import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
@@ -11,10 +11,24 @@ import plotly.express as px
 import bcrypt
 import streamlit as st
 from dotenv import load_dotenv
-from sklearn.linear_model import LinearRegression
-from sqlalchemy import Column, Date, Float, Integer, String, Boolean, create_engine
+from sqlalchemy import Column, Date, Float, ForeignKey, Integer, String, Boolean, create_engine
 from sqlalchemy.orm import declarative_base, sessionmaker
 
+import calendar_heatmap as ch
+import dashboard_client
+import db_routing
+import exercise_dictionary
+import instrumentation as obs
+import progression_forecast as pf
+import save_journal
+
+# 記録の読み込み（training_records）は、バックエンドと共有の kintore_common を使う（リポジトリ直下だけを追加）
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import training_records  # noqa: E402
+
+# 計測（KINTORE_TRACE=1 のときだけ記録。スクリプト1回の実行 = 1トレース）
+obs.start_run("app_login.py")
+
 # =========================
 # 日本語フォント設定
 # =========================
@@ -40,7 +54,7 @@ if not DATABASE_URL:
     st.error("❌ .env に DATABASE_URL がありません。")
     st.stop()
 
-engine = create_engine(DATABASE_URL, echo=False, pool_pre_ping=True)
+engine = obs.instrument_engine(create_engine(DATABASE_URL, echo=False, pool_pre_ping=True))
 Base = declarative_base()
 SessionLocal = sessionmaker(bind=engine)
 
@@ -61,12 +75,41 @@ class TrainingRecord(Base):
     date = Column(Date, index=True)
     body_part = Column(String, index=True)
     exercise = Column(String, index=True)
+    exercise_id = Column(Integer, ForeignKey(exercise_dictionary.Exercise.id), index=True)
     weight = Column(Float)
     reps = Column(Integer)
     volume = Column(Float)
 
+# exercise_id の参照先（種目名辞書のテーブル）を先に作る
+exercise_dictionary.create_tables(engine)
 Base.metadata.create_all(bind=engine)
 
+# 種目名辞書（起動時に1回だけスキーマ確認・既存記録の移行・インデックス構築）
+@st.cache_resource(show_spinner=False)
+def get_exercise_index():
+    s = SessionLocal()
+    try:
+        return exercise_dictionary.setup(engine, s, TrainingRecord)
+    finally:
+        s.close()
+
+exercise_index = get_exercise_index()
+
+# 読み取りのレプリカ振り分け（DATABASE_READ_URLS 未設定なら常にプライマリ）
+@st.cache_resource(show_spinner=False)
+def get_db_router():
+    return db_routing.ReadRouter(engine, os.getenv("DATABASE_READ_URLS"), instrument=obs.instrument_engine)
+
+db_router = get_db_router()
+
+# 記録保存のライトビハインド（保存はローカルのジャーナルに書いてすぐ戻り、DBへはバックグラウンドで反映）
+@st.cache_resource(show_spinner=False)
+def get_save_journal():
+    return save_journal.start(engine, TrainingRecord.__table__, exercise_index.resolve,
+                              on_applied=db_router.note_applied)
+
+journal, flusher = get_save_journal()
+
 session = SessionLocal()
 
 # =========================
@@ -91,6 +134,7 @@ def login_view():
         if user and verify_password(password, user.password_hash):
             st.session_state["user_id"] = user.id
             st.session_state["user_email"] = user.email
+            st.session_state["is_admin"] = bool(user.is_admin)
             st.success(f"ようこそ {user.email} さん！")
             st.rerun()
         else:
@@ -141,20 +185,23 @@ st.title(f"🏋️‍♂️ AI Kintore - {st.session_state['user_email']} さん
 # -------------------------
 def load_df():
     uid = st.session_state.get("user_id")
-    recs = session.query(TrainingRecord).filter_by(user_id=uid).all()
-    if not recs:
-        return pd.DataFrame(columns=["ID","日付","部位","種目","重量(kg)","回数","ボリューム"])
-    return pd.DataFrame([{
-        "ID": r.id,
-        "日付": r.date,
-        "部位": r.body_part,
-        "種目": r.exercise,
-        "重量(kg)": r.weight,
-        "回数": r.reps,
-        "ボリューム": r.volume
-    } for r in recs])
-
-df = load_df()
+    if not uid:
+        return pd.DataFrame(columns=training_records.COLUMNS)
+    # まだDBに反映されていない保存（ジャーナル）も重ねて表示する
+    return training_records.load_df(db_router, TrainingRecord, exercise_index, uid, journal=journal)
+
+# 自己ベスト・伸びの傾向は API の事前計算キャッシュを読む（KINTORE_API_URL 未設定なら表示しない）
+@st.cache_data(ttl=60, show_spinner=False)
+def load_dashboard(uid, record_count):
+    return dashboard_client.fetch_dashboard(uid)
+
+def use_suggestion(i, name):
+    """「もしかして」の候補を選んだとき: 入力欄をその正規名に置き換える。"""
+    st.session_state.exercises[i]["name"] = name
+    st.session_state.pop(f"name_{i}", None)
+
+with obs.span("load_df"):
+    df = load_df()
 
 # -------------------------
 # タブ構成
@@ -162,7 +209,7 @@ df = load_df()
 tab1, tab2, tab3, tab4 = st.tabs(["📅 カレンダー", "🏋️ 記録管理", "📈 分析", "⚙️ 設定"])
 
 # 📅 カレンダー
-with tab1:
+with tab1, obs.span("tab.calendar"):
     st.subheader("📅 トレーニングカレンダー")
     unique_dates = sorted(df["日付"].unique().tolist()) if not df.empty else []
     default_date = unique_dates[-1] if unique_dates else date.today()
@@ -175,25 +222,27 @@ with tab1:
         st.info(f"ℹ️ {selected_date} の記録はまだありません。")
 
     if not df.empty:
-        df_copy = df.copy()
-        df_copy["日付"] = pd.to_datetime(df_copy["日付"])
-        df_copy["週"] = df_copy["日付"].dt.isocalendar().week
-        df_copy["曜日"] = df_copy["日付"].dt.day_name(locale="ja_JP")
-        df_copy["曜日"] = pd.Categorical(
-            df_copy["曜日"],
-            categories=["月曜日","火曜日","水曜日","木曜日","金曜日","土曜日","日曜日"],
-            ordered=True
-        )
-        heat_df = df_copy.groupby(["週","曜日"])["ボリューム"].sum().reset_index()
-        fig = px.density_heatmap(
-            heat_df, x="週", y="曜日", z="ボリューム",
-            color_continuous_scale="YlOrRd",
-            labels={"ボリューム":"総ボリューム(kg)"}
+        grid = ch.CalendarGrid(df)
+        parts, part_grids = grid.by("部位")
+        c_year, c_part = st.columns(2)
+        heat_year = c_year.selectbox("年", grid.years[::-1].tolist(), key="heatmap_year")
+        heat_part = c_part.selectbox("部位", ["全体"] + parts.tolist(), key="heatmap_part")
+        heat = grid.year_matrix(heat_year, grid.total() if heat_part == "全体"
+                                else part_grids[parts.tolist().index(heat_part)])
+        fig = px.imshow(
+            heat, x=list(range(1, ch.WEEKS + 1)), y=ch.WEEKDAY_LABELS,
+            color_continuous_scale="YlOrRd", aspect="auto",
+            labels={"x": "週", "y": "曜日", "color": "総ボリューム(kg)"}
         )
         st.plotly_chart(fig, use_container_width=True)
 
+        dash = load_dashboard(st.session_state["user_id"], len(df))
+        if dash and dash.get("prs"):
+            st.markdown("### 🏆 自己ベストと伸び")
+            st.dataframe(dashboard_client.pr_table(dash), use_container_width=True, hide_index=True)
+
 # 🏋️ 記録管理
-with tab2:
+with tab2, obs.span("tab.manage"):
     selected_date = st.session_state.get("selected_date", date.today())
     daily_df = df[df["日付"] == selected_date] if not df.empty else pd.DataFrame(columns=df.columns)
     st.dataframe(daily_df, use_container_width=True, hide_index=True)
@@ -206,6 +255,9 @@ with tab2:
             c1, c2 = st.columns(2)
             name = c1.text_input("種目名", value=ex["name"], key=f"name_{i}")
             part = c2.selectbox("部位", ["胸","背中","脚","肩","腕","その他"], key=f"part_{i}")
+            # 似た名前の登録済み種目は候補として出すだけ（押したときだけその名前で保存する）
+            for j, (cand, _) in enumerate(exercise_index.suggest(name) if name else []):
+                c1.button(f"もしかして: {cand}", key=f"suggest_{i}_{j}", on_click=use_suggestion, args=(i, cand))
             sets = st.number_input("セット数", min_value=1, max_value=10, value=int(ex["sets"]), key=f"sets_{i}")
             set_data = []
             for s in range(int(sets)):
@@ -220,18 +272,31 @@ with tab2:
             if not ex["name"]: continue
             for (w, r) in ex["data"]:
                 if w > 0 and r > 0:
-                    new_records.append(TrainingRecord(
-                        user_id=st.session_state["user_id"], date=selected_date,
-                        body_part=ex["part"], exercise=ex["name"], weight=w, reps=r, volume=w*r
-                    ))
+                    new_records.append({
+                        "date": selected_date, "body_part": ex["part"], "exercise": ex["name"],
+                        "weight": w, "reps": r, "volume": w*r
+                    })
         if new_records:
-            session.add_all(new_records)
-            session.commit()
+            journal.append(new_records, user_id=st.session_state["user_id"])
+            flusher.notify()
             st.success("✅ 保存しました。")
             st.rerun()
+    pending = journal.pending_records(st.session_state["user_id"])
+    if pending:
+        st.caption(f"⏳ DBへの反映待ち: {len(pending)} セット")
+
+    # 何度やっても反映できなかった保存（dead_letter）は、内容を見て再送か破棄を選んでもらう
+    dead = journal.dead_letters(st.session_state["user_id"])
+    if dead:
+        st.warning(f"⚠️ DBに反映できなかった保存が {len(dead)} 件あります。再送するか破棄してください。")
+        for d in dead:
+            c1, c2, c3 = st.columns([6, 1, 1])
+            c1.caption(f"{d['created_at']:%Y-%m-%d %H:%M} の保存（{len(d['records'])} セット）: {d['last_error']}")
+            c2.button("再送", key=f"retry_{d['key']}", on_click=flusher.retry, args=(d["key"],))
+            c3.button("破棄", key=f"discard_{d['key']}", on_click=journal.discard, args=(d["key"],))
 
 # 📈 分析
-with tab3:
+with tab3, obs.span("tab.analysis"):
     st.subheader("📈 部位・種目別分析")
     if df.empty:
         st.info("記録なし")
@@ -245,21 +310,29 @@ with tab3:
                     st.markdown(f"#### 🏋️ {ex}")
                     ex_df = part_df[part_df["種目"] == ex]
                     max_df = ex_df.groupby("日付")["重量(kg)"].max().reset_index()
-                    if len(max_df) >= 2:
-                        X = np.arange(len(max_df)).reshape(-1, 1)
-                        y = max_df["重量(kg)"].values
-                        model = LinearRegression().fit(X, y)
-                        y_pred = model.predict(X)
+                    # 記録の通し番号ではなく経過日数で回帰する
+                    forecast = pf.fit_cached((st.session_state["user_id"], ex), max_df["日付"].to_numpy(),
+                                             max_df["重量(kg)"].to_numpy())
+                    if forecast is not None:
+                        y_pred = forecast.predict(max_df["日付"].to_numpy())
                         fig, ax = plt.subplots(figsize=(8, 3))
                         sns.lineplot(x=max_df["日付"], y=max_df["重量(kg)"], ax=ax, marker="o")
                         sns.lineplot(x=max_df["日付"], y=y_pred, ax=ax, linestyle="--")
                         st.pyplot(fig, use_container_width=True)
 
 # ⚙️ 設定
-with tab4:
+with tab4, obs.span("tab.settings"):
     st.subheader("⚙️ アカウント設定")
     st.write(f"ログイン中: {st.session_state['user_email']}")
     if st.button("🚪 ログアウト"):
         st.session_state.clear()
         st.success("ログアウトしました。")
         st.rerun()
+
+    if st.session_state.get("is_admin"):
+        obs.render_panel(st)
+        if db_router.replicas:
+            st.markdown("#### 🗄 読み取りレプリカ")
+            st.dataframe(pd.DataFrame(db_router.status()), use_container_width=True, hide_index=True)
+
+obs.finish_run()
@@ -0,0 +1,91 @@
+"""
+カレンダーヒートマップの集計（ISO 年 × 週 × 曜日）。
+
+日付を整数の (ISO年, 週, 曜日) コードに変換し、np.bincount で
+年 × 53週 × 7曜日 の密な配列にボリュームを積み上げます。
+曜日名などの文字列処理やロケールには依存せず、元の DataFrame もコピーしません。
+
+    grid = CalendarGrid(df)
+    grid.total()            # (年数, 53, 7)
+    parts, arr = grid.by("部位")   # (部位数, 年数, 53, 7)
+
+日付コードの計算は一度だけなので、全体・部位別・種目別を同じ grid から出せます。
+"""
+from typing import Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+WEEKS = 53
+DAYS = 7
+WEEKDAY_LABELS = ["月", "火", "水", "木", "金", "土", "日"]
+
+
+# =========================
+# 日付 → (ISO年, 週, 曜日)
+# =========================
+def to_days(dates) -> np.ndarray:
+    """日付の列（date オブジェクト・datetime64・文字列）を 1970-01-01 からの日数にする。"""
+    values = dates.to_numpy() if isinstance(dates, pd.Series) else np.asarray(dates)
+    if values.dtype.kind != "M":
+        values = pd.to_datetime(values).to_numpy()
+    return values.astype("datetime64[D]").astype(np.int64)
+
+
+def iso_calendar(days: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """日数から (ISO年, 週 1-53, 曜日 0=月曜) を整数演算だけで求める。"""
+    # 1970-01-01 は木曜日。ISO 週の年は、その週の木曜日が属する年
+    weekday = (days + 3) % 7
+    thursday = days - weekday + 3
+    year = thursday.astype("datetime64[D]").astype("datetime64[Y]").astype(np.int64)
+    jan1 = year.astype("datetime64[Y]").astype("datetime64[D]").astype(np.int64)
+    week = (thursday - jan1) // 7 + 1
+    return year + 1970, week, weekday
+
+
+# =========================
+# 集計
+# =========================
+class CalendarGrid:
+    def __init__(self, df: pd.DataFrame, value_column: str = "ボリューム", date_column: str = "日付"):
+        self.df = df
+        if df.empty:
+            self.years = np.array([], dtype=np.int64)
+            self.cell = np.array([], dtype=np.int64)
+            self.values = np.array([], dtype=float)
+            return
+        year, week, weekday = iso_calendar(to_days(df[date_column]))
+        first = int(year.min())
+        self.years = np.arange(first, int(year.max()) + 1)
+        # セル番号 = ((年 - 最初の年) * 53 + 週 - 1) * 7 + 曜日
+        self.cell = ((year - first) * WEEKS + week - 1) * DAYS + weekday
+        self.values = df[value_column].to_numpy(dtype=float)
+
+    @property
+    def size(self) -> int:
+        return len(self.years) * WEEKS * DAYS
+
+    def total(self) -> np.ndarray:
+        """全記録の合計。形は (年数, 53, 7)。"""
+        out = np.bincount(self.cell, weights=self.values, minlength=self.size)
+        return out.reshape(len(self.years), WEEKS, DAYS)
+
+    def by(self, column: str) -> Tuple[np.ndarray, np.ndarray]:
+        """列（部位・種目など）ごとの合計。(ラベル, (ラベル数, 年数, 53, 7) の配列) を返す。"""
+        codes, labels = pd.factorize(self.df[column], sort=True)
+        n = len(labels)
+        if n == 0:
+            return np.asarray(labels), np.zeros((0, len(self.years), WEEKS, DAYS))
+        # 欠損（コード -1）は集計から外す
+        valid = codes >= 0
+        index = codes[valid].astype(np.int64) * self.size + self.cell[valid]
+        out = np.bincount(index, weights=self.values[valid], minlength=n * self.size)
+        return np.asarray(labels), out.reshape(n, len(self.years), WEEKS, DAYS)
+
+    def year_matrix(self, year: int, grid: Optional[np.ndarray] = None) -> np.ndarray:
+        """表示用に1年分を (7曜日, 53週) で返す。記録のない日は NaN（ヒートマップで空白になる）。"""
+        grid = self.total() if grid is None else grid
+        if year not in self.years:
+            return np.full((DAYS, WEEKS), np.nan)
+        m = grid[int(year - self.years[0])].T
+        return np.where(m > 0, m, np.nan)
@@ -0,0 +1,42 @@
+"""
+FastAPI の事前計算済みダッシュボード（GET /dashboard/{user_id}）を読むクライアント。
+
+KINTORE_API_URL（例: http://127.0.0.1:8000）が設定されているときだけ使います。
+未設定・API に届かない場合は None を返すので、画面側はその部分を表示しないだけで動き続けます。
+"""
+import json
+import os
+import urllib.error
+import urllib.request
+from typing import Dict, Optional
+
+import pandas as pd
+
+API_URL = os.getenv("KINTORE_API_URL", "")
+TIMEOUT = float(os.getenv("KINTORE_API_TIMEOUT", "3"))
+
+
+def fetch_dashboard(user_id: int, api_url: Optional[str] = None, timeout: float = TIMEOUT) -> Optional[Dict]:
+    """ユーザーのダッシュボードデータ（heatmap / weekly_volume / prs / trends）。取れなければ None。"""
+    base = (api_url if api_url is not None else API_URL).rstrip("/")
+    if not base or user_id is None:
+        return None
+    try:
+        with urllib.request.urlopen(f"{base}/dashboard/{int(user_id)}", timeout=timeout) as res:
+            return json.loads(res.read().decode("utf-8"))
+    except (urllib.error.URLError, OSError, ValueError):
+        return None
+
+
+def pr_table(dashboard: Dict) -> pd.DataFrame:
+    """自己ベストと伸びの傾向を1つの表にする（推定1RMの大きい順）。"""
+    prs = pd.DataFrame(dashboard.get("prs") or [], columns=["exercise", "best_weight", "best_e1rm", "date"])
+    trends = {t["exercise"]: t["slope_kg_per_week"] for t in dashboard.get("trends") or []}
+    table = pd.DataFrame({
+        "種目": prs["exercise"],
+        "最大重量(kg)": prs["best_weight"],
+        "推定1RM(kg)": prs["best_e1rm"].round(1),
+        "達成日": prs["date"],
+        "伸び(kg/週)": prs["exercise"].map(trends).round(2),
+    })
+    return table.sort_values("推定1RM(kg)", ascending=False, ignore_index=True)
@@ -0,0 +1,255 @@
+"""
+読み取りのレプリカ振り分け（DATABASE_READ_URLS が設定されているときだけ有効）。
+
+- 書き込みと flush は常にプライマリ（DATABASE_URL）
+- 読み取り専用の重いクエリ（load_df など）は、健全で遅延の小さいレプリカにラウンドロビン
+- レプリカは REPLICA_CHECK_SECONDS ごとに死活と遅延を確認し、落ちている・遅延が
+  REPLICA_MAX_LAG 秒を超えているものは使わない（使えるものがなければプライマリ）
+- 直前に保存したユーザーは、その書き込みを含むと確認できたレプリカが出るまでプライマリから読む
+  （read-your-writes。PostgreSQL は WAL の位置 = LSN で、それ以外は確認時刻で判定）
+- 「いつ書き込んだか」の印は ReadMarks（ローカルの SQLite）に置き、同じマシンの別プロセスとも共有する
+
+    router = ReadRouter(engine, "postgresql://replica1/...,postgresql://replica2/...")
+    df = router.read(lambda s: s.query(TrainingRecord).all(), user_id=uid)
+    router.note_applied(uid)   # プライマリへ commit した後: その LSN を覚える
+
+ライトビハインドの保存（save_journal）は、プライマリに反映されるまでジャーナルを画面に重ねて表示し、
+反映の commit 後・ジャーナルから消す前に note_applied が呼ばれます。
+
+ローカルで試すときは SQLite のファイル2つ（プライマリ・レプリカ役）を指定すれば動きます。
+遅延の計測は PostgreSQL のみで、それ以外のDBは遅延 0 として扱います。
+"""
+import itertools
+import os
+import sqlite3
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import Select
+
+CHECK_SECONDS = float(os.getenv("REPLICA_CHECK_SECONDS", "5"))
+MAX_LAG = float(os.getenv("REPLICA_MAX_LAG", "10"))
+MARKS_PATH = Path.home() / ".cache" / "kintore" / "read_marks.db"
+MARK_TTL = 3600.0  # これより古い書き込みは、どのレプリカでも追いついているはずなので捨てる
+
+# (遅延秒, 適用済みのLSN, WAL を受信中か)。遅延はレプリカでなければ 0、受信済みのWALを適用し終えていれば
+# （更新がないだけなら）0。LSN は '0/0' からのバイト数。
+# プライマリとの接続が切れたレプリカは受信位置 = 適用位置のまま止まって遅延 0 に見えるので、
+# pg_stat_wal_receiver が streaming でなければ（行が無い場合も）受信中ではないとみなす
+PG_STATUS_SQL = text(
+    "SELECT CASE WHEN NOT pg_is_in_recovery() THEN 0"
+    " WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0"
+    " ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END,"
+    " (CASE WHEN pg_is_in_recovery() THEN pg_last_wal_replay_lsn() ELSE pg_current_wal_lsn() END)"
+    " - '0/0'::pg_lsn,"
+    " NOT pg_is_in_recovery() OR EXISTS (SELECT 1 FROM pg_stat_wal_receiver WHERE status = 'streaming')"
+)
+PG_CURRENT_LSN_SQL = text("SELECT pg_current_wal_lsn() - '0/0'::pg_lsn")
+
+
+def split_urls(value: Optional[str]) -> List[str]:
+    return [u.strip() for u in (value or "").split(",") if u.strip()]
+
+
+class ReplicaDisconnected(Exception):
+    """レプリカがプライマリから WAL を受信していない（遅延を測れないので使わない）。"""
+
+
+def pg_status(conn) -> Tuple[float, Optional[int]]:
+    lag, lsn, streaming = conn.execute(PG_STATUS_SQL).one()
+    if not streaming:
+        raise ReplicaDisconnected("WAL receiver is not streaming from the primary")
+    return float(lag or 0.0), int(lsn) if lsn is not None else None
+
+
+class Replica:
+    def __init__(self, engine):
+        self.engine = engine
+        self.healthy = False
+        self.lag = 0.0
+        self.lsn: Optional[int] = None
+        self.checked_at = 0.0
+        self.error: Optional[str] = None
+
+    @property
+    def fresh_as_of(self) -> float:
+        """このレプリカが少なくともこの時刻までの書き込みを含んでいる（最後の確認時点）。"""
+        return self.checked_at - self.lag
+
+    def describe(self) -> Dict:
+        return {"url": self.engine.url.render_as_string(hide_password=True), "healthy": self.healthy,
+                "lag": round(self.lag, 2), "lsn": self.lsn, "checked_at": self.checked_at, "error": self.error}
+
+
+class ReadMarks:
+    """
+    user_id → (書き込み時刻, プライマリのLSN)。KINTORE_READ_MARKS（既定 ~/.cache/kintore/read_marks.db）の
+    SQLite に置くので、同じマシンで動く別の Streamlit プロセスの書き込みも見える。
+    """
+
+    def __init__(self, path=None):
+        self.path = Path(path or os.getenv("KINTORE_READ_MARKS") or MARKS_PATH)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None, timeout=5)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS read_marks ("
+                           " user_key TEXT PRIMARY KEY, written_at REAL NOT NULL, lsn INTEGER)")
+
+    def put(self, user_id, written_at: float, lsn: Optional[int]):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO read_marks (user_key, written_at, lsn) VALUES (?, ?, ?)"
+                " ON CONFLICT (user_key) DO UPDATE SET written_at = excluded.written_at, lsn = excluded.lsn",
+                (repr(user_id), written_at, lsn))
+            self._conn.execute("DELETE FROM read_marks WHERE written_at < ?", (written_at - MARK_TTL,))
+
+    def get(self, user_id) -> Optional[Tuple[float, Optional[int]]]:
+        with self._lock:
+            row = self._conn.execute("SELECT written_at, lsn FROM read_marks WHERE user_key = ?",
+                                     (repr(user_id),)).fetchone()
+        if row is None or row[0] < time.time() - MARK_TTL:
+            return None
+        return row[0], row[1]
+
+
+def _check_loop(ref, stop: threading.Event, interval: float):
+    # ルーターへの参照は弱参照にして、キャッシュから外れたルーターがスレッドごと回収されるようにする
+    while not stop.wait(interval):
+        router = ref()
+        if router is None:
+            return
+        router.check()
+        del router
+
+
+class ReadRouter:
+    def __init__(self, primary, read_urls=None, instrument: Callable = lambda e: e,
+                 check_seconds: float = CHECK_SECONDS, max_lag: float = MAX_LAG,
+                 lag_fn: Optional[Callable] = None, marks: Optional[ReadMarks] = None):
+        self.primary = primary
+        urls = split_urls(read_urls) if isinstance(read_urls, str) else list(read_urls or [])
+        self.replicas = [Replica(instrument(create_engine(u, pool_pre_ping=True))) for u in urls]
+        self.check_seconds = check_seconds
+        self.max_lag = max_lag
+        self.lag_fn = lag_fn
+        # レプリカが無ければ印は使わないので、ファイルも作らない
+        self.marks = marks if marks is not None or not self.replicas else ReadMarks()
+        self._rr = itertools.count()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        if self.replicas:
+            self.check()
+            self._thread = threading.Thread(target=_check_loop, args=(weakref.ref(self), self._stop, check_seconds),
+                                            name="replica-check", daemon=True)
+            self._thread.start()
+            weakref.finalize(self, self._stop.set)
+
+    # ---------- 死活・遅延の確認 ----------
+    def _measure(self, replica: Replica):
+        try:
+            lsn = None
+            with replica.engine.connect() as conn:
+                if self.lag_fn is not None:
+                    lag = self.lag_fn(conn)
+                elif conn.dialect.name == "postgresql":
+                    lag, lsn = pg_status(conn)
+                else:
+                    conn.execute(text("SELECT 1"))
+                    lag = 0.0
+            replica.lag, replica.lsn, replica.healthy, replica.error = float(lag), lsn, True, None
+        except Exception as e:
+            replica.healthy, replica.error = False, str(e)[:200]
+        replica.checked_at = time.time()
+
+    def check(self):
+        for replica in self.replicas:
+            self._measure(replica)
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+    # ---------- 振り分け ----------
+    def note_applied(self, user_id=None):
+        """user_id の書き込みがプライマリに commit された。PostgreSQL ならその時点の LSN を覚える。"""
+        if not self.replicas:
+            return
+        lsn = None
+        if self.primary.dialect.name == "postgresql":
+            try:
+                with self.primary.connect() as conn:
+                    lsn = int(conn.execute(PG_CURRENT_LSN_SQL).scalar())
+            except Exception:
+                pass
+        self.marks.put(user_id, time.time(), lsn)
+
+    def _eligible(self, replica: Replica, written: Optional[Tuple[float, Optional[int]]]) -> bool:
+        if not replica.healthy or replica.lag > self.max_lag:
+            return False
+        if written is None:
+            return True
+        written_at, lsn = written
+        if lsn is not None and replica.lsn is not None:
+            return replica.lsn >= lsn
+        return replica.fresh_as_of > written_at
+
+    def pick(self, user_id=None) -> Optional[Replica]:
+        """読み取りに使うレプリカ。使えるものがなければ None（プライマリを使う）。"""
+        if not self.replicas:
+            return None
+        written = self.marks.get(user_id)
+        with self._lock:
+            candidates = [r for r in self.replicas if self._eligible(r, written)]
+            if not candidates:
+                return None
+            return candidates[next(self._rr) % len(candidates)]
+
+    @contextmanager
+    def session(self, user_id=None):
+        """読み取り用のセッション。SELECT はレプリカ、書き込みはプライマリへ。"""
+        replica = self.pick(user_id)
+        session = RoutingSession(primary=self.primary, replica=replica.engine if replica else None)
+        try:
+            yield session
+        finally:
+            session.close()
+
+    def read(self, fn: Callable[[Session], object], user_id=None):
+        """fn(session) を読み取りセッションで実行する。レプリカで失敗したらプライマリでやり直す。"""
+        replica = self.pick(user_id)
+        if replica is not None:
+            session = RoutingSession(primary=self.primary, replica=replica.engine)
+            try:
+                return fn(session)
+            except DBAPIError as e:
+                replica.healthy, replica.error = False, str(e)[:200]
+            finally:
+                session.close()
+        with Session(self.primary) as session:
+            return fn(session)
+
+    def status(self) -> List[Dict]:
+        return [r.describe() for r in self.replicas]
+
+
+class RoutingSession(Session):
+    """SELECT は replica（指定があれば）、それ以外と flush 中の処理は primary に流すセッション。"""
+
+    def __init__(self, primary, replica=None, **kw):
+        super().__init__(bind=primary, **kw)
+        self.replica = replica
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if self.replica is not None and not self._flushing and isinstance(clause, Select):
+            return self.replica
+        return super().get_bind(mapper, clause=clause, **kw)
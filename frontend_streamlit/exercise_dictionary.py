@@ -0,0 +1,360 @@
+"""
+種目名の辞書（正規名 + 別名インデックス）。
+
+種目名は自由入力なので「ベンチプレス」「ﾍﾞﾝﾁﾌﾟﾚｽ」「Bench Press」が別の系列になってしまいます。
+保存・復元時に resolve() を通して正規名と整数の種目ID（training_records.exercise_id）に
+そろえることで、分析タブの系列を1つにまとめます。
+
+照合の手順:
+  1. normalize() した文字列で別名インデックスを完全一致検索
+     （NFKC で全角/半角をそろえ、小文字化、カタカナ→ひらがな、空白・記号を除去）
+  2. 見つからなければ新しい種目として登録
+
+似た名前（文字トライグラムの Dice 係数が SUGGEST_THRESHOLD 以上）は suggest() で候補として
+返すだけで、自動では寄せません。「Decline Bench Press」と「インクラインベンチプレス」、
+「Hack Squat」と「スクワット」のように綴りが近くても別の種目があるため、画面で利用者が選んだときだけ
+その正規名で保存します。
+
+resolve() は呼び出し元のセッションで flush するだけで commit しません（呼び出し元のトランザクションに
+含まれ、rollback すれば辞書への登録も取り消されます）。メモリ上の索引は commit 後に反映します。
+索引に無い名前は DB から索引を読み直してから照合します。読み直しはトランザクションごとに1回だけなので、
+CSV復元や保存の一括反映で知らない名前が続いても、名前ごとに辞書全体を読み直すことはありません。
+
+training_records.exercise_id は exercises.id を参照する外部キーです。各アプリは記録のテーブルより先に
+create_tables() で辞書のテーブルを作ります。
+"""
+import re
+import threading
+import unicodedata
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import Column, ForeignKey, Integer, String, event, insert, inspect, select, text, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import declarative_base
+
+Base = declarative_base()
+
+SUGGEST_THRESHOLD = 0.6
+SUGGEST_LIMIT = 3
+
+# (正規名, 部位, 別名...)
+SEED_EXERCISES = [
+    ("ベンチプレス", "胸", "Bench Press", "ベンチ", "BP"),
+    ("インクラインベンチプレス", "胸", "Incline Bench Press", "インクラインベンチ"),
+    ("ダンベルフライ", "胸", "Dumbbell Fly", "フライ"),
+    ("スクワット", "脚", "Squat", "バックスクワット", "Back Squat"),
+    ("レッグプレス", "脚", "Leg Press"),
+    ("ルーマニアンデッドリフト", "脚", "Romanian Deadlift", "RDL"),
+    ("デッドリフト", "背中", "Deadlift", "デッド"),
+    ("懸垂", "背中", "Pull Up", "Pull-up", "チンニング", "Chin Up"),
+    ("ラットプルダウン", "背中", "Lat Pulldown", "ラットプル"),
+    ("ベントオーバーロウ", "背中", "Bent Over Row", "Barbell Row", "バーベルロウ"),
+    ("ショルダープレス", "肩", "Shoulder Press", "Overhead Press", "OHP", "ミリタリープレス"),
+    ("サイドレイズ", "肩", "Lateral Raise", "Side Raise", "サイドレイズ"),
+    ("アームカール", "腕", "Biceps Curl", "Barbell Curl", "バーベルカール", "ダンベルカール", "Dumbbell Curl"),
+    ("トライセプスエクステンション", "腕", "Triceps Extension", "フレンチプレス"),
+]
+
+
+class Exercise(Base):
+    __tablename__ = "exercises"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    name = Column(String, unique=True, nullable=False)
+    body_part = Column(String)
+
+
+class ExerciseAlias(Base):
+    __tablename__ = "exercise_aliases"
+    alias = Column(String, primary_key=True)  # normalize() 済みの文字列
+    exercise_id = Column(Integer, ForeignKey("exercises.id"), index=True, nullable=False)
+
+
+# =========================
+# 正規化・トライグラム
+# =========================
+_STRIP = re.compile(r"[\s\-_・･.,/()（）\[\]「」]+")
+
+
+def normalize(name: str) -> str:
+    s = unicodedata.normalize("NFKC", str(name)).lower()
+    # カタカナ → ひらがな（長音記号「ー」はそのまま）
+    s = "".join(chr(ord(c) - 0x60) if "ァ" <= c <= "ヶ" else c for c in s)
+    return _STRIP.sub("", s)
+
+
+def trigrams(norm: str) -> Set[str]:
+    padded = f"^{norm}$"
+    if len(padded) < 3:
+        return {padded}
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+# =========================
+# インデックス
+# =========================
+class ExerciseIndex:
+    """別名 → 種目ID の辞書とトライグラムの転置インデックスをメモリ上に持つ。"""
+
+    def __init__(self):
+        self.aliases: Dict[str, int] = {}
+        self.names: Dict[int, str] = {}
+        self.parts: Dict[int, Optional[str]] = {}
+        self.grams: Dict[str, Set[str]] = {}              # alias -> trigram 集合
+        self.postings: Dict[str, Set[str]] = defaultdict(set)  # trigram -> alias 集合
+        self._lock = threading.Lock()
+
+    def load(self, session):
+        with self._lock:
+            self.aliases.clear()
+            self.names.clear()
+            self.parts.clear()
+            self.grams.clear()
+            self.postings.clear()
+            for exercise_id, name, part in session.execute(select(Exercise.id, Exercise.name, Exercise.body_part)):
+                self.names[exercise_id] = name
+                self.parts[exercise_id] = part
+            for alias, exercise_id in session.execute(select(ExerciseAlias.alias, ExerciseAlias.exercise_id)):
+                self._add_alias(alias, exercise_id)
+
+    def _add_alias(self, alias: str, exercise_id: int):
+        self.aliases[alias] = exercise_id
+        grams = trigrams(alias)
+        self.grams[alias] = grams
+        for g in grams:
+            self.postings[g].add(alias)
+
+    def _scores(self, norm: str) -> Dict[int, float]:
+        """転置インデックスで共通トライグラムを数え、種目ごとの最大の Dice 係数を返す。"""
+        query = trigrams(norm)
+        counts: Dict[str, int] = defaultdict(int)
+        for g in query:
+            for alias in self.postings.get(g, ()):
+                counts[alias] += 1
+        scores: Dict[int, float] = {}
+        for alias, common in counts.items():
+            score = 2 * common / (len(query) + len(self.grams[alias]))
+            exercise_id = self.aliases[alias]
+            if score > scores.get(exercise_id, 0.0):
+                scores[exercise_id] = score
+        return scores
+
+    def fuzzy_match(self, norm: str) -> Tuple[Optional[int], float]:
+        """Dice 係数が最大の種目とその値（候補表示用。resolve() はこれで寄せない）。"""
+        scores = self._scores(norm)
+        if not scores:
+            return None, 0.0
+        best_id = max(scores, key=scores.get)
+        return best_id, scores[best_id]
+
+    def suggest(self, name: str, limit: int = SUGGEST_LIMIT,
+                threshold: float = SUGGEST_THRESHOLD) -> List[Tuple[str, float]]:
+        """
+        登録済みの種目で名前が近いもの（正規名, 係数）を近い順に返す。完全一致する名前なら空。
+        画面で「もしかして」として出し、利用者が選んだ正規名で保存する用途（DBには触れない）。
+        """
+        norm = normalize(name)
+        with self._lock:
+            if not norm or norm in self.aliases:
+                return []
+            scores = self._scores(norm)
+            ranked = sorted(((self.names[i], sc) for i, sc in scores.items() if sc >= threshold),
+                            key=lambda r: -r[1])
+        return ranked[:limit]
+
+    def body_part(self, exercise_id: Optional[int]) -> Optional[str]:
+        return self.parts.get(exercise_id)
+
+    def canonical(self, exercise_id: Optional[int], fallback: str) -> str:
+        """表示用の正規名（種目IDが未設定・不明なら記録の種目名のまま）。"""
+        if exercise_id is None:
+            return fallback
+        return self.names.get(exercise_id, fallback)
+
+    def match(self, name: str) -> Optional[Tuple[int, str]]:
+        """別名として完全一致する登録済みの種目 (種目ID, 正規名)。無ければ None（DBには触れない）。"""
+        norm = normalize(name)
+        with self._lock:
+            exercise_id = self.aliases.get(norm)
+            return (exercise_id, self.names[exercise_id]) if exercise_id is not None else None
+
+    # ---------- 未 commit の登録 ----------
+    def _pending(self, session) -> Dict[str, Tuple[int, str, Optional[str]]]:
+        """このセッションで登録して、まだ commit されていない別名 → (種目ID, 正規名, 部位)。"""
+        key = f"exercise_index:{id(self)}"
+        if key not in session.info:
+            session.info[key] = {}
+            if not session.info.get(key + ":listening"):
+                session.info[key + ":listening"] = True
+                event.listen(session, "after_commit", lambda s: self._apply_pending(s, key))
+                event.listen(session, "after_rollback", lambda s: s.info.pop(key, None))
+        return session.info[key]
+
+    def _apply_pending(self, session, key: str):
+        pending = session.info.pop(key, None) or {}
+        with self._lock:
+            for norm, (exercise_id, name, part) in pending.items():
+                self.names[exercise_id] = name
+                self.parts.setdefault(exercise_id, part)
+                self._add_alias(norm, exercise_id)
+
+    def refresh(self, session):
+        """他のプロセスの登録を読み直す。呼び出し元の未 commit の書き込みが混ざらないよう別の接続で読む。"""
+        bind = session.get_bind()
+        if isinstance(bind, Engine):
+            with bind.connect() as conn:
+                self.load(conn)
+        else:
+            self.load(session)
+
+    def _lookup(self, session, norm: str) -> Optional[Tuple[int, str]]:
+        entry = self._pending(session).get(norm)
+        if entry is not None:
+            return entry[0], entry[1]
+        with self._lock:
+            exercise_id = self.aliases.get(norm)
+            if exercise_id is not None:
+                return exercise_id, self.names[exercise_id]
+        return None
+
+    def _refresh_once(self, session) -> bool:
+        """このトランザクションでまだ読み直していなければ読み直す。読み直したら True。"""
+        key = f"exercise_index:{id(self)}:refreshed"
+        if session.info.get(key):
+            return False
+        if not session.info.get(key + ":listening"):
+            session.info[key + ":listening"] = True
+            event.listen(session, "after_transaction_end",
+                         lambda s, trans: s.info.pop(key, None) if trans.parent is None else None)
+        self.refresh(session)
+        session.info[key] = True
+        return True
+
+    def resolve(self, session, name: str, body_part: Optional[str] = None, create: bool = True
+                ) -> Tuple[Optional[int], str]:
+        """
+        種目名を (種目ID, 正規名) に変換する。別名として完全一致しなければ新しい種目として登録する
+        （flush のみ。commit は呼び出し元が行う）。
+        """
+        display = unicodedata.normalize("NFKC", str(name)).strip()
+        norm = normalize(name)
+        if not norm:
+            return None, display
+        found = self._lookup(session, norm)
+        if found is not None:
+            return found
+
+        # 他のプロセスが登録した可能性があるので読み直してから照合する（トランザクションごとに1回）。
+        # 読み直した後に登録された名前は、下の INSERT が衝突して既存の登録を使うので結果は変わらない
+        if self._refresh_once(session):
+            found = self._lookup(session, norm)
+            if found is not None:
+                return found
+        if not create:
+            return None, display
+
+        # 別のプロセスが同じ名前・別名を同時に登録していたら、そちらの登録を使う
+        _insert_ignore(session, Exercise.__table__, {"name": display, "body_part": body_part}, "name")
+        new_id = session.scalar(select(Exercise.id).where(Exercise.name == display))
+        _insert_ignore(session, ExerciseAlias.__table__, {"alias": norm, "exercise_id": new_id}, "alias")
+        exercise_id, canonical, part = session.execute(
+            select(Exercise.id, Exercise.name, Exercise.body_part)
+            .join(ExerciseAlias, ExerciseAlias.exercise_id == Exercise.id).where(ExerciseAlias.alias == norm)
+        ).one()
+        self._pending(session)[norm] = (exercise_id, canonical, part)
+        return exercise_id, canonical
+
+
+def _insert_ignore(session, table, values: Dict, key: str):
+    """一意キー key が既にあれば何もしない INSERT（呼び出し元のトランザクションは壊さない）。"""
+    dialect = session.get_bind().dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        module = sqlite if dialect == "sqlite" else postgresql
+        session.execute(module.insert(table).values(**values).on_conflict_do_nothing(index_elements=[key]))
+        return
+    try:
+        with session.begin_nested():
+            session.execute(insert(table).values(**values))
+    except IntegrityError:
+        pass
+
+
+# =========================
+# スキーマ・初期データ
+# =========================
+def create_tables(engine):
+    """辞書テーブルを作成する（training_records.exercise_id の参照先なので記録のテーブルより先に）。"""
+    Base.metadata.create_all(bind=engine)
+
+
+def ensure_schema(engine):
+    """
+    辞書テーブルを作成し、既存の training_records に exercise_id 列が無ければ外部キー付きで追加する。
+    外部キーの無い列が既にある PostgreSQL では制約だけを足す（既存行は検証しない NOT VALID）。
+    """
+    create_tables(engine)
+    insp = inspect(engine)
+    columns = {c["name"] for c in insp.get_columns("training_records")}
+    if "exercise_id" not in columns:
+        with engine.begin() as conn:
+            conn.execute(text("ALTER TABLE training_records ADD COLUMN exercise_id INTEGER REFERENCES exercises (id)"))
+            conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_training_records_exercise_id ON training_records (exercise_id)"
+            ))
+    elif engine.dialect.name == "postgresql" and not any(
+        fk["referred_table"] == "exercises" and fk["constrained_columns"] == ["exercise_id"]
+        for fk in insp.get_foreign_keys("training_records")
+    ):
+        with engine.begin() as conn:
+            conn.execute(text(
+                "ALTER TABLE training_records ADD CONSTRAINT fk_training_records_exercise_id "
+                "FOREIGN KEY (exercise_id) REFERENCES exercises (id) NOT VALID"
+            ))
+
+
+def seed(session, entries: Iterable = SEED_EXERCISES):
+    """よく使う種目と別名を登録する（登録済みのものは飛ばす。commit は呼び出し元）。"""
+    existing = {normalize(a) for (a,) in session.execute(select(ExerciseAlias.alias))}
+    for name, part, *aliases in entries:
+        if normalize(name) in existing:
+            continue
+        # 複数プロセスが同時に起動しても、先に登録された種目・別名はそのまま使う
+        _insert_ignore(session, Exercise.__table__, {"name": name, "body_part": part}, "name")
+        exercise_id = session.scalar(select(Exercise.id).where(Exercise.name == name))
+        for alias in {normalize(a) for a in (name, *aliases)} - existing:
+            _insert_ignore(session, ExerciseAlias.__table__, {"alias": alias, "exercise_id": exercise_id}, "alias")
+            existing.add(alias)
+
+
+def backfill_exercise_ids(session, index: ExerciseIndex, record_model) -> int:
+    """
+    exercise_id が未設定の記録に、種目名ごとにまとめて種目IDを入れる（commit は呼び出し元）。
+    記録の種目名（利用者が入力した文字列）は書き換えない。表示は index.canonical() で正規名にそろえる。
+    """
+    names = [n for (n,) in session.execute(
+        select(record_model.exercise).where(record_model.exercise_id.is_(None)).distinct()
+    )]
+    for name in names:
+        exercise_id, _ = index.resolve(session, name)
+        if exercise_id is None:
+            continue
+        session.execute(
+            update(record_model)
+            .where(record_model.exercise == name, record_model.exercise_id.is_(None))
+            .values(exercise_id=exercise_id)
+        )
+    return len(names)
+
+
+def setup(engine, session, record_model) -> ExerciseIndex:
+    """アプリ起動時の初期化: スキーマ確認・初期データ・インデックス構築・既存記録の移行。"""
+    ensure_schema(engine)
+    seed(session)
+    session.commit()
+    index = ExerciseIndex()
+    index.load(session)
+    backfill_exercise_ids(session, index, record_model)
+    session.commit()
+    return index
@@ -0,0 +1,359 @@
+"""
+Streamlit スクリプトの計測（オプトイン）。
+
+「ダッシュボードが遅い」と言われたときに、DB クエリ・load_df の変換・集計・グラフ描画の
+どこに時間がかかっているかを見るための軽い仕組みです。
+
+- start_run() でスクリプト1回の実行を1トレースとして開始し、finish_run() で閉じる
+- span("名前") で各段階を囲む（経過時間とRSSの増減を記録）
+- instrument_engine(engine) で SQLAlchemy のクエリ1本ずつを子スパンとして記録
+- 終わったトレースはセッションごとに直近 RECENT_TRACES 件をメモリに残し（管理者パネル用）、
+  OTLP/JSON 形式で1行ずつファイルに追記する。OTEL_EXPORTER_OTLP_ENDPOINT があれば
+  バックグラウンドで /v1/traces にも送る
+
+環境変数（無効のときの span() は何もしないコンテキストマネージャを返すだけです）:
+  KINTORE_TRACE=1               計測を有効にする
+  KINTORE_TRACE_SAMPLE=0.1      実行の何割を記録するか（既定 1.0）
+  KINTORE_TRACE_FILE=path       JSON の出力先（既定 traces.jsonl。空文字で出力しない）
+  OTEL_EXPORTER_OTLP_ENDPOINT   OTLP/HTTP の送信先（例: http://localhost:4318）
+  OTEL_SERVICE_NAME             service.name（既定 kintore-streamlit）
+"""
+import contextvars
+import json
+import os
+import queue
+import random
+import statistics
+import threading
+import time
+import urllib.request
+from collections import OrderedDict, defaultdict, deque
+from contextlib import contextmanager, nullcontext
+from typing import Dict, List, Optional
+
+from sqlalchemy import event
+
+ENABLED = os.getenv("KINTORE_TRACE", "0").lower() in ("1", "true", "yes")
+SAMPLE_RATE = float(os.getenv("KINTORE_TRACE_SAMPLE", "1.0"))
+TRACE_FILE = os.getenv("KINTORE_TRACE_FILE", "traces.jsonl")
+OTLP_ENDPOINT = os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT", "").rstrip("/")
+SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "kintore-streamlit")
+RECENT_TRACES = 50
+RECENT_SESSIONS = 200  # 直近のトレースを残すセッション数（古いセッションから捨てる）
+OPEN_RUN_TTL = 600.0   # これより長く閉じられていない実行中トレースは捨てる（タブを閉じたセッションなど）
+MAX_SQL_LENGTH = 300
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def rss_bytes() -> Optional[int]:
+    """現在の RSS（Linux のみ。/proc を1回読むだけなので数マイクロ秒）。"""
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _new_id(nbytes: int) -> str:
+    return random.getrandbits(nbytes * 8).to_bytes(nbytes, "big").hex()
+
+
+# =========================
+# トレース・スパン
+# =========================
+class Span:
+    __slots__ = ("name", "span_id", "parent_id", "start_ns", "end_ns", "attributes", "_rss_start")
+
+    def __init__(self, name: str, parent_id: Optional[str], attributes: Optional[Dict] = None):
+        self.name = name
+        self.span_id = _new_id(8)
+        self.parent_id = parent_id
+        self.attributes = dict(attributes or {})
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self._rss_start = rss_bytes()
+
+    def end(self):
+        self.end_ns = time.time_ns()
+        rss = rss_bytes()
+        if rss is not None and self._rss_start is not None:
+            self.attributes["memory.rss_delta_bytes"] = rss - self._rss_start
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e6
+
+
+class Trace:
+    """スクリプト1回分のスパンの集まり。ルートスパンは start_run() の name。"""
+
+    def __init__(self, name: str, attributes: Optional[Dict] = None, session_key=None):
+        self.trace_id = _new_id(16)
+        self.session_key = session_key
+        self.spans: List[Span] = []
+        self.root = self._open(name, None, attributes)
+        self._stack = [self.root]
+
+    def _open(self, name, parent_id, attributes):
+        s = Span(name, parent_id, attributes)
+        self.spans.append(s)
+        return s
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        s = self._open(name, self._stack[-1].span_id, attributes)
+        self._stack.append(s)
+        try:
+            yield s
+        finally:
+            self._stack.pop()
+            s.end()
+
+    def add_sql(self, statement: str, start_ns: int, end_ns: int, rowcount: int):
+        s = self._open("sql", self._stack[-1].span_id, {
+            "db.statement": statement[:MAX_SQL_LENGTH], "db.rowcount": rowcount,
+        })
+        s.start_ns, s.end_ns = start_ns, end_ns
+
+    def finish(self, status: str = "ok"):
+        self.root.attributes["run.status"] = status
+        self.root.end()
+
+    def summary(self) -> List[Dict]:
+        """スパン名ごとの 回数・合計ms・最大ms・RSS増減（ルート以外）。"""
+        rows: Dict[str, Dict] = {}
+        for s in self.spans[1:]:
+            r = rows.setdefault(s.name, {"段階": s.name, "回数": 0, "合計(ms)": 0.0, "最大(ms)": 0.0, "RSS増減(MB)": 0.0})
+            r["回数"] += 1
+            r["合計(ms)"] += s.duration_ms
+            r["最大(ms)"] = max(r["最大(ms)"], s.duration_ms)
+            r["RSS増減(MB)"] += s.attributes.get("memory.rss_delta_bytes", 0) / 2 ** 20
+        return sorted(rows.values(), key=lambda r: -r["合計(ms)"])
+
+    def to_otlp(self) -> Dict:
+        def attrs(d):
+            out = []
+            for k, v in d.items():
+                if isinstance(v, bool):
+                    out.append({"key": k, "value": {"boolValue": v}})
+                elif isinstance(v, int):
+                    out.append({"key": k, "value": {"intValue": str(v)}})
+                elif isinstance(v, float):
+                    out.append({"key": k, "value": {"doubleValue": v}})
+                else:
+                    out.append({"key": k, "value": {"stringValue": str(v)}})
+            return out
+
+        return {"resourceSpans": [{
+            "resource": {"attributes": attrs({"service.name": SERVICE_NAME})},
+            "scopeSpans": [{
+                "scope": {"name": "kintore.instrumentation"},
+                "spans": [{
+                    "traceId": self.trace_id,
+                    "spanId": s.span_id,
+                    **({"parentSpanId": s.parent_id} if s.parent_id else {}),
+                    "name": s.name,
+                    "kind": 3 if s.name == "sql" else 1,  # CLIENT / INTERNAL
+                    "startTimeUnixNano": str(s.start_ns),
+                    "endTimeUnixNano": str(s.end_ns or s.start_ns),
+                    "attributes": attrs(s.attributes),
+                } for s in self.spans],
+            }],
+        }]}
+
+
+# =========================
+# 実行ごとのトレース管理
+# =========================
+_current: contextvars.ContextVar = contextvars.ContextVar("kintore_trace", default=None)
+_recent: "OrderedDict[object, deque[Trace]]" = OrderedDict()  # セッション -> 直近のトレース
+_export_queue: "queue.Queue[Trace]" = queue.Queue(maxsize=1000)
+_file_lock = threading.Lock()
+_exporter: Optional[threading.Thread] = None
+_open_runs: Dict = {}  # セッション -> 実行中のトレース
+_runs_lock = threading.Lock()
+
+
+def _session_key():
+    # Streamlit の実行ごとにスレッドが変わることがあるので、ブラウザのセッションIDで区別する
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        ctx = get_script_run_ctx()
+        if ctx is not None:
+            return ctx.session_id
+    except ImportError:
+        pass
+    return threading.get_ident()
+
+
+def start_run(name: str, **attributes) -> Optional[Trace]:
+    """スクリプトの先頭で呼ぶ。前回の実行が st.rerun() などで途中終了していたら閉じておく。"""
+    key = _session_key()
+    with _runs_lock:
+        previous = _open_runs.pop(key, None)
+        stale = _pop_stale_runs()
+    if previous is not None:
+        _finish(previous, "interrupted")
+    for trace in stale:
+        _finish(trace, "abandoned")
+    if not ENABLED or random.random() >= SAMPLE_RATE:
+        _current.set(None)
+        return None
+    trace = Trace(name, attributes, session_key=key)
+    with _runs_lock:
+        _open_runs[key] = trace
+    _current.set(trace)
+    return trace
+
+
+def _pop_stale_runs() -> List[Trace]:
+    # 例外で finish_run() まで届かなかった実行や、閉じられたタブの実行が残り続けないように
+    cutoff = time.time_ns() - int(OPEN_RUN_TTL * 1e9)
+    stale = [k for k, t in _open_runs.items() if t.root.start_ns < cutoff]
+    return [_open_runs.pop(k) for k in stale]
+
+
+def finish_run():
+    """スクリプトの最後で呼ぶ。"""
+    with _runs_lock:
+        trace = _open_runs.pop(_session_key(), None) or _current.get()
+    _current.set(None)
+    if trace is not None:
+        _finish(trace, "ok")
+
+
+def _finish(trace: Trace, status: str):
+    trace.finish(status)
+    with _runs_lock:
+        traces = _recent.pop(trace.session_key, None) or deque(maxlen=RECENT_TRACES)
+        traces.append(trace)
+        _recent[trace.session_key] = traces
+        while len(_recent) > RECENT_SESSIONS:
+            _recent.popitem(last=False)
+    if TRACE_FILE or OTLP_ENDPOINT:
+        _ensure_exporter()
+        try:
+            _export_queue.put_nowait(trace)
+        except queue.Full:
+            pass  # 書き出しが追いつかないときは捨てる（画面の応答を優先）
+
+
+def span(name: str, **attributes):
+    """計測中ならスパンを開き、そうでなければ何もしない。"""
+    trace = _current.get()
+    if trace is None:
+        return nullcontext()
+    return trace.span(name, **attributes)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current.get()
+
+
+def recent_traces(session_key=None) -> List[Trace]:
+    """このセッション（session_key を指定したらそのセッション）の直近のトレース。"""
+    key = session_key if session_key is not None else _session_key()
+    with _runs_lock:
+        return list(_recent.get(key, ()))
+
+
+# =========================
+# SQL の計測
+# =========================
+def instrument_engine(engine):
+    """エンジンにクエリ計測のイベントを登録する（同じエンジンには1回だけ）。"""
+    if not ENABLED or getattr(engine, "_kintore_instrumented", False):
+        return engine
+    engine._kintore_instrumented = True
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        if _current.get() is not None:
+            conn.info.setdefault("kintore_query_start", []).append(time.time_ns())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        trace = _current.get()
+        starts = conn.info.get("kintore_query_start")
+        if trace is not None and starts:
+            trace.add_sql(statement, starts.pop(), time.time_ns(), cursor.rowcount)
+
+    return engine
+
+
+# =========================
+# 書き出し
+# =========================
+def _ensure_exporter():
+    global _exporter
+    if _exporter is None or not _exporter.is_alive():
+        _exporter = threading.Thread(target=_export_loop, name="kintore-trace-exporter", daemon=True)
+        _exporter.start()
+
+
+def _export_loop():
+    while True:
+        trace = _export_queue.get()
+        payload = trace.to_otlp()
+        if TRACE_FILE:
+            try:
+                line = json.dumps(payload, ensure_ascii=False)
+                with _file_lock, open(TRACE_FILE, "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+            except OSError:
+                pass
+        if OTLP_ENDPOINT:
+            try:
+                req = urllib.request.Request(
+                    f"{OTLP_ENDPOINT}/v1/traces", data=json.dumps(payload).encode("utf-8"),
+                    headers={"Content-Type": "application/json"}, method="POST",
+                )
+                urllib.request.urlopen(req, timeout=5).close()
+            except OSError:
+                pass
+
+
+# =========================
+# 管理者パネル
+# =========================
+def stage_stats(traces=None) -> List[Dict]:
+    """直近のトレース（既定はこのセッションの分）から、スパン名ごとの p50 / p95（1実行あたりの合計ms）を出す。"""
+    per_stage = defaultdict(list)
+    for trace in list(traces if traces is not None else recent_traces()):
+        for row in trace.summary():
+            per_stage[row["段階"]].append(row["合計(ms)"])
+        per_stage["(全体)"].append(trace.root.duration_ms)
+    rows = []
+    for name, values in per_stage.items():
+        values.sort()
+        rows.append({
+            "段階": name, "実行数": len(values),
+            "p50(ms)": round(statistics.median(values), 1),
+            "p95(ms)": round(values[min(len(values) - 1, int(len(values) * 0.95))], 1),
+        })
+    return sorted(rows, key=lambda r: -r["p50(ms)"])
+
+
+def render_panel(st):
+    """このセッションの計測結果の表示（呼び出し側で管理者かどうかを判定してから呼ぶ）。"""
+    with st.expander("🛠 パフォーマンス計測（管理者のみ）"):
+        if not ENABLED:
+            st.info("KINTORE_TRACE=1 を設定すると計測が有効になります。")
+            return
+        finished = [t for t in recent_traces() if t.root.end_ns is not None]
+        if not finished:
+            st.info("まだ計測結果がありません。画面を操作すると記録されます。")
+            return
+        last = finished[-1]
+        st.caption(f"直前の実行: {last.root.duration_ms:.0f} ms（trace_id {last.trace_id}）")
+        st.dataframe([{k: round(v, 1) if isinstance(v, float) else v for k, v in row.items()}
+                      for row in last.summary()], use_container_width=True, hide_index=True)
+        sql = sorted((s for s in last.spans if s.name == "sql"), key=lambda s: -s.duration_ms)[:10]
+        if sql:
+            st.markdown("**時間のかかった SQL**")
+            st.dataframe([{"ms": round(s.duration_ms, 2), "行数": s.attributes.get("db.rowcount"),
+                           "SQL": s.attributes.get("db.statement")} for s in sql],
+                         use_container_width=True, hide_index=True)
+        st.markdown(f"**直近 {len(finished)} 回の実行**")
+        st.dataframe(stage_stats(finished), use_container_width=True, hide_index=True)
@@ -0,0 +1,285 @@
+"""
+種目ごとの重量推移の予測。
+
+説明変数は「記録の通し番号」ではなく「最初の記録からの経過日数」です。
+モデルはすべて numpy だけで閉じた形（または少数回の反復）で解くので、
+1系列あたりの fit はマイクロ秒〜ミリ秒オーダーです。
+
+- linear    : 最小二乗の直線
+- huber     : Huber 損失の直線（IRLS）。外れ値の日に引っ張られにくい
+- theil_sen : 2点間の傾きの中央値による直線
+- log       : y = a + b·log(1 + 日数)。伸びが鈍っていく系列向け
+- plateau   : y = a − b·exp(−日数/τ)。上限（a）に近づく系列向け。τ は格子探索
+
+予測区間は、基底関数で線形化した回帰の標準的な式（t 分布）で出します。
+"""
+import threading
+from collections import OrderedDict
+from datetime import date, timedelta
+from typing import Hashable, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+MODELS = ("linear", "huber", "theil_sen", "log", "plateau")
+
+# 95% 予測区間用の t 分布の両側 2.5% 点（自由度 1〜30）。それ以上は正規近似
+_T975 = [12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+         2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+         2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042]
+_PLATEAU_TAUS = np.geomspace(7, 730, 24)
+
+
+def _to_days(dates) -> np.ndarray:
+    arr = np.asarray(dates)
+    if np.issubdtype(arr.dtype, np.datetime64):
+        return arr.astype("datetime64[D]")
+    if arr.dtype == object and len(arr) and isinstance(arr[0], date):
+        # datetime.date の配列（load_df() の日付列）はそのまま変換できる
+        return arr.astype("datetime64[D]")
+    return pd.to_datetime(pd.Series(dates)).to_numpy(dtype="datetime64[D]")
+
+
+def _t975(dof: int) -> float:
+    if dof <= 0:
+        return float("nan")
+    return _T975[dof - 1] if dof <= len(_T975) else 1.96
+
+
+# =========================
+# 予測結果
+# =========================
+class Forecast:
+    """
+    y = c0 + c1·g(x) の形のフィット結果。g は model ごとの基底関数、x は origin からの日数。
+    """
+
+    def __init__(self, model: str, origin: date, coef: Tuple[float, float], n: int,
+                 resid_scale: float, g_mean: float, g_sxx: float, tau: Optional[float] = None):
+        self.model = model
+        self.origin = origin
+        self.coef = coef
+        self.n = n
+        self.resid_scale = resid_scale
+        self.g_mean = g_mean
+        self.g_sxx = g_sxx
+        self.tau = tau
+
+    def basis(self, x):
+        return _basis(self.model, np.asarray(x, dtype=float), self.tau)
+
+    def days(self, when) -> np.ndarray:
+        when = _to_days(when)
+        return (when - np.datetime64(self.origin, "D")).astype(float)
+
+    def predict(self, when, interval: bool = False):
+        """日付（または日付の配列）の予測値。interval=True なら (予測値, 下限, 上限)。"""
+        g = self.basis(self.days(np.atleast_1d(when)))
+        y = self.coef[0] + self.coef[1] * g
+        if not interval:
+            return y
+        if self.n < 3 or self.g_sxx <= 0:
+            return y, np.full_like(y, np.nan), np.full_like(y, np.nan)
+        half = _t975(self.n - 2) * self.resid_scale * np.sqrt(1 + 1 / self.n + (g - self.g_mean) ** 2 / self.g_sxx)
+        return y, y - half, y + half
+
+    def slope_at(self, when) -> float:
+        """指定日における傾き（kg/週）。"""
+        x = float(self.days([when])[0])
+        eps = 0.5
+        g1, g0 = self.basis([x + eps]), self.basis([max(x - eps, 0.0)])
+        return float(self.coef[1] * (g1 - g0)[0] / (x + eps - max(x - eps, 0.0)) * 7)
+
+
+# =========================
+# フィット
+# =========================
+def _basis(model: str, x: np.ndarray, tau: Optional[float] = None) -> np.ndarray:
+    if model == "log":
+        return np.log1p(np.maximum(x, 0.0))
+    if model == "plateau":
+        return -np.exp(-x / tau)
+    return x
+
+
+def _ols(g: np.ndarray, y: np.ndarray, w: Optional[np.ndarray] = None) -> Tuple[float, float]:
+    if w is None:
+        w = np.ones_like(y)
+    sw = w.sum()
+    gm, ym = (w * g).sum() / sw, (w * y).sum() / sw
+    sxx = (w * (g - gm) ** 2).sum()
+    c1 = (w * (g - gm) * (y - ym)).sum() / sxx if sxx > 0 else 0.0
+    return ym - c1 * gm, c1
+
+
+def _huber(g: np.ndarray, y: np.ndarray, k: float = 1.345, iters: int = 20) -> Tuple[float, float]:
+    coef = _ols(g, y)
+    r = y - (coef[0] + coef[1] * g)
+    # 尺度は最初の残差の MAD で固定する（反復ごとに中央値を取り直さない）
+    scale = np.median(np.abs(r - np.median(r))) / 0.6745
+    if scale <= 0:
+        return coef
+    for _ in range(iters):
+        a = np.abs(r) / scale
+        w = np.where(a <= k, 1.0, k / np.maximum(a, k))
+        new = _ols(g, y, w)
+        if abs(new[0] - coef[0]) + abs(new[1] - coef[1]) < 1e-9 * (1 + abs(coef[0])):
+            return new
+        coef = new
+        r = y - (coef[0] + coef[1] * g)
+    return coef
+
+
+def _theil_sen(g: np.ndarray, y: np.ndarray, max_points: int = 200) -> Tuple[float, float]:
+    if len(g) > max_points:
+        # 点数が多いときは等間隔に間引いてから傾きを求める（O(n²) を抑える）
+        idx = np.linspace(0, len(g) - 1, max_points).astype(int)
+        gs, ys = g[idx], y[idx]
+    else:
+        gs, ys = g, y
+    i, j = np.triu_indices(len(gs), k=1)
+    dg = gs[j] - gs[i]
+    ok = dg != 0
+    slope = float(np.median((ys[j] - ys[i])[ok] / dg[ok])) if ok.any() else 0.0
+    return float(np.median(y - slope * g)), slope
+
+
+def fit_series(dates: Sequence, values: Sequence, model: str = "linear") -> Optional[Forecast]:
+    """1系列をフィットする。点が2つ未満なら None。"""
+    if model not in MODELS:
+        raise ValueError(f"未対応のモデルです: {model}")
+    days = _to_days(dates)
+    y = np.asarray(values, dtype=float)
+    if len(y) < 2:
+        return None
+    origin = days.min()
+    x = (days - origin).astype(float)
+
+    tau = None
+    if model == "plateau":
+        # τ の候補ごとの線形最小二乗を2次元配列でまとめて解き、残差が最小の τ を選ぶ
+        G = -np.exp(-x[:, None] / _PLATEAU_TAUS[None, :])
+        Gc = G - G.mean(axis=0)
+        yc = y - y.mean()
+        sxx = (Gc ** 2).sum(axis=0)
+        c1 = np.divide((Gc * yc[:, None]).sum(axis=0), sxx, out=np.zeros_like(sxx), where=sxx > 0)
+        sse = ((yc[:, None] - Gc * c1) ** 2).sum(axis=0)
+        best = int(np.argmin(sse))
+        tau = float(_PLATEAU_TAUS[best])
+        g = G[:, best]
+        coef = (float(y.mean() - c1[best] * G[:, best].mean()), float(c1[best]))
+    else:
+        g = _basis(model, x)
+        if model == "huber":
+            coef = _huber(g, y)
+        elif model == "theil_sen":
+            coef = _theil_sen(g, y)
+        else:
+            coef = _ols(g, y)
+
+    n = len(y)
+    resid = y - (coef[0] + coef[1] * g)
+    if model in ("huber", "theil_sen"):
+        # ロバスト推定では残差の尺度も MAD で見積もる
+        scale = float(np.median(np.abs(resid - np.median(resid))) / 0.6745)
+    else:
+        scale = float(np.sqrt((resid ** 2).sum() / (n - 2))) if n > 2 else float("nan")
+    g_mean = float(g.mean())
+    return Forecast(model, pd.Timestamp(origin).date(), (float(coef[0]), float(coef[1])), n,
+                    scale, g_mean, float(((g - g_mean) ** 2).sum()), tau)
+
+
+# =========================
+# 複数系列の一括フィット（linear / log）
+# =========================
+def fit_many(daily_df: pd.DataFrame, key: str = "種目", date_col: str = "日付",
+             value_col: str = "重量(kg)", model: str = "linear") -> pd.DataFrame:
+    """
+    全系列の直線（または log）回帰を groupby の合計値から一括で解く。
+    戻り値は key ごとの 切片・傾き(kg/日)・n・残差標準偏差・起点日。
+    """
+    if model not in ("linear", "log"):
+        rows = []
+        for k, grp in daily_df.groupby(key, sort=True):
+            f = fit_series(grp[date_col], grp[value_col], model)
+            if f is not None:
+                rows.append({key: k, "切片": f.coef[0], "傾き": f.coef[1], "n": f.n,
+                             "残差SD": f.resid_scale, "起点日": f.origin})
+        return pd.DataFrame(rows)
+
+    days = pd.to_datetime(daily_df[date_col]).to_numpy(dtype="datetime64[D]").astype(np.int64)
+    codes, uniques = pd.factorize(daily_df[key], sort=True)
+    origin = pd.Series(days).groupby(codes).transform("min").to_numpy()
+    g = _basis(model, (days - origin).astype(float))
+    y = daily_df[value_col].to_numpy(dtype=float)
+
+    m = len(uniques)
+    n = np.bincount(codes, minlength=m).astype(float)
+    sg, sy = np.bincount(codes, g, m), np.bincount(codes, y, m)
+    sgg, sgy, syy = np.bincount(codes, g * g, m), np.bincount(codes, g * y, m), np.bincount(codes, y * y, m)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sxx = sgg - sg * sg / n
+        sxy = sgy - sg * sy / n
+        syy_c = syy - sy * sy / n
+        slope = np.where(sxx > 0, sxy / sxx, 0.0)
+        intercept = (sy - slope * sg) / n
+        sse = np.maximum(syy_c - slope * sxy, 0.0)
+        resid_sd = np.where(n > 2, np.sqrt(sse / (n - 2)), np.nan)
+
+    first = np.full(m, np.iinfo(np.int64).max)
+    np.minimum.at(first, codes, days)
+    out = pd.DataFrame({
+        key: uniques, "切片": intercept, "傾き": slope, "n": n.astype(int),
+        "残差SD": resid_sd, "起点日": first.astype("datetime64[D]"),
+    })
+    return out[out["n"] >= 2].reset_index(drop=True)
+
+
+# =========================
+# キャッシュ
+# =========================
+_CACHE_SIZE = 4096
+_cache: "OrderedDict[Tuple, Optional[Forecast]]" = OrderedDict()
+# Streamlit はセッションごとに別スレッドで動くので、_cache の参照・更新はこのロックの中で行う
+_cache_lock = threading.Lock()
+
+
+def data_version(dates: Sequence, values: Sequence) -> Tuple:
+    """系列が変わったかどうかを判定するためのバージョン値（日付と値の配列全体のハッシュ）。"""
+    y = np.asarray(values, dtype=float)
+    if len(y) == 0:
+        return (0,)
+    days = _to_days(dates).astype(np.int64)
+    return (len(y), hash(days.tobytes()), hash(y.tobytes()))
+
+
+def fit_cached(key: Hashable, dates: Sequence, values: Sequence, model: str = "linear",
+               version: Optional[Hashable] = None) -> Optional[Forecast]:
+    """
+    (key, model, version) ごとにフィット結果を使い回す。
+    key は (user_id, 種目) など。version を省略すると data_version() を使う。
+    """
+    if version is None:
+        version = data_version(dates, values)
+    cache_key = (key, model, version)
+    with _cache_lock:
+        if cache_key in _cache:
+            _cache.move_to_end(cache_key)
+            return _cache[cache_key]
+    # フィットはロックの外で行う（同じ系列を同時に計算しても結果は同じ）
+    forecast = fit_series(dates, values, model)
+    with _cache_lock:
+        _cache[cache_key] = forecast
+        while len(_cache) > _CACHE_SIZE:
+            _cache.popitem(last=False)
+    return forecast
+
+
+def next_session_date(dates: Sequence) -> date:
+    """過去のトレーニング間隔の中央値から次回の日付を見積もる。"""
+    days = np.sort(pd.to_datetime(pd.Series(dates)).to_numpy(dtype="datetime64[D]"))
+    last = pd.Timestamp(days[-1]).date()
+    if len(days) < 2:
+        return last + timedelta(days=7)
+    gap = int(np.median(np.diff(days).astype(int)))
+    return last + timedelta(days=max(gap, 1))
@@ -0,0 +1,395 @@
+"""
+記録保存のライトビハインド（ローカルのジャーナル → バックグラウンドで本番DBへ反映）。
+
+「💾 保存」はローカルの SQLite（WAL, synchronous=FULL）に1件追記した時点で完了とし、
+本番DB（リモートの PostgreSQL など）への書き込みは別スレッドの SaveFlusher がまとめて行います。
+
+- 追記ごとに冪等キー（uuid）を振り、反映時に applied_saves へ同じトランザクションで記録する
+  → 反映後ジャーナルから消す前に落ちても、再送時に二重登録しない
+- 失敗したらジャーナルに残したまま指数バックオフで再試行（入力は失われない）
+- まとめて失敗したときは1件ずつ流し直し、壊れた1件が他の保存を止めないようにする
+- 接続エラー以外で MAX_ATTEMPTS 回失敗した保存は dead_letter に移し、画面から再送・破棄できるようにする
+- 各保存には反映先（DB の URL と記録テーブル）の target を付け、同じジャーナルを別のアプリ・DBと
+  共有していても自分の反映先の保存だけを流す
+- applied_saves は APPLIED_RETENTION 秒より古いものを1時間ごとに消す
+
+まだ反映されていない保存は pending_saves() と applied_keys() で画面の表示に重ねられます
+（training_records.load_df）。
+
+ジャーナルの場所は KINTORE_JOURNAL（既定: ~/.cache/kintore/save_journal.db）。
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import date, datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, delete, insert, select
+from sqlalchemy.exc import DBAPIError, DisconnectionError, InterfaceError, OperationalError
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger("kintore.save_journal")
+
+DEFAULT_PATH = Path.home() / ".cache" / "kintore" / "save_journal.db"
+BATCH_SIZE = 200
+MAX_BACKOFF = 60.0
+MAX_ATTEMPTS = 5                       # 接続エラー以外でこの回数失敗したら dead_letter へ
+APPLIED_RETENTION = 30 * 24 * 3600.0   # applied_saves を残す秒数（これより古い保存の再送は想定しない）
+PRUNE_INTERVAL = 3600.0
+
+metadata = MetaData()
+applied_saves = Table(
+    "applied_saves", metadata,
+    Column("key", String(32), primary_key=True),
+    Column("records", Integer, nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+
+class InvalidEntry(ValueError):
+    """保存の中身が反映先のテーブルに合わない（何度再送しても通らないので、すぐ dead_letter へ）。"""
+
+
+def target_for(engine, record_table: Table) -> str:
+    """反映先（DB の URL・記録テーブル名・列）を表すキー。パスワードは含めない。"""
+    url = engine.url.render_as_string(hide_password=True)
+    source = "|".join([url, record_table.name, ",".join(sorted(record_table.c.keys()))])
+    return hashlib.sha256(source.encode("utf-8")).hexdigest()[:32]
+
+
+def is_transient(error: BaseException) -> bool:
+    """DBに届かない・接続が切れたなど、保存の中身と関係のない失敗か（失敗回数に数えない）。"""
+    if isinstance(error, DBAPIError) and error.connection_invalidated:
+        return True
+    return isinstance(error, (OperationalError, InterfaceError, DisconnectionError, PoolTimeoutError,
+                              ConnectionError))
+
+
+# =========================
+# ローカルジャーナル
+# =========================
+class SaveJournal:
+    """
+    target（target_for() の値）ごとの未反映の保存。別のアプリ・DB向けの保存が同じファイルに
+    あっても、pending() などが返すのは自分の target の分だけ。
+    """
+
+    def __init__(self, path=None, target: str = "", max_attempts: int = MAX_ATTEMPTS):
+        self.path = Path(path or os.getenv("KINTORE_JOURNAL") or DEFAULT_PATH)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.target = target
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # WAL でも FULL にしておけば、追記が返った時点で電源断にも耐える
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS journal ("
+            " key TEXT PRIMARY KEY, target TEXT, user_id INTEGER, payload TEXT NOT NULL, created_at REAL NOT NULL,"
+            " attempts INTEGER NOT NULL DEFAULT 0, last_error TEXT)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS dead_letter ("
+            " key TEXT PRIMARY KEY, target TEXT, user_id INTEGER, payload TEXT NOT NULL, created_at REAL NOT NULL,"
+            " failed_at REAL NOT NULL, attempts INTEGER NOT NULL, last_error TEXT)"
+        )
+        self._migrate()
+        self._conn.execute("CREATE INDEX IF NOT EXISTS journal_target ON journal (target, attempts, created_at)")
+
+    def _migrate(self):
+        # target 列が無かった頃のジャーナル: 反映先が分からない保存は自動では流さず dead_letter に回す
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(journal)")}
+        if "target" not in columns:
+            self._conn.execute("ALTER TABLE journal ADD COLUMN target TEXT")
+        with self._transaction():
+            keys = [k for (k,) in self._conn.execute("SELECT key FROM journal WHERE target IS NULL")]
+            self._conn.execute("UPDATE journal SET last_error = ? WHERE target IS NULL",
+                               ("反映先が記録されていない古い保存です（再送するとこのアプリのDBに反映します）",))
+            self._bury(keys)
+
+    @contextmanager
+    def _transaction(self):
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._conn.execute("COMMIT")
+
+    def _bury(self, keys: Sequence[str]):
+        """journal の keys を dead_letter に移す（トランザクションの中で呼ぶ）。"""
+        now = time.time()
+        for key in keys:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO dead_letter"
+                " SELECT key, target, user_id, payload, created_at, ?, attempts, last_error FROM journal WHERE key = ?",
+                (now, key))
+            self._conn.execute("DELETE FROM journal WHERE key = ?", (key,))
+
+    def append(self, records: Sequence[Dict], user_id: Optional[int] = None) -> str:
+        """1回の保存分の記録を追記して冪等キーを返す。"""
+        key = uuid.uuid4().hex
+        payload = json.dumps([_encode(r) for r in records], ensure_ascii=False)
+        with self._lock:
+            self._conn.execute("INSERT INTO journal (key, target, user_id, payload, created_at) VALUES (?, ?, ?, ?, ?)",
+                               (key, self.target, user_id, payload, time.time()))
+        return key
+
+    def pending(self, limit: int = BATCH_SIZE) -> List[Tuple[str, Optional[int], List[Dict]]]:
+        """未反映の保存を古い順に返す（失敗を繰り返しているものは後回し）。"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, user_id, payload FROM journal WHERE target = ? ORDER BY attempts, created_at LIMIT ?",
+                (self.target, limit)
+            ).fetchall()
+        return [(key, user_id, json.loads(payload)) for key, user_id, payload in rows]
+
+    def pending_saves(self, user_id: Optional[int] = None) -> List[Tuple[str, List[Dict]]]:
+        """画面表示用: まだ本番DBに反映されていない保存 (冪等キー, 記録) を保存した順に。"""
+        sql = "SELECT key, payload FROM journal WHERE target = ?"
+        params: tuple = (self.target,)
+        if user_id is not None:
+            sql, params = sql + " AND user_id = ?", params + (user_id,)
+        with self._lock:
+            rows = self._conn.execute(sql + " ORDER BY created_at", params).fetchall()
+        return [(key, json.loads(payload)) for key, payload in rows]
+
+    def pending_records(self, user_id: Optional[int] = None) -> List[Dict]:
+        """画面表示用: まだ本番DBに反映されていない記録。"""
+        return [r for _, records in self.pending_saves(user_id) for r in records]
+
+    def remove(self, keys: Sequence[str]):
+        with self._lock:
+            self._conn.executemany("DELETE FROM journal WHERE key = ?", [(k,) for k in keys])
+
+    def mark_failed(self, keys: Sequence[str], error: str, count: bool = True, give_up: bool = False) -> List[str]:
+        """
+        失敗を記録する。count なら失敗回数を増やし、max_attempts に達した保存（give_up なら全部）を
+        dead_letter に移す。移したキーを返す。
+        """
+        with self._lock, self._transaction():
+            self._conn.executemany(
+                "UPDATE journal SET attempts = attempts + ?, last_error = ? WHERE key = ?",
+                [(1 if count else 0, error[:500], k) for k in keys])
+            dead = [k for k in keys if give_up or (self._conn.execute(
+                "SELECT attempts FROM journal WHERE key = ?", (k,)).fetchone() or (0,))[0] >= self.max_attempts]
+            self._bury(dead)
+        return dead
+
+    # ---------- 反映できなかった保存 ----------
+    def dead_letters(self, user_id: Optional[int] = None) -> List[Dict]:
+        """このアプリ（と反映先不明の古い保存）で、反映をあきらめた保存。新しい順。"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, payload, created_at, failed_at, attempts, last_error FROM dead_letter"
+                " WHERE (target = ? OR target IS NULL) AND user_id IS ? ORDER BY failed_at DESC",
+                (self.target, user_id)).fetchall()
+        return [{"key": key, "records": json.loads(payload), "created_at": datetime.fromtimestamp(created),
+                 "failed_at": datetime.fromtimestamp(failed), "attempts": attempts, "last_error": error}
+                for key, payload, created, failed, attempts, error in rows]
+
+    def retry(self, key: str):
+        """dead_letter の保存をこのアプリの反映先でジャーナルに戻す（失敗回数は 0 から）。"""
+        with self._lock, self._transaction():
+            self._conn.execute(
+                "INSERT OR IGNORE INTO journal (key, target, user_id, payload, created_at)"
+                " SELECT key, ?, user_id, payload, created_at FROM dead_letter WHERE key = ?", (self.target, key))
+            self._conn.execute("DELETE FROM dead_letter WHERE key = ?", (key,))
+
+    def discard(self, key: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM dead_letter WHERE key = ?", (key,))
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT count(*) FROM journal WHERE target = ?", (self.target,)).fetchone()[0]
+
+
+def _encode(record: Dict) -> Dict:
+    return {k: v.isoformat() if isinstance(v, (date, datetime)) else v for k, v in record.items()}
+
+
+def applied_keys(session, keys: Sequence[str]) -> Set[str]:
+    """keys のうち、本番DBに反映済み（applied_saves にある）もの。"""
+    if not keys:
+        return set()
+    return set(session.scalars(select(applied_saves.c.key).where(applied_saves.c.key.in_(list(keys)))))
+
+
+# =========================
+# 本番DBへの反映
+# =========================
+class SaveFlusher:
+    """
+    ジャーナルを本番DBへ流すバックグラウンドスレッド。
+
+    record_table は training_records の Table、resolve は ExerciseIndex.resolve
+    （種目名 → (種目ID, 正規名)。種目の新規登録でDBに触れるので、画面側ではなくここで呼ぶ）。
+    on_applied は反映を commit したあと（ジャーナルから消す前に）、ユーザーごとに on_applied(user_id) で呼ばれる。
+    on_applied の例外はログに残すだけで、保存の失敗としては数えない（DBには反映済みなので再送しない）。
+    """
+
+    def __init__(self, journal: SaveJournal, engine, record_table: Table,
+                 resolve: Optional[Callable] = None, batch_size: int = BATCH_SIZE, interval: float = 1.0,
+                 on_applied: Optional[Callable] = None):
+        self.journal = journal
+        self.engine = engine
+        self.table = record_table
+        self.resolve = resolve
+        self.on_applied = on_applied
+        self.batch_size = batch_size
+        self.interval = interval
+        self.backoff = 0.0
+        self.last_error: Optional[str] = None
+        self.flushed = 0
+        self._pruned_at = 0.0
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="save-flusher", daemon=True)
+        self._schema_ready = False
+
+    def start(self) -> "SaveFlusher":
+        self._thread.start()
+        return self
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        self._wake.set()
+        self._thread.join(timeout)
+
+    def notify(self):
+        """新しい追記があったことを知らせる（待たずにすぐ反映を試みる）。"""
+        self._wake.set()
+
+    def retry(self, key: str):
+        """dead_letter の保存を再送する（画面の「再送」ボタン用）。"""
+        self.journal.retry(key)
+        self.notify()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.backoff or self.interval)
+            self._wake.clear()
+            try:
+                while self.flush_once():
+                    pass
+                if time.time() - self._pruned_at > PRUNE_INTERVAL:
+                    self.prune_applied()
+                self.backoff = 0.0
+                self.last_error = None
+            except Exception as e:
+                # DBに届かない: ジャーナルに残したまま間隔を空けて再試行
+                self.last_error = str(e)
+                self.backoff = min(MAX_BACKOFF, max(1.0, self.backoff * 2))
+
+    def _rows(self, session, user_id, records: List[Dict]) -> List[Dict]:
+        # user_id を黙って落とす・空で入れると別の人の記録になってしまうので、合わなければ反映しない
+        if ("user_id" in self.table.c) != (user_id is not None):
+            raise InvalidEntry(f"user_id={user_id!r} の保存は {self.table.name} に反映できません")
+        rows = []
+        for r in records:
+            row = dict(r, date=date.fromisoformat(r["date"]))
+            if self.resolve is not None:
+                row["exercise_id"], row["exercise"] = self.resolve(session, r["exercise"], r.get("body_part"))
+            if user_id is not None:
+                row["user_id"] = user_id
+            rows.append({k: v for k, v in row.items() if k in self.table.c})
+        return rows
+
+    def _ensure_schema(self):
+        if not self._schema_ready:
+            # 起動時にDBへ届かなくても画面は動かしたいので、最初の反映時に作る
+            metadata.create_all(self.engine)
+            self._schema_ready = True
+
+    def _apply(self, batch) -> int:
+        """batch を1トランザクションで反映し、反映した記録数を返す。反映済みのキーは飛ばす。"""
+        keys = [key for key, _, _ in batch]
+        self._ensure_schema()
+        with Session(self.engine) as session:
+            done = set(session.scalars(select(applied_saves.c.key).where(applied_saves.c.key.in_(keys))))
+            todo = [(key, self._rows(session, user_id, records)) for key, user_id, records in batch
+                    if key not in done]
+            rows = [row for _, key_rows in todo for row in key_rows]
+            if todo:
+                now = datetime.now()
+                session.execute(insert(applied_saves),
+                                [{"key": key, "records": len(key_rows), "applied_at": now} for key, key_rows in todo])
+                if rows:
+                    session.execute(insert(self.table), rows)
+                session.commit()
+        # ジャーナルから消すと画面の重ね表示も消えるので、その前に読み取り側へ反映を知らせる
+        # （別プロセスが反映済みの保存も、知らせ直して害はない）
+        if self.on_applied is not None:
+            for user_id in {user_id for _, user_id, _ in batch}:
+                try:
+                    self.on_applied(user_id)
+                except Exception:
+                    logger.exception("反映の通知に失敗しました: user_id=%s", user_id)
+        self.journal.remove(keys)
+        return len(rows)
+
+    def _failed(self, key: str, error: Exception):
+        # 接続エラーは保存の中身のせいではないので数えない（DBが戻れば通る）
+        self.journal.mark_failed([key], str(error), count=not is_transient(error),
+                                 give_up=isinstance(error, InvalidEntry))
+
+    def flush_once(self) -> int:
+        """未反映の保存を最大 batch_size 件反映し、処理した保存の件数を返す（0 なら空）。"""
+        batch = self.journal.pending(self.batch_size)
+        if not batch:
+            return 0
+        try:
+            self.flushed += self._apply(batch)
+            return len(batch)
+        except Exception as e:
+            if len(batch) == 1 or is_transient(e):
+                if len(batch) == 1:
+                    self._failed(batch[0][0], e)
+                raise
+        # まとめて失敗したら1件ずつ（別プロセスが先に反映したキーはここで done として飛ばされる）。
+        # 全部失敗するならDB側の問題なので例外を上げて待つ
+        failed = 0
+        for entry in batch:
+            try:
+                self.flushed += self._apply([entry])
+            except Exception as e:
+                failed += 1
+                self._failed(entry[0], e)
+                error = e
+        if failed == len(batch):
+            raise error
+        return len(batch) - failed
+
+    def prune_applied(self, retention: float = APPLIED_RETENTION) -> int:
+        """applied_saves から retention 秒より古い冪等キーを消し、消した件数を返す。"""
+        self._pruned_at = time.time()
+        self._ensure_schema()
+        cutoff = datetime.fromtimestamp(time.time() - retention)
+        with Session(self.engine) as session:
+            deleted = session.execute(delete(applied_saves).where(applied_saves.c.applied_at < cutoff)).rowcount
+            session.commit()
+        return deleted
+
+
+def start(engine, record_table: Table, resolve: Optional[Callable] = None, path=None,
+          on_applied: Optional[Callable] = None) -> Tuple[SaveJournal, SaveFlusher]:
+    """ジャーナルを開いてフラッシャーを起動する（Streamlit では st.cache_resource で1回だけ呼ぶ）。"""
+    journal = SaveJournal(path, target_for(engine, record_table))
+    flusher = SaveFlusher(journal, engine, record_table, resolve, on_applied=on_applied)
+    try:
+        # 画面の読み込み（applied_keys）で applied_saves を引くので、DBに届くなら先に作っておく
+        flusher._ensure_schema()
+    except Exception:
+        pass
+    return journal, flusher.start()
@@ -0,0 +1,37 @@
+import sys
+from pathlib import Path
+
+import pytest
+from sqlalchemy import Column, Date, Float, ForeignKey, Integer, String, create_engine
+from sqlalchemy.orm import declarative_base
+
+FRONTEND_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(FRONTEND_DIR))
+sys.path.insert(1, str(FRONTEND_DIR.parent))
+
+import exercise_dictionary  # noqa: E402
+
+RecordBase = declarative_base()
+
+
+class TrainingRecord(RecordBase):
+    """アプリ（app_login.py）と同じ形の training_records。"""
+    __tablename__ = "training_records"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, index=True)
+    date = Column(Date, index=True)
+    body_part = Column(String, index=True)
+    exercise = Column(String, index=True)
+    exercise_id = Column(Integer, ForeignKey(exercise_dictionary.Exercise.id), index=True)
+    weight = Column(Float)
+    reps = Column(Integer)
+    volume = Column(Float)
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/app.db")
+    exercise_dictionary.create_tables(engine)
+    RecordBase.metadata.create_all(engine)
+    yield engine
+    engine.dispose()
@@ -0,0 +1,49 @@
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+from calendar_heatmap import CalendarGrid, iso_calendar, to_days
+
+
+def _expected(dates):
+    iso = pd.Series(pd.to_datetime(dates)).dt.isocalendar()
+    return iso["year"].to_numpy(), iso["week"].to_numpy(), iso["day"].to_numpy() - 1
+
+
+def test_iso_calendar_matches_pandas_for_every_day():
+    # 1970-01-01 より前（日数が負）も含めて、毎日 pandas の isocalendar と一致する
+    dates = pd.date_range("1968-01-01", "2032-12-31", freq="D")
+    got = iso_calendar(to_days(dates))
+    for g, e in zip(got, _expected(dates)):
+        np.testing.assert_array_equal(g, e)
+
+
+def test_year_boundaries():
+    cases = {
+        date(2020, 12, 31): (2020, 53, 3),  # 53週ある年
+        date(2021, 1, 1): (2020, 53, 4),    # 1月1日が前の ISO 年の週
+        date(2021, 1, 3): (2020, 53, 6),
+        date(2021, 1, 4): (2021, 1, 0),
+        date(2019, 12, 30): (2020, 1, 0),   # 12月末が次の ISO 年の第1週
+        date(2026, 12, 31): (2026, 53, 3),
+        date(2027, 1, 1): (2026, 53, 4),
+        date(2027, 1, 4): (2027, 1, 0),
+    }
+    year, week, weekday = iso_calendar(to_days(list(cases)))
+    assert list(zip(year.tolist(), week.tolist(), weekday.tolist())) == list(cases.values())
+    for g, e in zip((year, week, weekday), _expected(list(cases))):
+        np.testing.assert_array_equal(g, e)
+
+
+def test_grid_puts_new_year_days_in_the_prior_iso_year():
+    df = pd.DataFrame({"日付": [date(2020, 12, 31), date(2021, 1, 1), date(2021, 1, 4)],
+                       "ボリューム": [100.0, 200.0, 300.0]})
+    grid = CalendarGrid(df)
+    assert grid.years.tolist() == [2020, 2021]
+    total = grid.total()
+    assert total[0, 52, 3] == 100.0 and total[0, 52, 4] == 200.0
+    assert total[1, 0, 0] == 300.0
+    assert total.sum() == 600.0
+    m = grid.year_matrix(2020, total)
+    assert m.shape == (7, 53) and m[4, 52] == 200.0
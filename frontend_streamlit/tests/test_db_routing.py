@@ -0,0 +1,187 @@
+import contextlib
+import gc
+import time
+from datetime import date
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session
+
+import db_routing
+from conftest import RecordBase, TrainingRecord
+
+
+def _add(engine, user_id=1, weight=60):
+    with Session(engine) as session:
+        session.add(TrainingRecord(user_id=user_id, date=date(2024, 1, 1), body_part="胸", exercise="ベンチプレス",
+                                   weight=weight, reps=10, volume=weight * 10))
+        session.commit()
+
+
+def _weights(router, user_id=1):
+    return router.read(lambda s: [r.weight for r in s.query(TrainingRecord).filter_by(user_id=user_id)],
+                       user_id=user_id)
+
+
+@pytest.fixture
+def replica_url(tmp_path):
+    # レプリカ役の SQLite（プライマリとは別ファイル。中身は手で揃える）
+    url = f"sqlite:///{tmp_path}/replica.db"
+    engine = create_engine(url)
+    RecordBase.metadata.create_all(engine)
+    engine.dispose()
+    return url
+
+
+@pytest.fixture
+def lag():
+    return {"value": 0.0}
+
+
+@pytest.fixture
+def router(engine, replica_url, lag, tmp_path):
+    router = db_routing.ReadRouter(engine, replica_url, check_seconds=3600, lag_fn=lambda conn: lag["value"],
+                                   marks=db_routing.ReadMarks(tmp_path / "marks.db"))
+    yield router
+    router.stop()
+
+
+def test_reads_go_to_replica(engine, router):
+    _add(engine, weight=60)
+    _add(router.replicas[0].engine, weight=99)
+    assert _weights(router) == [99]
+
+
+def test_lagging_replica_falls_back_to_primary(engine, router, lag):
+    _add(engine, weight=60)
+    lag["value"] = router.max_lag + 1
+    router.check()
+    assert router.pick(1) is None
+    assert _weights(router) == [60]
+    lag["value"] = 0.0
+    router.check()
+    assert router.pick(1) is router.replicas[0]
+
+
+def test_read_after_write_uses_primary_until_replica_catches_up(engine, router):
+    _add(engine, weight=60)
+    router.note_applied(1)
+    # 反映後の確認がまだなので、このユーザーはプライマリから読む（他のユーザーはレプリカ）
+    assert _weights(router) == [60]
+    assert router.pick(2) is router.replicas[0]
+    time.sleep(0.01)
+    router.check()
+    assert router.pick(1) is router.replicas[0]
+
+
+def test_marks_are_shared_between_processes(engine, replica_url, tmp_path):
+    routers = [db_routing.ReadRouter(engine, replica_url, check_seconds=3600,
+                                     marks=db_routing.ReadMarks(tmp_path / "marks.db")) for _ in range(2)]
+    try:
+        routers[0].note_applied(1)
+        assert routers[1].pick(1) is None
+    finally:
+        for r in routers:
+            r.stop()
+
+
+def test_failed_replica_fails_over(engine, router):
+    _add(engine, weight=60)
+    with router.replicas[0].engine.begin() as conn:
+        conn.exec_driver_sql("DROP TABLE training_records")
+    assert _weights(router) == [60]
+    assert not router.replicas[0].healthy
+    assert router.pick(1) is None
+
+
+def test_check_thread_stops(engine, replica_url, tmp_path):
+    router = db_routing.ReadRouter(engine, replica_url, check_seconds=0.01,
+                                   marks=db_routing.ReadMarks(tmp_path / "marks.db"))
+    thread = router._thread
+    router.stop()
+    assert not thread.is_alive()
+
+    # stop() を呼ばずに捨てられたルーターも、スレッドごと止まる
+    router = db_routing.ReadRouter(engine, replica_url, check_seconds=0.01,
+                                   marks=db_routing.ReadMarks(tmp_path / "marks.db"))
+    thread = router._thread
+    del router
+    gc.collect()
+    thread.join(1)
+    assert not thread.is_alive()
+
+
+def test_write_behind_save_is_visible_before_and_after_flush(engine, router, tmp_path):
+    import exercise_dictionary as ed
+    import save_journal
+    import training_records
+
+    with Session(engine) as session:
+        index = ed.setup(engine, session, TrainingRecord)
+    journal = save_journal.SaveJournal(tmp_path / "journal.db")
+    seen = []
+
+    def on_applied(user_id):
+        # ジャーナルから消える前に呼ばれる（重ね表示が消える前にプライマリ読みへ切り替わる）
+        seen.append(len(journal))
+        router.note_applied(user_id)
+
+    flusher = save_journal.SaveFlusher(journal, engine, TrainingRecord.__table__, index.resolve, on_applied=on_applied)
+    with router.replicas[0].engine.begin() as conn:
+        save_journal.metadata.create_all(conn)
+    journal.append([{"date": date(2024, 1, 1), "body_part": "胸", "exercise": "ベンチプレス", "weight": 60,
+                     "reps": 10, "volume": 600}], user_id=1)
+
+    # 反映前: レプリカには無いが、ジャーナルを重ねて表示する
+    df = training_records.load_df(router, TrainingRecord, index, 1, journal=journal)
+    assert df["重量(kg)"].tolist() == [60] and df["ID"].isna().all()
+
+    # 反映後: レプリカはまだ追いついていないので、プライマリから読む
+    flusher.flush_once()
+    assert seen == [1]
+    df = training_records.load_df(router, TrainingRecord, index, 1, journal=journal)
+    assert df["重量(kg)"].tolist() == [60] and df["ID"].notna().all()
+
+
+class _StubPgEngine:
+    """PG_STATUS_SQL に決まった行を返す PostgreSQL 役のエンジン。"""
+
+    def __init__(self, row):
+        self.row = row
+        self.url = make_url("postgresql://replica/kintore")
+        self.dialect = type("Dialect", (), {"name": "postgresql"})()
+
+    @contextlib.contextmanager
+    def connect(self):
+        engine = self
+
+        class Conn:
+            dialect = engine.dialect
+
+            def execute(self, sql):
+                assert sql is db_routing.PG_STATUS_SQL
+                return type("Result", (), {"one": lambda _: engine.row})()
+
+        yield Conn()
+
+
+def test_disconnected_replica_is_unhealthy_despite_zero_lag(engine, replica_url, tmp_path):
+    router = db_routing.ReadRouter(engine, replica_url, check_seconds=3600,
+                                   marks=db_routing.ReadMarks(tmp_path / "marks.db"))
+    try:
+        replica = router.replicas[0]
+        replica.engine = _StubPgEngine((0.0, 1000, True))
+        router.check()
+        assert (replica.healthy, replica.lag, replica.lsn) == (True, 0.0, 1000)
+        assert router.pick(1) is replica
+
+        # WAL receiver が切れている（receive = replay なので遅延は 0 に見える）
+        replica.engine = _StubPgEngine((0.0, 1000, False))
+        router.check()
+        assert not replica.healthy
+        assert "not streaming" in replica.error
+        assert router.pick(1) is None
+    finally:
+        router.stop()
+    assert "pg_stat_wal_receiver" in str(db_routing.PG_STATUS_SQL)
@@ -0,0 +1,132 @@
+from datetime import date
+
+import pytest
+from sqlalchemy import create_engine, inspect, select, text
+from sqlalchemy.orm import Session
+
+import exercise_dictionary as ed
+from conftest import TrainingRecord
+
+
+@pytest.fixture
+def index(engine):
+    with Session(engine) as session:
+        return ed.setup(engine, session, TrainingRecord)
+
+
+def _aliases(engine):
+    with Session(engine) as session:
+        return dict(session.execute(select(ed.ExerciseAlias.alias, ed.ExerciseAlias.exercise_id)).all())
+
+
+@pytest.mark.parametrize("name", ["ﾍﾞﾝﾁﾌﾟﾚｽ", "bench press", "Bench-Press", "BP", "べんちぷれす"])
+def test_spelling_variants_resolve_to_canonical(engine, index, name):
+    with Session(engine) as session:
+        _, canonical = index.resolve(session, name)
+    assert canonical == "ベンチプレス"
+
+
+# 綴りは近いが別の種目（以前は Dice 係数 0.6 以上で自動的に寄せていた）
+@pytest.mark.parametrize("name, lookalike", [
+    ("Decline Bench Press", "インクラインベンチプレス"),
+    ("Hack Squat", "スクワット"),
+    ("Sumo Deadlift", "デッドリフト"),
+    ("スミスベンチプレス", "ベンチプレス"),
+    ("Dumbbell Row", "ダンベルフライ"),
+    ("ダンベルベンチプレス", "ベンチプレス"),
+    ("Close Grip Bench Press", "ベンチプレス"),
+])
+def test_lookalike_exercises_are_not_merged(engine, index, name, lookalike):
+    with Session(engine) as session:
+        exercise_id, canonical = index.resolve(session, name)
+        session.commit()
+    assert canonical == name
+    assert exercise_id not in {i for i, n in index.names.items() if n == lookalike}
+    # 誤った別名が登録されて後続の入力まで寄せられることもない
+    assert _aliases(engine)[ed.normalize(name)] == exercise_id
+    with Session(engine) as session:
+        assert index.resolve(session, name)[0] == exercise_id
+
+
+def test_fuzzy_matches_are_only_suggestions(engine, index):
+    assert [name for name, _ in index.suggest("Hack Squat")] == ["スクワット"]
+    assert index.suggest("ベンチプレス") == []
+    assert ed.normalize("Hack Squat") not in _aliases(engine)
+
+
+def test_resolve_does_not_commit_and_rollback_discards(engine, index):
+    with Session(engine) as session:
+        exercise_id, _ = index.resolve(session, "Hack Squat")
+        assert exercise_id is not None
+        # 同じトランザクション内の2回目は同じ ID
+        assert index.resolve(session, "hack squat")[0] == exercise_id
+        with Session(engine) as other:
+            assert other.scalar(select(ed.Exercise).where(ed.Exercise.name == "Hack Squat")) is None
+        session.rollback()
+    assert ed.normalize("Hack Squat") not in index.aliases
+    assert ed.normalize("Hack Squat") not in _aliases(engine)
+
+
+def test_commit_updates_in_memory_index(engine, index):
+    with Session(engine) as session:
+        exercise_id, _ = index.resolve(session, "Hack Squat", "脚")
+        session.commit()
+    assert index.aliases[ed.normalize("Hack Squat")] == exercise_id
+    assert index.body_part(exercise_id) == "脚"
+
+
+def test_concurrent_registration_reuses_the_winner(engine, index, monkeypatch):
+    other = ed.ExerciseIndex()
+    with Session(engine) as session:
+        other.load(session)
+    with Session(engine) as session:
+        winner, _ = index.resolve(session, "Hack Squat")
+        session.commit()
+    # 読み直す前に同じ名前を登録しようとした別プロセス
+    monkeypatch.setattr(other, "refresh", lambda session: None)
+    with Session(engine) as session:
+        assert other.resolve(session, "Hack Squat")[0] == winner
+        session.commit()
+
+
+def test_backfill_keeps_original_text(engine):
+    with Session(engine) as session:
+        session.add_all([
+            TrainingRecord(user_id=1, date=date(2026, 1, 5), body_part="胸", exercise="ﾍﾞﾝﾁﾌﾟﾚｽ",
+                           weight=60, reps=5, volume=300),
+            TrainingRecord(user_id=1, date=date(2026, 1, 5), body_part="脚", exercise="Hack Squat",
+                           weight=80, reps=8, volume=640),
+        ])
+        session.commit()
+        index = ed.setup(engine, session, TrainingRecord)
+        rows = session.execute(select(TrainingRecord.exercise, TrainingRecord.exercise_id)).all()
+    assert [name for name, _ in rows] == ["ﾍﾞﾝﾁﾌﾟﾚｽ", "Hack Squat"]
+    assert all(exercise_id is not None for _, exercise_id in rows)
+    assert [index.canonical(i, n) for n, i in rows] == ["ベンチプレス", "Hack Squat"]
+
+
+def test_unknown_names_reload_the_index_once_per_transaction(engine, index, monkeypatch):
+    refreshes = []
+    original = index.refresh
+    monkeypatch.setattr(index, "refresh", lambda session: refreshes.append(1) or original(session))
+    with Session(engine) as session:
+        for name in ["Hack Squat", "Cable Fly", "Face Pull", "ベンチプレス"]:
+            index.resolve(session, name)
+        assert len(refreshes) == 1
+        session.commit()
+        # commit 後の次のトランザクションでは、他のプロセスの登録を拾うためにまた読み直す
+        index.resolve(session, "Nordic Curl")
+        assert len(refreshes) == 2
+        session.rollback()
+
+
+def test_exercise_id_references_exercises(engine, tmp_path):
+    assert inspect(engine).get_foreign_keys("training_records")[0]["referred_table"] == "exercises"
+    # exercise_id 列の無い古いDBには外部キー付きで追加する
+    old = create_engine(f"sqlite:///{tmp_path}/old.db")
+    with old.begin() as conn:
+        conn.execute(text("CREATE TABLE training_records (id INTEGER PRIMARY KEY, exercise VARCHAR)"))
+    ed.ensure_schema(old)
+    fks = inspect(old).get_foreign_keys("training_records")
+    assert [(fk["constrained_columns"], fk["referred_table"]) for fk in fks] == [(["exercise_id"], "exercises")]
+    old.dispose()
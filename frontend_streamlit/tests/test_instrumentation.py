@@ -0,0 +1,51 @@
+import pytest
+
+import instrumentation as obs
+
+
+@pytest.fixture
+def traced(monkeypatch):
+    monkeypatch.setattr(obs, "ENABLED", True)
+    monkeypatch.setattr(obs, "SAMPLE_RATE", 1.0)
+    monkeypatch.setattr(obs, "TRACE_FILE", "")
+    monkeypatch.setattr(obs, "OTLP_ENDPOINT", "")
+    monkeypatch.setattr(obs, "_recent", obs.OrderedDict())
+    monkeypatch.setattr(obs, "_open_runs", {})
+    session = {"key": "a"}
+    monkeypatch.setattr(obs, "_session_key", lambda: session["key"])
+    return session
+
+
+def _run(name):
+    obs.start_run(name)
+    with obs.span("load_df"):
+        pass
+    obs.finish_run()
+
+
+def test_recent_traces_are_per_session(traced):
+    _run("a1")
+    traced["key"] = "b"
+    _run("b1")
+    _run("b2")
+    assert [t.root.name for t in obs.recent_traces("a")] == ["a1"]
+    assert [t.root.name for t in obs.recent_traces()] == ["b1", "b2"]
+    assert {row["段階"] for row in obs.stage_stats()} == {"load_df", "(全体)"}
+
+
+def test_old_sessions_are_dropped(traced, monkeypatch):
+    monkeypatch.setattr(obs, "RECENT_SESSIONS", 2)
+    for key in ["a", "b", "c"]:
+        traced["key"] = key
+        _run(key)
+    assert list(obs._recent) == ["b", "c"]
+
+
+def test_stale_open_runs_are_evicted(traced):
+    obs.start_run("abandoned")  # finish_run() まで届かなかった実行
+    obs._open_runs["a"].root.start_ns -= int((obs.OPEN_RUN_TTL + 1) * 1e9)
+    traced["key"] = "b"
+    _run("b1")
+    assert "a" not in obs._open_runs
+    [trace] = obs.recent_traces("a")
+    assert trace.root.attributes["run.status"] == "abandoned"
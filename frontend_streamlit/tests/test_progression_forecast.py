@@ -0,0 +1,93 @@
+from datetime import date, timedelta
+
+import numpy as np
+import pytest
+
+import progression_forecast as pf
+
+START = date(2026, 1, 1)
+
+
+def _series(days, f):
+    x = np.asarray(days, dtype=float)
+    return np.array([START + timedelta(days=int(d)) for d in days], dtype=object), f(x)
+
+
+def test_fit_series_needs_two_points_and_known_model():
+    dates, values = _series([0], lambda x: 60 + x)
+    assert pf.fit_series(dates, values) is None
+    with pytest.raises(ValueError):
+        pf.fit_series(*_series([0, 7], lambda x: 60 + x), model="cubic")
+
+
+@pytest.mark.parametrize("model", ["linear", "huber", "theil_sen"])
+def test_straight_line_models_recover_slope_in_kg_per_week(model):
+    # 不規則な間隔で 1日 0.25kg ずつ伸びる系列（= 1.75kg/週）
+    dates, values = _series([0, 3, 4, 10, 17, 18, 30, 41], lambda x: 60 + 0.25 * x)
+    f = pf.fit_series(dates, values, model)
+    assert f.origin == START
+    assert f.coef == pytest.approx((60.0, 0.25))
+    assert f.slope_at(START + timedelta(days=20)) == pytest.approx(1.75)
+    assert f.predict(START + timedelta(days=50))[0] == pytest.approx(72.5)
+
+
+def test_robust_models_ignore_an_outlier_day():
+    dates, values = _series(range(0, 60, 3), lambda x: 60 + 0.25 * x)
+    values[5] += 40
+    assert abs(pf.fit_series(dates, values, "linear").coef[1] - 0.25) > 0.05
+    assert pf.fit_series(dates, values, "huber").coef[1] == pytest.approx(0.25, abs=0.01)
+    assert pf.fit_series(dates, values, "theil_sen").coef[1] == pytest.approx(0.25)
+
+
+def test_log_model_slows_down():
+    dates, values = _series(range(0, 120, 4), lambda x: 50 + 10 * np.log1p(x))
+    f = pf.fit_series(dates, values, "log")
+    assert f.coef == pytest.approx((50.0, 10.0))
+    # 傾きは b / (1 + x) [kg/日] を週に直したもの
+    assert f.slope_at(START + timedelta(days=69)) == pytest.approx(10 / 70 * 7, rel=1e-3)
+    assert f.slope_at(START + timedelta(days=100)) < f.slope_at(START + timedelta(days=20))
+
+
+def test_plateau_model_finds_the_ceiling():
+    tau = pf._PLATEAU_TAUS[10]
+    dates, values = _series(range(0, 365, 5), lambda x: 100 - 30 * np.exp(-x / tau))
+    f = pf.fit_series(dates, values, "plateau")
+    assert f.tau == pytest.approx(tau)
+    assert f.coef == pytest.approx((100.0, 30.0))
+    assert f.predict(START + timedelta(days=3000))[0] == pytest.approx(100.0, abs=0.01)
+
+
+def test_prediction_interval_widens_away_from_data():
+    rng = np.random.default_rng(0)
+    dates, values = _series(range(0, 60, 2), lambda x: 60 + 0.2 * x + rng.normal(0, 1, len(x)))
+    f = pf.fit_series(dates, values)
+    _, lo, hi = f.predict([START + timedelta(days=30), START + timedelta(days=120)], interval=True)
+    assert (lo < hi).all()
+    assert hi[1] - lo[1] > hi[0] - lo[0]
+
+
+def test_next_session_date_uses_median_gap():
+    dates = [START, START + timedelta(days=2), START + timedelta(days=5), START + timedelta(days=8)]
+    assert pf.next_session_date(np.array(dates, dtype=object)) == START + timedelta(days=11)
+    assert pf.next_session_date([START]) == START + timedelta(days=7)
+
+
+def test_data_version_changes_with_any_value_or_date():
+    dates, values = _series([0, 7, 14], lambda x: 60 + x)
+    base = pf.data_version(dates, values)
+    # 合計・最終値・最終日が同じでも中身が違えば別バージョン
+    swapped = values.copy()
+    swapped[[0, 1]] = swapped[[1, 0]]
+    assert pf.data_version(dates, swapped) != base
+    moved = dates.copy()
+    moved[1] = START + timedelta(days=8)
+    assert pf.data_version(moved, values) != base
+    assert pf.data_version(dates, values.copy()) == base
+
+
+def test_fit_cached_reuses_until_data_changes():
+    dates, values = _series([0, 7, 14], lambda x: 60 + x)
+    first = pf.fit_cached(("test", "ベンチプレス"), dates, values)
+    assert pf.fit_cached(("test", "ベンチプレス"), dates, values.copy()) is first
+    values[0] += 1
+    assert pf.fit_cached(("test", "ベンチプレス"), dates, values) is not first
@@ -0,0 +1,180 @@
+import sqlite3
+from datetime import date, datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine, func, insert, select
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+import db_routing
+import exercise_dictionary as ed
+import save_journal
+import training_records
+from conftest import TrainingRecord
+
+RECORD = {"date": date(2024, 1, 1), "body_part": "胸", "exercise": "bench press", "weight": 60, "reps": 10,
+          "volume": 600}
+
+
+@pytest.fixture
+def index(engine):
+    with Session(engine) as session:
+        return ed.setup(engine, session, TrainingRecord)
+
+
+@pytest.fixture
+def journal(engine, tmp_path):
+    return save_journal.SaveJournal(tmp_path / "journal.db", save_journal.target_for(engine, TrainingRecord.__table__))
+
+
+def _flusher(journal, engine, index=None):
+    # スレッドは起動せず flush_once() を直接呼ぶ
+    return save_journal.SaveFlusher(journal, engine, TrainingRecord.__table__, index.resolve if index else None)
+
+
+def _count(engine):
+    with Session(engine) as session:
+        return session.execute(select(func.count()).select_from(TrainingRecord)).scalar()
+
+
+def test_flush_applies_and_is_idempotent(engine, journal, index):
+    key = journal.append([RECORD], user_id=1)
+    flusher = _flusher(journal, engine, index)
+    assert flusher.flush_once() == 1
+    assert len(journal) == 0
+    with Session(engine) as session:
+        rec = session.scalars(select(TrainingRecord)).one()
+        assert (rec.user_id, rec.exercise) == (1, "ベンチプレス")
+        assert save_journal.applied_keys(session, [key]) == {key}
+    # 反映後・ジャーナルから消す前に落ちた場合の再送
+    journal._conn.execute("INSERT INTO journal (key, target, user_id, payload, created_at) VALUES (?, ?, 1, ?, 0)",
+                          (key, journal.target, '[{"date": "2024-01-01", "exercise": "x", "weight": 1, "reps": 1,'
+                                                ' "volume": 1}]'))
+    flusher.flush_once()
+    assert _count(engine) == 1
+
+
+def test_only_own_target_is_drained(engine, journal, tmp_path):
+    other_engine = create_engine(f"sqlite:///{tmp_path}/other.db")
+    TrainingRecord.metadata.create_all(other_engine)
+    other = save_journal.SaveJournal(journal.path, save_journal.target_for(other_engine, TrainingRecord.__table__))
+    journal.append([RECORD], user_id=1)
+    other.append([RECORD], user_id=2)
+    assert _flusher(journal, engine).flush_once() == 1
+    assert _count(engine) == 1
+    assert len(other) == 1 and other.pending_records(2)
+    assert _flusher(other, other_engine).flush_once() == 1
+    assert _count(other_engine) == 1
+    other_engine.dispose()
+
+
+def test_legacy_entries_without_target_are_not_drained(engine, tmp_path):
+    path = tmp_path / "legacy.db"
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE journal (key TEXT PRIMARY KEY, user_id INTEGER, payload TEXT NOT NULL,"
+                 " created_at REAL NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, last_error TEXT)")
+    conn.execute("INSERT INTO journal (key, user_id, payload, created_at) VALUES ('old', 1, ?, 0)",
+                 ('[{"date": "2024-01-01", "exercise": "x", "weight": 1, "reps": 1, "volume": 1}]',))
+    conn.commit()
+    conn.close()
+    journal = save_journal.SaveJournal(path, save_journal.target_for(engine, TrainingRecord.__table__))
+    assert len(journal) == 0
+    [dead] = journal.dead_letters(1)
+    assert dead["key"] == "old"
+    journal.retry("old")
+    assert _flusher(journal, engine).flush_once() == 1
+    assert _count(engine) == 1
+
+
+def test_missing_user_id_goes_to_dead_letter(engine, journal):
+    journal.append([RECORD])  # user_id 列のあるテーブルに user_id なしの保存
+    with pytest.raises(save_journal.InvalidEntry):
+        _flusher(journal, engine).flush_once()
+    assert len(journal) == 0 and _count(engine) == 0
+    assert len(journal.dead_letters()) == 1
+
+
+def test_failures_are_capped_but_connection_errors_do_not_count(engine, journal, monkeypatch):
+    key = journal.append([RECORD], user_id=1)
+    flusher = _flusher(journal, engine)
+    monkeypatch.setattr(flusher, "_apply", lambda batch: (_ for _ in ()).throw(
+        OperationalError("SELECT 1", {}, Exception("could not connect"))))
+    for _ in range(save_journal.MAX_ATTEMPTS + 1):
+        with pytest.raises(OperationalError):
+            flusher.flush_once()
+    assert len(journal) == 1
+
+    monkeypatch.setattr(flusher, "_apply", lambda batch: (_ for _ in ()).throw(ValueError("bad row")))
+    for _ in range(save_journal.MAX_ATTEMPTS):
+        with pytest.raises(ValueError):
+            flusher.flush_once()
+    assert len(journal) == 0
+    [dead] = journal.dead_letters(1)
+    assert (dead["key"], dead["attempts"], dead["last_error"]) == (key, save_journal.MAX_ATTEMPTS, "bad row")
+    journal.discard(key)
+    assert journal.dead_letters(1) == []
+
+
+def test_on_applied_errors_do_not_fail_the_save(engine, journal, caplog):
+    journal.append([RECORD], user_id=1)
+    journal.append([RECORD], user_id=2)
+    notified = []
+
+    def on_applied(user_id):
+        notified.append(user_id)
+        raise RuntimeError("marks unavailable")
+
+    flusher = save_journal.SaveFlusher(journal, engine, TrainingRecord.__table__, on_applied=on_applied)
+    assert flusher.flush_once() == 2
+    # DBには反映済みなので、通知に失敗してもジャーナルから消え、再送・dead_letter にはしない
+    assert sorted(notified) == [1, 2]
+    assert len(journal) == 0 and journal.dead_letters() == []
+    assert _count(engine) == 2 and flusher.flushed == 2
+    assert "反映の通知に失敗しました" in caplog.text
+
+
+def test_prune_applied(engine, journal):
+    flusher = _flusher(journal, engine)
+    journal.append([RECORD], user_id=1)
+    flusher.flush_once()
+    with Session(engine) as session:
+        session.execute(insert(save_journal.applied_saves),
+                        [{"key": "old", "records": 1, "applied_at": datetime.now() - timedelta(days=31)}])
+        session.commit()
+    assert flusher.prune_applied() == 1
+    with Session(engine) as session:
+        assert session.execute(select(func.count()).select_from(save_journal.applied_saves)).scalar() == 1
+
+
+def test_load_df_overlays_pending_saves(engine, journal, index):
+    router = db_routing.ReadRouter(engine)
+    flusher = _flusher(journal, engine, index)
+    flusher._ensure_schema()
+    journal.append([RECORD], user_id=1)
+    journal.append([dict(RECORD, user_id=2)], user_id=2)
+
+    df = training_records.load_df(router, TrainingRecord, index, 1, journal=journal)
+    assert len(df) == 1 and df["ID"].isna().all()
+    assert df["種目"].tolist() == ["ベンチプレス"]
+
+    # 反映後は DB の行だけ（二重に出ない）
+    flusher.flush_once()
+    df = training_records.load_df(router, TrainingRecord, index, 1, journal=journal)
+    assert len(df) == 1 and df["ID"].notna().all()
+
+
+def test_load_df_does_not_drop_saves_applied_after_journal_read(engine, journal, index, monkeypatch):
+    # ジャーナルを読んでから DB を読むまでの間に反映された保存も、消えずに1回だけ出る
+    router = db_routing.ReadRouter(engine)
+    flusher = _flusher(journal, engine, index)
+    journal.append([RECORD], user_id=1)
+    pending_saves = journal.pending_saves
+
+    def pending_then_flush(user_id=None):
+        saves = pending_saves(user_id)
+        flusher.flush_once()
+        return saves
+
+    monkeypatch.setattr(journal, "pending_saves", pending_then_flush)
+    df = training_records.load_df(router, TrainingRecord, index, 1, journal=journal)
+    assert len(df) == 1 and df["ID"].notna().all()
@@ -0,0 +1,61 @@
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+from training_load import ALL_PARTS, TrainingLoadEngine
+
+START = date(2026, 1, 1)
+
+
+def _frame(rows):
+    """rows: (ID, 何日目, 部位, ボリューム)"""
+    return pd.DataFrame([{"ID": i, "日付": START + timedelta(days=d), "部位": part, "ボリューム": vol}
+                         for i, d, part, vol in rows])
+
+
+def _assert_same_as_backfill(engine, df, as_of):
+    full, _ = TrainingLoadEngine.backfill(df, user_id=1)
+    assert set(engine.states) == set(full.states)
+    for _, part in full.states:
+        got, want = engine.metrics(1, part, as_of=as_of), full.metrics(1, part, as_of=as_of)
+        np.testing.assert_allclose([got[k] for k in engine.names], [want[k] for k in full.names])
+    assert engine.last_id == full.last_id
+
+
+def _history():
+    rng = np.random.default_rng(0)
+    return [(i + 1, int(d), part, float(v)) for i, (d, part, v) in enumerate(zip(
+        np.sort(rng.integers(0, 60, 40)), rng.choice(["胸", "脚", "背中"], 40), rng.uniform(500, 3000, 40)))]
+
+
+def test_sync_after_appends_matches_backfill():
+    rows = _history()
+    engine, _ = TrainingLoadEngine.backfill(_frame(rows[:25]), user_id=1)
+    for n in (30, 31, 40):
+        engine.sync(_frame(rows[:n]), user_id=1)
+    _assert_same_as_backfill(engine, _frame(rows), as_of=START + timedelta(days=70))
+
+
+def test_sync_of_back_dated_inserts_matches_backfill():
+    rows = _history()
+    engine, _ = TrainingLoadEngine.backfill(_frame(rows), user_id=1)
+    # 新しい ID で過去の日付の記録（新しい部位を含む）を入れる
+    rows += [(41, 3, "胸", 1200.0), (42, 10, "肩", 800.0), (43, 0, "脚", 2500.0)]
+    engine.sync(_frame(rows), user_id=1)
+    _assert_same_as_backfill(engine, _frame(rows), as_of=START + timedelta(days=70))
+    assert engine.metrics(1, ALL_PARTS)
+
+
+def test_sync_with_shuffled_ids_matches_backfill():
+    rows = _history()
+    rng = np.random.default_rng(1)
+    ids = rng.permutation(len(rows)) + 1
+    shuffled = [(int(i), d, part, v) for i, (_, d, part, v) in zip(ids, rows)]
+    # ID 順ではなく日付順に届く（最大 ID より小さい ID の記録も後から反映される）
+    engine, _ = TrainingLoadEngine.backfill(_frame(shuffled[:20]), user_id=1)
+    engine.sync(_frame(shuffled[:20][::-1] + shuffled[20:]), user_id=1)
+    _assert_same_as_backfill(engine, _frame(shuffled), as_of=START + timedelta(days=70))
+    # 同じ記録をもう一度渡しても二重に数えない
+    engine.sync(_frame(shuffled), user_id=1)
+    _assert_same_as_backfill(engine, _frame(shuffled), as_of=START + timedelta(days=70))
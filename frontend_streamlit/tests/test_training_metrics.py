@@ -0,0 +1,71 @@
+from datetime import date
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from training_metrics import compute_set_metrics, e1rm
+
+
+def _frame(rows):
+    return pd.DataFrame(rows, columns=["ID", "日付", "部位", "種目", "重量(kg)", "回数", "ボリューム"])
+
+
+def test_e1rm_formulas():
+    assert e1rm(100, 5) == pytest.approx(100 * (1 + 5 / 30))
+    assert e1rm(100, 5, "Brzycki") == pytest.approx(100 * 36 / 32)
+    assert e1rm(100, 5, "Lombardi") == pytest.approx(100 * 5 ** 0.1)
+    # Brzycki は 37回以上でも発散しない
+    assert np.isfinite(e1rm([100, 100], [36, 50], "Brzycki")).all()
+    np.testing.assert_allclose(e1rm([100, 60], [1, 10]), [100 * 31 / 30, 80.0])
+    with pytest.raises(ValueError):
+        e1rm(100, 5, "Wathan")
+
+
+def test_pr_flags_follow_date_order():
+    df = _frame([
+        (3, date(2026, 1, 9), "胸", "ベンチプレス", 80.0, 3, 240.0),
+        (1, date(2026, 1, 5), "胸", "ベンチプレス", 70.0, 5, 350.0),
+        (2, date(2026, 1, 7), "胸", "ベンチプレス", 70.0, 8, 560.0),
+        (4, date(2026, 1, 12), "胸", "ベンチプレス", 75.0, 5, 375.0),
+    ])
+    out = compute_set_metrics(df)
+    assert out["ID"].tolist() == [1, 2, 3, 4]
+    assert out["重量PR"].tolist() == [True, False, True, False]
+    # 70kg×8回（推定1RM 88.7）は 80kg×3回（88.0）を上回る
+    assert out["1RM_PR"].tolist() == [True, True, False, False]
+    # 回数別: 5回は 70→75kg で更新、8回・3回は初回
+    assert out["回数別PR"].tolist() == [True, True, True, True]
+    assert out.loc[3, "強度(%)"] == pytest.approx(75 / (70 * (1 + 8 / 30)) * 100)
+
+
+def test_pr_flags_are_grouped_by_body_part_and_exercise():
+    df = _frame([
+        (1, date(2026, 1, 5), "肩", "プレス", 50.0, 5, 250.0),
+        (2, date(2026, 1, 6), "脚", "プレス", 150.0, 5, 750.0),
+        (3, date(2026, 1, 7), "肩", "プレス", 55.0, 5, 275.0),
+    ])
+    out = compute_set_metrics(df)
+    # 脚のレッグプレスの重量は肩のプレスの PR 判定に影響しない
+    assert out["重量PR"].tolist() == [True, True, True]
+    assert out["回数別PR"].tolist() == [True, True, True]
+
+
+def test_rep_codes_tolerate_missing_reps():
+    df = _frame([
+        (1, date(2026, 1, 5), "胸", "ベンチプレス", 60.0, 5, 300.0),
+        (2, date(2026, 1, 6), "胸", "ベンチプレス", 65.0, None, None),
+        (3, date(2026, 1, 7), "胸", "ベンチプレス", 62.5, 5, 312.5),
+    ])
+    out = compute_set_metrics(df)
+    assert out["回数別PR"].tolist() == [True, False, True]
+    assert out["重量PR"].tolist() == [True, True, False]
+
+    only_missing = _frame([(1, date(2026, 1, 5), "胸", "ベンチプレス", 60.0, None, None)])
+    assert compute_set_metrics(only_missing)["回数別PR"].tolist() == [False]
+
+
+def test_empty_frame_keeps_metric_columns():
+    out = compute_set_metrics(_frame([]))
+    assert out.empty
+    assert {"1RM", "重量PR", "回数別PR", "1RM_PR", "強度(%)"} <= set(out.columns)
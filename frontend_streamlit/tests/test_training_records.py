@@ -0,0 +1,67 @@
+from datetime import date
+
+import pytest
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+import db_routing
+import exercise_dictionary as ed
+import training_records
+from conftest import TrainingRecord
+
+BACKUP = (
+    "ID,日付,部位,種目,重量(kg),回数,ボリューム\n"
+    "1,2024-01-01,胸,ベンチプレス,60,10,600\n"
+    "2,2024-01-02,,スクワット,80,5,400\n"
+    "3,2024-01-03,その他,ファーマーズウォーク,40,1,40\n"
+).encode("utf-8")
+
+
+@pytest.fixture
+def index(engine):
+    with Session(engine) as session:
+        return ed.setup(engine, session, TrainingRecord)
+
+
+def _count(engine, table):
+    with Session(engine) as session:
+        return session.execute(select(func.count()).select_from(table)).scalar()
+
+
+def test_restore_fills_only_blank_body_parts(engine, index):
+    with Session(engine) as session:
+        records, _ = training_records.restore_csv(session, TrainingRecord, index, BACKUP, user_id=1)
+        session.commit()
+        # 空欄は辞書の部位、CSV に書かれた「その他」はそのまま
+        assert [r.body_part for r in records] == ["胸", "脚", "その他"]
+
+
+def test_restore_rolls_back_completely(engine, index):
+    exercises = _count(engine, ed.Exercise.__table__)
+    with Session(engine) as session:
+        records, _ = training_records.restore_csv(session, TrainingRecord, index, BACKUP, user_id=1)
+        session.flush()
+        assert len(records) == 3
+        session.rollback()
+    assert _count(engine, TrainingRecord.__table__) == 0
+    assert _count(engine, ed.Exercise.__table__) == exercises
+    assert "ファーマーズウォーク" not in index.names.values()
+
+
+def test_load_df_filters_user_and_sorts_by_date(engine, index):
+    with Session(engine) as session:
+        session.add_all([
+            TrainingRecord(user_id=1, date=date(2024, 1, 3), body_part="胸", exercise="bench press",
+                           weight=60, reps=10, volume=600),
+            TrainingRecord(user_id=1, date=date(2024, 1, 1), body_part="脚", exercise="スクワット",
+                           weight=80, reps=5, volume=400),
+            TrainingRecord(user_id=2, date=date(2024, 1, 2), body_part="胸", exercise="ベンチプレス",
+                           weight=50, reps=8, volume=400),
+        ])
+        session.commit()
+    router = db_routing.ReadRouter(engine)
+    df = training_records.load_df(router, TrainingRecord, index, user_id=1)
+    assert list(df.columns) == training_records.COLUMNS
+    assert list(df["日付"]) == [date(2024, 1, 1), date(2024, 1, 3)]
+    assert len(training_records.load_df(router, TrainingRecord, index)) == 3
+    assert training_records.load_df(router, TrainingRecord, index, user_id=3).empty
@@ -0,0 +1,152 @@
+"""
+トレーニング負荷の指標（ACWR・EWMA の疲労/体力）を差分更新で計算するエンジン。
+
+日ごとの負荷（ボリューム合計）を L_d として、休養日は負荷 0 とみなした指数移動平均
+
+    EWMA_d = λ・L_d + (1 − λ)・EWMA_{d-1}     （λ = 2 / (N + 1)）
+
+を (ユーザー, 部位) ごとに持ちます。EWMA は線形なので、
+最終日から gap 日後の記録は「(1 − λ)^gap 倍してから λ・L を足す」だけで反映でき、
+1セット追加するたびの更新は履歴の長さに関係なく O(1) です。
+
+- 疲労（fatigue） : N = 7 日
+- 慢性負荷（chronic）: N = 28 日
+- 体力（fitness） : N = 42 日
+- ACWR = fatigue / chronic、コンディション（form）= fitness − fatigue
+
+初回は backfill() で全履歴を日×キーの2次元配列にまとめ、pandas の ewm で一括計算します。
+"""
+from datetime import date
+from typing import Dict, Hashable, Optional, Set, Tuple
+
+import numpy as np
+import pandas as pd
+
+ALL_PARTS = "全体"
+SPANS = {"fatigue": 7, "chronic": 28, "fitness": 42}
+
+
+class LoadState:
+    """1キー分の EWMA 状態（最終日時点の値）。"""
+
+    __slots__ = ("last_date", "values")
+
+    def __init__(self, last_date: date, values: np.ndarray):
+        self.last_date = last_date
+        self.values = values
+
+
+class TrainingLoadEngine:
+    def __init__(self, spans: Optional[Dict[str, int]] = None):
+        self.spans = dict(spans or SPANS)
+        self.names = list(self.spans)
+        self.lambdas = np.array([2 / (n + 1) for n in self.spans.values()])
+        self.states: Dict[Tuple[Hashable, str], LoadState] = {}
+        self.last_id: Optional[int] = None
+        # 取り込み済みの記録ID（ID が最大値より小さい記録が後から反映されても取りこぼさない）
+        self.ids: Set[int] = set()
+
+    # =========================
+    # 差分更新
+    # =========================
+    def _add(self, key, d: date, load: float):
+        state = self.states.get(key)
+        if state is None:
+            self.states[key] = LoadState(d, self.lambdas * load)
+            return
+        gap = (d - state.last_date).days
+        if gap >= 0:
+            state.values = state.values * (1 - self.lambdas) ** gap + self.lambdas * load
+            state.last_date = d
+        else:
+            # 過去日付の記録: その日の寄与を現在まで減衰させて足す
+            state.values = state.values + self.lambdas * load * (1 - self.lambdas) ** (-gap)
+
+    def add(self, user_id, body_part: str, d: date, load: float):
+        """1セット（または1日分）の負荷を部位別と全体の両方に反映する。"""
+        self._add((user_id, body_part), d, load)
+        self._add((user_id, ALL_PARTS), d, load)
+
+    def sync(self, df: pd.DataFrame, user_id=None):
+        """
+        load_df() の結果のうち、まだ取り込んでいない ID の行だけを反映する（結果は backfill() と同じ）。
+        user_id 列が無い場合は引数の user_id を使う。
+        """
+        if df.empty:
+            return
+        new = df[~df["ID"].isin(self.ids)]
+        if new.empty:
+            return
+        users = new["user_id"] if "user_id" in new.columns else [user_id] * len(new)
+        for uid, d, part, vol in zip(users, pd.to_datetime(new["日付"]).dt.date, new["部位"], new["ボリューム"]):
+            self.add(uid, part, d, float(vol))
+        self.ids.update(new["ID"].astype(int))
+        self.last_id = max(self.last_id or 0, int(new["ID"].max()))
+
+    # =========================
+    # 参照
+    # =========================
+    def metrics(self, user_id, body_part: str = ALL_PARTS, as_of: Optional[date] = None) -> Dict[str, float]:
+        """as_of 日時点（省略時は最終記録日）の各指標。"""
+        state = self.states.get((user_id, body_part))
+        if state is None:
+            return {}
+        values = state.values
+        if as_of is not None and as_of > state.last_date:
+            values = values * (1 - self.lambdas) ** (as_of - state.last_date).days
+        out = dict(zip(self.names, values.tolist()))
+        out["acwr"] = out["fatigue"] / out["chronic"] if out["chronic"] > 0 else float("nan")
+        out["form"] = out["fitness"] - out["fatigue"]
+        return out
+
+    # =========================
+    # 一括計算
+    # =========================
+    @classmethod
+    def backfill(cls, df: pd.DataFrame, user_id=None, spans: Optional[Dict[str, int]] = None,
+                 until: Optional[date] = None) -> Tuple["TrainingLoadEngine", pd.DataFrame]:
+        """
+        全履歴から状態を一括で作り、日ごとの推移も返す。
+
+        戻り値の DataFrame は 日付・user_id・部位・fatigue・chronic・fitness・acwr・form 列の縦持ち。
+        """
+        engine = cls(spans)
+        if df.empty:
+            return engine, pd.DataFrame(columns=["日付", "user_id", "部位"] + engine.names + ["acwr", "form"])
+
+        days = pd.to_datetime(df["日付"]).to_numpy(dtype="datetime64[D]")
+        users = df["user_id"].to_numpy() if "user_id" in df.columns else np.full(len(df), user_id, dtype=object)
+        vol = df["ボリューム"].to_numpy(dtype=float)
+        base = pd.DataFrame({"日付": days, "user_id": users, "部位": df["部位"].to_numpy(), "負荷": vol})
+        both = pd.concat([base, base.assign(部位=ALL_PARTS)], ignore_index=True)
+
+        # 日 × (user_id, 部位) の密な負荷行列（記録の無い日は 0）
+        first = days.min()
+        last = max(days.max(), np.datetime64(until, "D")) if until else days.max()
+        grid = pd.date_range(first, last, freq="D")
+        load = both.pivot_table(index="日付", columns=["user_id", "部位"], values="負荷",
+                                aggfunc="sum", fill_value=0.0).reindex(grid, fill_value=0.0)
+
+        # 先頭に 0 の行を足して EWMA の初期値を 0 にそろえる
+        padded = pd.concat([pd.DataFrame(0.0, index=[grid[0] - pd.Timedelta(days=1)], columns=load.columns), load])
+        curves = {}
+        for name, span in engine.spans.items():
+            curves[name] = padded.ewm(alpha=2 / (span + 1), adjust=False).mean().iloc[1:]
+
+        # 状態はキーごとの最終記録日の値で持つ
+        last_seen = both.groupby(["user_id", "部位"])["日付"].max()
+        for key in load.columns:
+            key_last = pd.Timestamp(last_seen[key])
+            values = np.array([curves[name].at[key_last, key] for name in engine.names])
+            engine.states[key] = LoadState(key_last.date(), values)
+        if "ID" in df.columns:
+            engine.last_id = int(df["ID"].max())
+            engine.ids = set(df["ID"].astype(int))
+
+        history = pd.concat({name: c.stack(["user_id", "部位"], future_stack=True)
+                             for name, c in curves.items()}, axis=1)
+        history.index.names = ["日付", "user_id", "部位"]
+        history = history.reset_index()
+        history["acwr"] = history["fatigue"] / history["chronic"].where(history["chronic"] > 0)
+        history["form"] = history["fitness"] - history["fatigue"]
+        return engine, history
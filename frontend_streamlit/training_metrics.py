@@ -0,0 +1,135 @@
+"""
+トレーニング指標の計算（推定1RM・PR判定・ボリューム）。
+
+load_df() と同じ列（日付, 部位, 種目, 重量(kg), 回数, ボリューム）の DataFrame を受け取り、
+種目ごとのループではなく全体に対する1回の NumPy 演算 / groupby で計算します。
+"""
+import numpy as np
+import pandas as pd
+
+E1RM_FORMULAS = ("Epley", "Brzycki", "Lombardi")
+
+
+# =========================
+# 推定1RM
+# =========================
+def e1rm(weight, reps, formula: str = "Epley"):
+    """重量と回数（スカラーでも配列でも可）から推定1RMを計算する。"""
+    w = np.asarray(weight, dtype=float)
+    r = np.asarray(reps, dtype=float)
+    if formula == "Epley":
+        return w * (1 + r / 30)
+    if formula == "Brzycki":
+        # 37回以上では分母が0以下になるため上限を設ける
+        return w * 36 / (37 - np.minimum(r, 36))
+    if formula == "Lombardi":
+        return w * np.power(r, 0.1)
+    raise ValueError(f"未対応の1RM推定式です: {formula}")
+
+
+# =========================
+# セット単位の指標
+# =========================
+def _running_best(values: np.ndarray, codes: np.ndarray) -> np.ndarray:
+    """codes ごとの累積最大値（行は codes 内で時系列順に並んでいる前提）。"""
+    return pd.Series(values).groupby(codes, sort=False).cummax().to_numpy()
+
+
+def _is_new_best(values: np.ndarray, running_best: np.ndarray, codes: np.ndarray) -> np.ndarray:
+    """直前までの最大値を上回った（またはグループ最初の）行で True。"""
+    prev_best = pd.Series(running_best).groupby(codes, sort=False).shift().to_numpy()
+    return np.isnan(prev_best) | (values > prev_best)
+
+
+def compute_set_metrics(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    セットごとの指標を追加した新しい DataFrame を返す（元の df は変更しない）。
+
+    追加する列:
+      1RM_Epley / 1RM_Brzycki / 1RM_Lombardi : 各式による推定1RM
+      1RM            : 画面表示用（Epley）
+      重量PR         : その部位・種目でそれまでの最大重量を更新したセット
+      回数別PR       : 同じ部位・種目・同じ回数でそれまでの最大重量を更新したセット（回数が空欄なら False）
+      1RM_PR         : その部位・種目でそれまでの推定1RM（Epley）を更新したセット
+      強度(%)        : その時点までの種目別最大推定1RMに対する重量の割合
+    """
+    if df.empty:
+        extra = [f"1RM_{f}" for f in E1RM_FORMULAS] + ["1RM", "重量PR", "回数別PR", "1RM_PR", "強度(%)"]
+        return pd.DataFrame(columns=list(df.columns) + extra)
+
+    # (部位, 種目)・日付を整数コードにしてから並べ替え、以降の groupby も整数キーで行う
+    # （同じ種目名でも部位が違えば別の種目として PR を判定する）
+    ex_codes = df.groupby(["部位", "種目"], sort=True, dropna=False).ngroup().to_numpy()
+    day_codes = pd.to_datetime(df["日付"]).to_numpy(dtype="datetime64[D]").astype(np.int64)
+    keys = [day_codes, ex_codes]
+    if "ID" in df.columns:
+        keys.insert(0, df["ID"].to_numpy())
+    order = np.lexsort(keys)
+    out = df.iloc[order].reset_index(drop=True)
+    ex_codes = ex_codes[order]
+
+    weight = out["重量(kg)"].to_numpy(dtype=float)
+    reps = out["回数"].to_numpy(dtype=float)
+    for formula in E1RM_FORMULAS:
+        out[f"1RM_{formula}"] = e1rm(weight, reps, formula)
+    out["1RM"] = out["1RM_Epley"]
+
+    # 回数が空欄の行は種目ごとに1つの枠（max_reps + 1）へまとめ、回数別PRにはしない
+    has_reps = ~np.isnan(reps)
+    max_reps = int(np.nanmax(reps)) if has_reps.any() else 0
+    rep_slots = np.where(has_reps, reps, max_reps + 1).astype(np.int64)
+    rep_codes = ex_codes.astype(np.int64) * (max_reps + 2) + rep_slots
+    best_weight = _running_best(weight, ex_codes)
+    best_rm = _running_best(out["1RM"].to_numpy(), ex_codes)
+    best_at_reps = _running_best(weight, rep_codes)
+    out["重量PR"] = _is_new_best(weight, best_weight, ex_codes)
+    out["1RM_PR"] = _is_new_best(out["1RM"].to_numpy(), best_rm, ex_codes)
+    out["回数別PR"] = _is_new_best(weight, best_at_reps, rep_codes) & has_reps
+
+    out["強度(%)"] = weight / best_rm * 100
+    return out
+
+
+# =========================
+# 集計
+# =========================
+def session_summary(metrics_df: pd.DataFrame) -> pd.DataFrame:
+    """日付×部位×種目ごとのセット数・総回数・トン数・最大重量・最大推定1RM。"""
+    if metrics_df.empty:
+        return pd.DataFrame(columns=["日付", "部位", "種目", "セット数", "総回数", "トン数(kg)", "最大重量(kg)", "最大1RM"])
+    tonnage = metrics_df["ボリューム"].fillna(metrics_df["重量(kg)"] * metrics_df["回数"])
+    return (
+        metrics_df.assign(_tonnage=tonnage)
+        .groupby(["日付", "部位", "種目"], sort=True)
+        .agg(
+            セット数=("回数", "size"),
+            総回数=("回数", "sum"),
+            **{"トン数(kg)": ("_tonnage", "sum"), "最大重量(kg)": ("重量(kg)", "max")},
+            最大1RM=("1RM", "max"),
+        )
+        .reset_index()
+    )
+
+
+def daily_max(metrics_df: pd.DataFrame) -> pd.DataFrame:
+    """種目×日付ごとの最大重量・最大推定1RM（グラフ用）。"""
+    return (
+        metrics_df.groupby(["種目", "日付"], sort=True)
+        .agg(**{"重量(kg)": ("重量(kg)", "max"), "1RM": ("1RM", "max")})
+        .reset_index()
+    )
+
+
+def pr_table(metrics_df: pd.DataFrame) -> pd.DataFrame:
+    """種目ごとの自己ベスト（最大重量とその日付、最大推定1RM）。"""
+    if metrics_df.empty:
+        return pd.DataFrame(columns=["種目", "最大重量(kg)", "達成日", "最大1RM"])
+    idx = metrics_df.groupby("種目", sort=True)["重量(kg)"].idxmax()
+    best = metrics_df.loc[idx, ["種目", "重量(kg)", "日付"]].rename(columns={"重量(kg)": "最大重量(kg)", "日付": "達成日"})
+    best_rm = metrics_df.groupby("種目", sort=True)["1RM"].max().rename("最大1RM")
+    return best.merge(best_rm, left_on="種目", right_index=True).reset_index(drop=True)
+
+
+def rep_max_table(metrics_df: pd.DataFrame) -> pd.DataFrame:
+    """種目×回数ごとの最大重量（レップマックス表）。"""
+    return metrics_df.pivot_table(index="種目", columns="回数", values="重量(kg)", aggfunc="max")
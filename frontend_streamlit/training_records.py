@@ -0,0 +1,114 @@
+"""
+training_records の読み込み（load_df）とバックアップCSVからの復元。
+
+3つのアプリと benchmarks/bench_hot_paths.py が同じ処理を使うためのモジュールです
+（Streamlit のスクリプトは import できないので、計測したい処理はここに置きます）。
+
+load_df に save_journal のジャーナルを渡すと、まだDBに反映されていない保存も ID が空の行として
+重ねて返します（保存直後の画面にも記録が出る）。
+"""
+from datetime import date
+from typing import Dict, List, Tuple
+
+import pandas as pd
+
+import save_journal
+from kintore_common.csv_import import DEFAULT_BODY_PART, import_training_csv
+
+COLUMNS = ["ID", "日付", "部位", "種目", "重量(kg)", "回数", "ボリューム"]
+
+
+def to_frame(recs, index) -> pd.DataFrame:
+    """ORM の記録を画面用の日本語列の DataFrame にする（種目は辞書の正規名）。"""
+    if not recs:
+        return pd.DataFrame(columns=COLUMNS)
+    return pd.DataFrame([{
+        "ID": r.id,
+        "日付": r.date,
+        "部位": r.body_part,
+        "種目": index.canonical(r.exercise_id, r.exercise),
+        "重量(kg)": r.weight,
+        "回数": r.reps,
+        "ボリューム": r.volume
+    } for r in recs])
+
+
+def pending_frame(saves, index) -> pd.DataFrame:
+    """ジャーナルの未反映の保存を to_frame と同じ列にする（ID は空。種目は登録済みなら正規名）。"""
+    rows = []
+    for _, records in saves:
+        for r in records:
+            match = index.match(r["exercise"])
+            rows.append({
+                "ID": None,
+                "日付": date.fromisoformat(r["date"]),
+                "部位": r.get("body_part") or DEFAULT_BODY_PART,
+                "種目": match[1] if match else r["exercise"],
+                "重量(kg)": r["weight"],
+                "回数": r["reps"],
+                "ボリューム": r["volume"]
+            })
+    return pd.DataFrame(rows, columns=COLUMNS)
+
+
+def load_df(router, model, index, user_id=None, journal=None) -> pd.DataFrame:
+    """
+    全件（user_id を指定したらそのユーザーの記録を日付順）を読む。
+    重い読み取りなので router（db_routing.ReadRouter）経由でレプリカに流せるようにする。
+    journal を渡すと、未反映の保存を重ねる。
+    """
+    saves = journal.pending_saves(user_id) if journal is not None else []
+    keys = [key for key, _ in saves]
+
+    def read(s):
+        query = s.query(model)
+        if user_id is not None:
+            query = query.filter_by(user_id=user_id).order_by(model.date.asc())
+        # 反映済みのキーを記録の前後で確かめる。読んでいる間に反映された保存があると、
+        # 記録に含まれたか分からないので読み直す（重なるのは二重に見えるほうで、消えることはない）
+        for _ in range(3):
+            applied = save_journal.applied_keys(s, keys)
+            recs = query.all()
+            if save_journal.applied_keys(s, keys) == applied:
+                break
+        return recs, applied
+
+    recs, applied = router.read(read, user_id=user_id)
+    df = to_frame(recs, index)
+    pending = [(key, records) for key, records in saves if key not in applied]
+    if not pending:
+        return df
+    df = pd.concat([df, pending_frame(pending, index)], ignore_index=True) if not df.empty \
+        else pending_frame(pending, index)
+    if user_id is not None:
+        df = df.sort_values("日付", kind="stable", ignore_index=True)
+    return df
+
+
+def restore_csv(session, model, index, source, **fields) -> Tuple[List, Dict[str, str]]:
+    """
+    バックアップCSV（列名が違う CSV も可）から記録を作って session に追加する。commit は呼び出し側。
+    fields は全記録に入れる列（user_id など）。戻り値は (追加した記録, 役割 -> 元の列名)。
+    """
+    new_df, mapping, _ = import_training_csv(source, default_body_part=None)
+    new_df["日付"] = new_df["日付"].dt.date
+    # 種目名は種類ごとに1回だけ辞書で正規化する
+    resolved = {name: index.resolve(session, name, part)
+                for name, part in new_df[["種目", "部位"]].drop_duplicates("種目").itertuples(index=False)}
+    # 部位が空欄の行（部位の列が無い CSV を含む）だけ辞書に登録されている部位で埋める
+    parts = {name: index.body_part(ex_id) or DEFAULT_BODY_PART for name, (ex_id, _) in resolved.items()}
+    records = [
+        model(
+            **fields,
+            date=row["日付"],
+            body_part=row["部位"] or parts[row["種目"]],
+            exercise=resolved[row["種目"]][1],
+            exercise_id=resolved[row["種目"]][0],
+            weight=row["重量(kg)"],
+            reps=row["回数"],
+            volume=row["ボリューム"]
+        )
+        for _, row in new_df.iterrows()
+    ]
+    session.add_all(records)
+    return records, mapping
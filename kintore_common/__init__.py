@@ -0,0 +1,6 @@
+"""
+バックエンド（backend_fastapi）と Streamlit アプリ（frontend_streamlit）で共有するモジュール。
+
+どちらもリポジトリ直下を sys.path に加えて `kintore_common.xxx` として import します
+（各アプリの平置きのモジュール database・models などとは名前がぶつかりません）。
+"""
@@ -0,0 +1,251 @@
+"""
+いろいろな形式のトレーニングログCSVを、アプリ共通の列
+（日付, 部位, 種目, 重量(kg), 回数, ボリューム）に読み替えるインポーター。
+
+1. ヘッダー行だけを読み、列名の並び（ヘッダー署名）でキャッシュを引く
+2. キャッシュに無ければ、列名の同義語と先頭 SAMPLE_ROWS 行の値から各列の役割を推定して保存
+3. 必要な列だけを usecols / dtype 指定で読み込む（pyarrow があれば engine="pyarrow"）
+
+同じアプリから定期的に出力されるCSVは 2 を飛ばせるので、推定の分だけ速くなります。
+キャッシュは CSV_SCHEMA_CACHE（既定 ~/.cache/kintore/csv_schema_cache.json）に保存されます。
+"""
+import csv
+import hashlib
+import importlib.util
+import io
+import json
+import os
+import re
+import threading
+import unicodedata
+from pathlib import Path
+from typing import Dict, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+OUTPUT_COLUMNS = ["日付", "部位", "種目", "重量(kg)", "回数", "ボリューム"]
+REQUIRED_ROLES = ("date", "exercise", "weight", "reps")
+ROLE_TO_COLUMN = {
+    "date": "日付", "body_part": "部位", "exercise": "種目",
+    "weight": "重量(kg)", "reps": "回数", "volume": "ボリューム",
+}
+SAMPLE_ROWS = 200
+DEFAULT_BODY_PART = "その他"
+
+# 正規化済みの列名 -> 役割
+HEADER_SYNONYMS = {
+    "date": ["日付", "日時", "トレーニング日", "date", "day", "datetime", "workoutdate", "trainedat", "timestamp"],
+    "exercise": ["種目", "種目名", "exercise", "exercisename", "name", "lift", "movement", "workout"],
+    "weight": ["重量kg", "重量", "weight", "weightkg", "kg", "load", "重さ"],
+    "reps": ["回数", "レップ", "レップ数", "reps", "rep", "repetitions", "count"],
+    "body_part": ["部位", "bodypart", "muscle", "musclegroup", "category", "target"],
+    "volume": ["ボリューム", "volume", "tonnage", "totalvolume"],
+}
+_HEADER_INDEX = {name: role for role, names in HEADER_SYNONYMS.items() for name in names}
+
+_HAS_PYARROW = importlib.util.find_spec("pyarrow") is not None
+
+
+def _norm_header(name: str) -> str:
+    s = unicodedata.normalize("NFKC", str(name)).strip().lower()
+    return re.sub(r"[\s_\-()（）\[\]./]+", "", s)
+
+
+# =========================
+# スキーマ推定
+# =========================
+def _looks_like_date(values: pd.Series) -> float:
+    s = values.dropna().astype(str)
+    if s.empty or s.str.fullmatch(r"-?\d+(\.\d+)?").mean() > 0.5:
+        return 0.0
+    return float(pd.to_datetime(s, errors="coerce", format="mixed").notna().mean())
+
+
+def infer_mapping(sample: pd.DataFrame) -> Dict[str, str]:
+    """
+    サンプル行から 役割 -> 元の列名 の対応を推定する。
+    列名の同義語を優先し、残りの役割を値の傾向で埋める。
+    """
+    mapping: Dict[str, str] = {}
+    for col in sample.columns:
+        role = _HEADER_INDEX.get(_norm_header(col))
+        if role and role not in mapping:
+            mapping[role] = col
+
+    free = [c for c in sample.columns if c not in mapping.values()]
+    numeric = {c: pd.to_numeric(sample[c], errors="coerce") for c in free}
+
+    if "date" not in mapping:
+        scores = {c: _looks_like_date(sample[c]) for c in free}
+        best = max(scores, key=scores.get, default=None)
+        if best is not None and scores[best] >= 0.8:
+            mapping["date"] = best
+            free.remove(best)
+
+    if "reps" not in mapping:
+        # 回数: ほぼ全部が 1〜100 の整数
+        cands = []
+        for c in free:
+            v = numeric[c].dropna()
+            if len(v) and numeric[c].notna().mean() >= 0.9:
+                frac = ((v == v.round()) & (v >= 1) & (v <= 100)).mean()
+                if frac >= 0.95:
+                    cands.append((v.median(), c))
+        if cands:
+            mapping["reps"] = min(cands)[1]
+            free.remove(mapping["reps"])
+
+    if "weight" not in mapping:
+        # 重量: 数値列のうち中央値が最も大きいもの（回数より重い前提）
+        cands = [(numeric[c].median(), c) for c in free
+                 if numeric[c].notna().mean() >= 0.9 and numeric[c].dropna().ge(0).all()]
+        if cands:
+            mapping["weight"] = max(cands)[1]
+            free.remove(mapping["weight"])
+
+    if "exercise" not in mapping:
+        # 種目: 数値でない文字列列のうち、種類数が行数に比べて少ないもの
+        cands = [(sample[c].nunique(), c) for c in free if numeric[c].notna().mean() < 0.5]
+        if cands:
+            mapping["exercise"] = min(cands)[1]
+            free.remove(mapping["exercise"])
+
+    missing = [r for r in REQUIRED_ROLES if r not in mapping]
+    if missing:
+        raise ValueError(f"列の役割を推定できませんでした: {', '.join(missing)}（列: {list(sample.columns)}）")
+    return mapping
+
+
+# =========================
+# キャッシュ
+# =========================
+class SchemaCache:
+    """ヘッダー署名 -> 推定結果。プロセス内の辞書と JSON ファイルの二段。"""
+
+    def __init__(self, path: Optional[Union[str, Path]] = None):
+        default = Path.home() / ".cache" / "kintore" / "csv_schema_cache.json"
+        self.path = Path(path or os.getenv("CSV_SCHEMA_CACHE", default))
+        self._entries: Optional[Dict[str, Dict[str, str]]] = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def signature(header, delimiter: str) -> str:
+        raw = delimiter + "\x1f".join(header)
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def _load(self):
+        if self._entries is None:
+            try:
+                self._entries = json.loads(self.path.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                self._entries = {}
+
+    def get(self, sig: str) -> Optional[Dict[str, str]]:
+        with self._lock:
+            self._load()
+            return self._entries.get(sig)
+
+    def put(self, sig: str, mapping: Dict[str, str]):
+        with self._lock:
+            self._load()
+            self._entries[sig] = mapping
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                tmp = self.path.with_suffix(".tmp")
+                tmp.write_text(json.dumps(self._entries, ensure_ascii=False), encoding="utf-8")
+                tmp.replace(self.path)
+            except OSError:
+                pass  # 書けない環境ではメモリ上のキャッシュだけ使う
+
+
+schema_cache = SchemaCache()
+
+
+# =========================
+# 読み込み
+# =========================
+def _to_bytes(source) -> bytes:
+    if isinstance(source, (bytes, bytearray)):
+        return bytes(source)
+    if isinstance(source, (str, Path)):
+        return Path(source).read_bytes()
+    if hasattr(source, "seek"):
+        source.seek(0)
+    return source.read()
+
+
+def _read_header(data: bytes) -> Tuple[list, str, str, bool]:
+    line = data.split(b"\n", 1)[0].rstrip(b"\r")
+    encoding = "utf-8-sig"
+    try:
+        first = line.decode(encoding)
+    except UnicodeDecodeError:
+        encoding = "cp932"  # Excel で保存された日本語CSV
+        first = line.decode(encoding, errors="ignore")
+    try:
+        delimiter = csv.Sniffer().sniff(first, delimiters=",\t;").delimiter
+    except csv.Error:
+        delimiter = ","
+    header = next(csv.reader([first], delimiter=delimiter))
+    padded = any(h != h.strip() for h in header)
+    return [h.strip() for h in header], delimiter, encoding, padded
+
+
+def import_training_csv(source, cache: SchemaCache = schema_cache,
+                        default_body_part: Optional[str] = DEFAULT_BODY_PART
+                        ) -> Tuple[pd.DataFrame, Dict[str, str], bool]:
+    """
+    CSV（パス・bytes・ファイルオブジェクト）を共通列の DataFrame にする。
+    戻り値は (DataFrame, 役割 -> 元の列名, キャッシュを使ったか)。
+    部位の列が無い・空欄の行は default_body_part（None なら None のまま）にする。
+    """
+    data = _to_bytes(source)
+    header, delimiter, encoding, padded = _read_header(data)
+    sig = cache.signature(header, delimiter)
+
+    mapping = cache.get(sig)
+    cache_hit = mapping is not None
+    if not cache_hit:
+        sample = pd.read_csv(io.BytesIO(data), sep=delimiter, encoding=encoding, nrows=SAMPLE_ROWS,
+                             dtype=str, skipinitialspace=True)
+        sample.columns = [c.strip() for c in sample.columns]
+        mapping = infer_mapping(sample)
+        cache.put(sig, mapping)
+
+    usecols = list(mapping.values())
+    dtypes = {mapping[r]: t for r, t in (("weight", "float64"), ("reps", "float64"),
+                                          ("volume", "float64"), ("exercise", "string"),
+                                          ("body_part", "string")) if r in mapping}
+    if padded:
+        # 列名に前後の空白がある CSV は usecols で指定できないので、全列を読んでから取り出す
+        raw = pd.read_csv(io.BytesIO(data), sep=delimiter, encoding=encoding, skipinitialspace=True)
+        raw.columns = [c.strip() for c in raw.columns]
+        raw = raw[usecols].astype(dtypes)
+    else:
+        kwargs = dict(sep=delimiter, usecols=usecols, dtype=dtypes)
+        if _HAS_PYARROW and encoding == "utf-8-sig":
+            kwargs["engine"] = "pyarrow"
+        else:
+            kwargs["encoding"] = encoding
+        raw = pd.read_csv(io.BytesIO(data), **kwargs)
+
+    out = pd.DataFrame({ROLE_TO_COLUMN[role]: raw[col] for role, col in mapping.items()})
+    # 日付は datetime64 のまま返す（date オブジェクトへの変換は保存する側で必要なときだけ）
+    out["日付"] = pd.to_datetime(out["日付"], errors="coerce", format="mixed").dt.normalize()
+    out["重量(kg)"] = pd.to_numeric(out["重量(kg)"], errors="coerce")
+    out["回数"] = pd.to_numeric(out["回数"], errors="coerce")
+    out = out.dropna(subset=["日付", "種目", "重量(kg)", "回数"])
+    out["回数"] = out["回数"].astype(np.int64)
+    out["種目"] = out["種目"].astype(str).str.strip()
+    if "部位" not in out:
+        out["部位"] = default_body_part
+    else:
+        parts = out["部位"].astype("string").str.strip().replace("", pd.NA)
+        out["部位"] = parts.fillna(default_body_part).astype(object) if default_body_part is not None \
+            else parts.astype(object).where(parts.notna(), None)
+    if "ボリューム" not in out:
+        out["ボリューム"] = out["重量(kg)"] * out["回数"]
+    else:
+        out["ボリューム"] = out["ボリューム"].fillna(out["重量(kg)"] * out["回数"])
+    return out[OUTPUT_COLUMNS].reset_index(drop=True), mapping, cache_hit
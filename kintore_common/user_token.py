@@ -0,0 +1,56 @@
+"""
+ログイン済みユーザーを API に伝える署名付きトークン。
+
+Streamlit 側がログイン後に sign() で発行し、FastAPI 側は verify() が返したユーザーIDだけを信用します
+（リクエスト本文の user_id のようにクライアントが自由に書ける値は使いません）。
+
+    トークン = "<user_id>.<有効期限(UNIX秒)>.<HMAC-SHA256(署名鍵, "<user_id>.<有効期限>")>"
+
+署名鍵は両アプリで同じ KINTORE_USER_TOKEN_SECRET を設定します。未設定のときは発行も検証もせず
+（verify は常に None）、API はユーザー固有のデータを返しません。
+"""
+import hashlib
+import hmac
+import os
+import time
+from typing import Optional
+
+SECRET_ENV = "KINTORE_USER_TOKEN_SECRET"
+# 既定の有効期間（秒）
+DEFAULT_TTL = 12 * 3600
+
+
+def _secret(secret: Optional[str]) -> bytes:
+    return (secret if secret is not None else os.getenv(SECRET_ENV, "")).encode("utf-8")
+
+
+def _signature(key: bytes, payload: str) -> str:
+    return hmac.new(key, payload.encode("ascii"), hashlib.sha256).hexdigest()
+
+
+def sign(user_id: int, secret: Optional[str] = None, ttl: float = DEFAULT_TTL,
+         now: Optional[float] = None) -> Optional[str]:
+    """user_id のトークンを作る。署名鍵が無ければ None。"""
+    key = _secret(secret)
+    if not key:
+        return None
+    expires = int((time.time() if now is None else now) + ttl)
+    payload = f"{int(user_id)}.{expires}"
+    return f"{payload}.{_signature(key, payload)}"
+
+
+def verify(token: Optional[str], secret: Optional[str] = None, now: Optional[float] = None) -> Optional[int]:
+    """正しく署名された期限内のトークンならユーザーID、それ以外は None。"""
+    key = _secret(secret)
+    if not key or not token:
+        return None
+    try:
+        user_id, expires, signature = token.split(".")
+        payload = f"{int(user_id)}.{int(expires)}"
+    except ValueError:
+        return None
+    if not hmac.compare_digest(_signature(key, payload), signature):
+        return None
+    if int(expires) < (time.time() if now is None else now):
+        return None
+    return int(user_id)
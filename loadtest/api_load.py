@@ -0,0 +1,98 @@
+"""
+FastAPI への負荷（asyncio + httpx のクローズドループ）。
+
+同時接続数ぶんの仮想ユーザーが、重み付きでエンドポイントを選んでリクエストを送り続けます。
+実行中は /metrics を定期的に読み、DB コネクションプールの使用数を記録します。
+"""
+import asyncio
+import random
+import re
+import time
+from typing import Dict, List, Sequence, Tuple
+
+import httpx
+
+# (ステップ名, 重み)
+SCENARIO = [
+    ("GET /dashboard/{user_id}", 4),
+    ("GET /analytics/users/{user_id}", 3),
+    ("GET /analytics/cohort", 1),
+    ("POST /chat", 1),
+    ("POST /upload_csv", 1),
+]
+
+UPLOAD_CSV = (
+    "date,exercise,weight,reps\n"
+    + "".join(f"2025-09-{d:02d},Bench Press,{60 + d * 2.5},8\n" for d in range(1, 29))
+).encode("utf-8")
+
+_POOL_LINE = re.compile(r'^db_pool_connections\{engine="[^"]*",state="checked_out"\} (\S+)$', re.M)
+
+
+async def _request(client: httpx.AsyncClient, step: str, user_id: int) -> httpx.Response:
+    if step == "GET /dashboard/{user_id}":
+        return await client.get(f"/dashboard/{user_id}")
+    if step == "GET /analytics/users/{user_id}":
+        return await client.get(f"/analytics/users/{user_id}")
+    if step == "GET /analytics/cohort":
+        return await client.get("/analytics/cohort")
+    if step == "POST /chat":
+        return await client.post("/chat", json={"message": "ベンチプレスを伸ばしたい", "user_id": user_id,
+                                                "stream": False})
+    if step == "POST /upload_csv":
+        return await client.post("/upload_csv", files={"file": ("loadtest.csv", UPLOAD_CSV, "text/csv")})
+    raise ValueError(step)
+
+
+async def _sample_pool(client: httpx.AsyncClient, stop: asyncio.Event, interval: float, samples: List[float]):
+    while not stop.is_set():
+        try:
+            # 同期・非同期エンジンの使用中接続の合計
+            values = _POOL_LINE.findall((await client.get("/metrics")).text)
+            if values:
+                samples.append(sum(float(v) for v in values))
+        except httpx.HTTPError:
+            pass
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=interval)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def run(base_url: str, user_ids: Sequence[int], duration: float, concurrency: int,
+              think_time: float = 0.0, seed: int = 0) -> Tuple[List[Dict], List[float]]:
+    """(サンプル一覧, プール使用数の推移) を返す。サンプルは step / latency / ok / t。"""
+    rng = random.Random(seed)
+    steps = [s for s, _ in SCENARIO]
+    weights = [w for _, w in SCENARIO]
+    samples: List[Dict] = []
+    pool_samples: List[float] = []
+    limits = httpx.Limits(max_connections=concurrency + 1, max_keepalive_connections=concurrency + 1)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30.0) as client:
+        stop = asyncio.Event()
+        sampler = asyncio.create_task(_sample_pool(client, stop, 0.5, pool_samples))
+        start = time.monotonic()
+        deadline = start + duration
+
+        async def virtual_user(i: int):
+            local = random.Random(rng.random() + i)
+            while time.monotonic() < deadline:
+                step = local.choices(steps, weights)[0]
+                user_id = local.choice(user_ids)
+                t0 = time.perf_counter()
+                try:
+                    res = await _request(client, step, user_id)
+                    # /analytics/users は集計前のユーザーだと 404 になるが、処理としては正常
+                    ok = res.status_code < 400 or res.status_code == 404
+                except httpx.HTTPError:
+                    ok = False
+                samples.append({"step": step, "latency": time.perf_counter() - t0, "ok": ok,
+                                "t": time.monotonic() - start})
+                if think_time:
+                    await asyncio.sleep(local.expovariate(1 / think_time))
+
+        await asyncio.gather(*(virtual_user(i) for i in range(concurrency)))
+        stop.set()
+        await sampler
+    return samples, pool_samples
@@ -0,0 +1,243 @@
+"""
+再現可能な負荷試験。
+
+1. ローカルDB（既定: loadtest/.data/loadtest.db）に合成データとログイン用ユーザーを投入
+2. run_server.py を prod モードで起動し、FastAPI のエンドポイントへ非同期クライアントで負荷をかける
+3. Streamlit アプリの会員セッション（ログイン → カレンダー → 保存 → 分析）を並列に流す
+4. ステップごとのスループット・p50/p95/p99・エラー率・DB接続数を出し、
+   thresholds.json（と --baseline の前回結果）を下回ったら終了コード 1 で終わる
+
+    python loadtest/run.py --duration 30 --concurrency 32 --sessions 8 --json result.json
+    python loadtest/run.py --baseline result.json --max-regression 0.2
+
+--db-url に PostgreSQL を渡すと同じシナリオをそのDBで流します（training_records と users を
+作り直すので、負荷試験専用のDBを --i-know-this-drops 付きで指定してください）。
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import httpx
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import api_load  # noqa: E402
+import seed  # noqa: E402
+import streamlit_sessions  # noqa: E402
+
+HERE = Path(__file__).resolve().parent
+ROOT = HERE.parent
+RUN_SERVER = ROOT / "backend_fastapi" / "run_server.py"
+
+
+# =========================
+# 集計
+# =========================
+def summarize(samples: List[Dict], duration: float) -> Dict[str, Dict]:
+    """ステップごとの件数・rps・p50/p95/p99（秒）・エラー率。全体は "total"。"""
+    by_step: Dict[str, List[Dict]] = {}
+    for s in samples:
+        by_step.setdefault(s["step"], []).append(s)
+    by_step["total"] = samples
+
+    result = {}
+    for step, rows in by_step.items():
+        if not rows:
+            continue
+        lat = np.array([r["latency"] for r in rows])
+        errors = sum(not r["ok"] for r in rows)
+        p50, p95, p99 = np.percentile(lat, [50, 95, 99])
+        result[step] = {
+            "count": len(rows),
+            "rps": round(len(rows) / duration, 2),
+            "p50": round(float(p50), 4),
+            "p95": round(float(p95), 4),
+            "p99": round(float(p99), 4),
+            "error_rate": round(errors / len(rows), 4),
+        }
+    return result
+
+
+def check(report: Dict, thresholds: Dict, baseline: Dict = None, max_regression: float = 0.2) -> List[str]:
+    """閾値・前回結果からの悪化を調べ、違反内容の一覧を返す。"""
+    violations = []
+    for kind in ("api", "streamlit"):
+        steps = report.get(kind)
+        if not steps:
+            continue
+        limits = thresholds.get(kind, {})
+        for step, stats in steps.items():
+            limit = dict(limits.get("*", {}), **limits.get(step, {}))
+            for key in ("p50", "p95", "p99", "error_rate"):
+                if key in limit and stats[key] > limit[key]:
+                    violations.append(f"{kind} {step}: {key} {stats[key]} > {limit[key]}")
+            if "min_rps" in limit and stats["rps"] < limit["min_rps"]:
+                violations.append(f"{kind} {step}: rps {stats['rps']} < {limit['min_rps']}")
+
+            prev = (baseline or {}).get(kind, {}).get(step)
+            if not prev:
+                continue
+            for key in ("p95", "p99"):
+                # ごく短いレイテンシの揺れで落ちないよう 10ms 未満は比較しない
+                if prev[key] >= 0.01 and stats[key] > prev[key] * (1 + max_regression):
+                    violations.append(f"{kind} {step}: {key} {stats[key]} は前回 {prev[key]} から "
+                                      f"{max_regression:.0%} 以上悪化")
+            if step == "total" and stats["rps"] < prev["rps"] * (1 - max_regression):
+                violations.append(f"{kind} total: rps {stats['rps']} は前回 {prev['rps']} から "
+                                  f"{max_regression:.0%} 以上低下")
+
+    db_limits = thresholds.get("db_connections", {})
+    for key, value in report.get("db_connections", {}).items():
+        if key in db_limits and value > db_limits[key]:
+            violations.append(f"db_connections {key}: {value} > {db_limits[key]}")
+    return violations
+
+
+def postgres_connections(url: str) -> int:
+    """PostgreSQL の場合、そのDBへの接続数（pg_stat_activity）。"""
+    from sqlalchemy import create_engine, text
+
+    engine = create_engine(url)
+    try:
+        with engine.connect() as conn:
+            return conn.execute(text(
+                "SELECT count(*) FROM pg_stat_activity WHERE datname = current_database()")).scalar() - 1
+    finally:
+        engine.dispose()
+
+
+# =========================
+# API
+# =========================
+def wait_until_ready(url: str, proc: subprocess.Popen, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError("APIサーバーが起動直後に終了しました")
+        try:
+            if httpx.get(url, timeout=1.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.3)
+    raise RuntimeError(f"サーバーが起動しませんでした: {url}")
+
+
+def run_api(args, db_url: str, user_ids: List[int]) -> Dict:
+    # チャットの接続元ごとのレート制限（429）はここでは測らないので緩める
+    env = dict(os.environ, DATABASE_URL=db_url, PRECOMPUTE_SCHEDULER="0", LOG_LEVEL="WARNING",
+               CHAT_RATE_PER_MIN="100000", CHAT_BURST="1000")
+    cmd = [sys.executable, str(RUN_SERVER), "--mode", "prod", "--host", "127.0.0.1",
+           "--port", str(args.port), "--workers", str(args.workers)]
+    proc = subprocess.Popen(cmd, env=env, cwd=RUN_SERVER.parent)
+    base_url = f"http://127.0.0.1:{args.port}"
+    try:
+        wait_until_ready(base_url + "/", proc)
+        samples, pool = asyncio.run(api_load.run(base_url, user_ids, args.duration, args.concurrency,
+                                                 think_time=args.think_time, seed=args.seed))
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+    # /metrics はそれに答えたワーカーの値なので、複数ワーカー時はワーカーあたりの目安
+    return {"steps": summarize(samples, args.duration),
+            "pool_peak": max(pool, default=0), "pool_mean": round(float(np.mean(pool)), 2) if pool else 0}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db-url", default=None, help="既定: loadtest/.data/loadtest.db（SQLite）")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--rows", type=int, default=50_000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--reseed", action="store_true", help="DBを作り直す")
+    parser.add_argument("--i-know-this-drops", dest="allow_drop", action="store_true",
+                        help="--db-url の training_records・users を作り直してよい（負荷試験専用のDBのときだけ）")
+    parser.add_argument("--duration", type=float, default=30.0, help="各フェーズの秒数")
+    parser.add_argument("--concurrency", type=int, default=32, help="API の仮想ユーザー数")
+    parser.add_argument("--think-time", type=float, default=0.0, help="API リクエスト間の平均待ち（秒）")
+    parser.add_argument("--workers", type=int, default=1, help="APIサーバーのワーカー数")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--sessions", type=int, default=4, help="Streamlit の同時セッション数（0で省略）")
+    parser.add_argument("--app", default=str(streamlit_sessions.DEFAULT_APP))
+    parser.add_argument("--skip-api", action="store_true")
+    parser.add_argument("--thresholds", default=str(HERE / "thresholds.json"))
+    parser.add_argument("--baseline", default=None, help="比較する前回の --json 出力")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="前回比で許す悪化率")
+    parser.add_argument("--json", dest="json_path", default=None, help="結果をJSONで保存")
+    args = parser.parse_args(argv)
+
+    db_url = args.db_url or seed.default_url()
+    try:
+        seed.datagen.check_droppable(db_url, args.allow_drop)
+    except ValueError as e:
+        parser.error(str(e))
+    print(f"DB準備中: {db_url}")
+    accounts = seed.seed(db_url, args.users, args.rows, args.seed, force=args.reseed, allow_drop=args.allow_drop)
+    seed.build_analytics(db_url)
+    is_postgres = db_url.startswith("postgresql")
+
+    report = {
+        "meta": {"db": db_url.split("@")[-1], "users": args.users, "rows": args.rows, "seed": args.seed,
+                 "duration": args.duration, "concurrency": args.concurrency, "workers": args.workers,
+                 "sessions": args.sessions, "python": platform.python_version(),
+                 "cpu_count": os.cpu_count(), "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S")},
+        "db_connections": {},
+    }
+
+    if not args.skip_api:
+        print(f"API: {args.concurrency} 並列で {args.duration:.0f} 秒")
+        api = run_api(args, db_url, [uid for uid, _ in accounts])
+        report["api"] = api["steps"]
+        report["db_connections"]["api_peak"] = api["pool_peak"]
+        report["db_connections"]["api_mean"] = api["pool_mean"]
+
+    if args.sessions:
+        print(f"Streamlit: {args.sessions} セッションで {args.duration:.0f} 秒")
+        samples, conn = streamlit_sessions.run(args.app, db_url, accounts, seed.PASSWORD,
+                                               args.duration, args.sessions, seed=args.seed)
+        report["streamlit"] = summarize(samples, args.duration)
+        report["db_connections"]["streamlit_peak"] = conn["peak"]
+        report["db_connections"]["streamlit_mean"] = round(conn["mean"], 2)
+        if is_postgres:
+            report["db_connections"]["postgres_after"] = postgres_connections(db_url)
+
+    for kind in ("api", "streamlit"):
+        if kind not in report:
+            continue
+        print(f"\n[{kind}]")
+        print(f"{'step':<34}{'count':>8}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'err':>8}")
+        for step, s in report[kind].items():
+            print(f"{step:<34}{s['count']:>8}{s['rps']:>9.1f}{s['p50'] * 1000:>8.0f}ms{s['p95'] * 1000:>7.0f}ms"
+                  f"{s['p99'] * 1000:>7.0f}ms{s['error_rate']:>8.1%}")
+    print(f"\nDB接続: {report['db_connections']}")
+
+    thresholds = json.loads(Path(args.thresholds).read_text(encoding="utf-8"))
+    baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8")) if args.baseline else None
+    violations = check(report, thresholds, baseline, args.max_regression)
+    report["violations"] = violations
+
+    if args.json_path:
+        Path(args.json_path).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"保存しました: {args.json_path}")
+
+    if violations:
+        print("\n閾値違反:")
+        for v in violations:
+            print(f"  - {v}")
+        return 1
+    print("\nOK: すべての閾値を満たしました")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,75 @@
+"""
+負荷試験用のローカルDBを用意する。
+
+benchmarks/datagen.py の合成 training_records に加えて、ログイン用のユーザー
+（loadtest{N}@example.com / 共通パスワード）を users に登録します。
+"""
+from pathlib import Path
+from typing import List, Tuple
+import os
+import subprocess
+import sys
+
+import bcrypt
+from sqlalchemy import Boolean, Column, Integer, MetaData, String, Table, create_engine, func, insert, select
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "benchmarks"))
+import datagen  # noqa: E402
+
+PASSWORD = "loadtest-password"
+DATA_DIR = Path(__file__).resolve().parent / ".data"
+
+metadata = MetaData()
+users = Table(
+    "users", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("email", String, unique=True, nullable=False, index=True),
+    Column("password_hash", String, nullable=False),
+    Column("is_admin", Boolean, default=False),
+)
+
+
+def email_for(user_id: int) -> str:
+    return f"loadtest{user_id}@example.com"
+
+
+def default_url() -> str:
+    DATA_DIR.mkdir(exist_ok=True)
+    return f"sqlite:///{DATA_DIR / 'loadtest.db'}"
+
+
+def seed(url: str, n_users: int, rows: int, seed_value: int = 0, force: bool = False,
+         allow_drop: bool = False) -> List[Tuple[int, str]]:
+    """
+    記録とユーザーを入れる（同じ件数・人数で入っていれば何もしない）。(user_id, email) の一覧を返す。
+    training_records と users を作り直すので、loadtest/.data 以外の DB は allow_drop=True のときだけ。
+    """
+    datagen.check_droppable(url, allow_drop)
+    engine = create_engine(url)
+    try:
+        metadata.create_all(engine)
+        with engine.connect() as conn:
+            current_users = conn.execute(select(func.count()).select_from(users)).scalar()
+        if force or current_users != n_users:
+            datagen.write_db(url, datagen.make_records(rows, users=n_users, seed=seed_value), allow_drop=allow_drop)
+            # パスワードのハッシュは全員共通（bcrypt は1回 0.2 秒ほどかかるため）。強度はアプリの登録時と同じ
+            password_hash = bcrypt.hashpw(PASSWORD.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
+            with engine.begin() as conn:
+                conn.execute(users.delete())
+                conn.execute(insert(users), [
+                    {"id": uid, "email": email_for(uid), "password_hash": password_hash, "is_admin": False}
+                    for uid in range(1, n_users + 1)
+                ])
+        else:
+            datagen.ensure_db(url, rows, seed=seed_value, users=n_users, allow_drop=allow_drop)
+    finally:
+        engine.dispose()
+    return [(uid, email_for(uid)) for uid in range(1, n_users + 1)]
+
+
+def build_analytics(url: str):
+    """/analytics が空にならないよう、バッチ集計を一度流しておく。"""
+    env = dict(os.environ, DATABASE_URL=url)
+    subprocess.run([sys.executable, str(ROOT / "backend_fastapi" / "app" / "cohort_analytics.py"), "--full"],
+                   env=env, check=True, cwd=ROOT / "backend_fastapi" / "app")
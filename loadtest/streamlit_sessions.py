@@ -0,0 +1,143 @@
+"""
+Streamlit の会員セッションを台本どおりに動かす負荷（streamlit.testing の AppTest を使用）。
+
+1セッション = ログイン → カレンダーで日付を選ぶ → ワークアウトを保存 → 分析を開く。
+Streamlit のブラウザとの通信（WebSocket + protobuf）は再現せず、各操作ごとのスクリプト再実行を
+同じプロセス内で並列に走らせます。1ノードで何人まで捌けるかを決めるのはこの再実行のコストです。
+
+DB の接続数は SQLAlchemy のプールイベント（checkout / checkin）で数えます。
+"""
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Dict, List, Sequence, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.pool import Pool
+
+ROOT = Path(__file__).resolve().parents[1]
+DEFAULT_APP = ROOT / "frontend_streamlit" / "app_firebase_login.py"
+
+
+class ConnectionCounter:
+    """プロセス内の全プールで貸し出し中の接続数を数える。"""
+
+    def __init__(self):
+        self.current = 0
+        self.peak = 0
+        self.samples: List[int] = []
+        self._lock = threading.Lock()
+        event.listen(Pool, "checkout", self._checkout)
+        event.listen(Pool, "checkin", self._checkin)
+
+    def _checkout(self, *_):
+        with self._lock:
+            self.current += 1
+            self.peak = max(self.peak, self.current)
+
+    def _checkin(self, *_):
+        with self._lock:
+            self.current -= 1
+
+    def sample(self):
+        with self._lock:
+            self.samples.append(self.current)
+
+    def close(self):
+        event.remove(Pool, "checkout", self._checkout)
+        event.remove(Pool, "checkin", self._checkin)
+
+
+def _button(at, label: str):
+    for b in at.button:
+        if b.label == label:
+            return b
+    raise LookupError(f"ボタンが見つかりません: {label}")
+
+
+def member_session(app_path: str, db_url: str, email: str, password: str, rng: random.Random,
+                   record, timeout: float = 60.0):
+    """1人分の台本。各操作の所要時間を record(step, seconds, ok) に渡す。"""
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(str(app_path), default_timeout=timeout)
+    at.secrets["DATABASE_URL"] = db_url
+
+    def step(name, action):
+        t0 = time.perf_counter()
+        try:
+            action()
+            ok = not at.exception
+        except Exception:
+            ok = False
+        record(name, time.perf_counter() - t0, ok)
+        return ok
+
+    def login():
+        at.run()
+        at.text_input[0].input(email)
+        at.text_input[1].input(password)
+        _button(at, "ログイン").click()
+        at.run()
+        if "user_id" not in at.session_state:
+            raise RuntimeError("ログインできませんでした")
+
+    def browse_calendar():
+        at.date_input[0].set_value(date.today() - timedelta(days=rng.randint(0, 60))).run()
+
+    def save_workout():
+        at.text_input(key="name_0").input(rng.choice(["ベンチプレス", "スクワット", "デッドリフト"]))
+        for s in range(3):
+            at.number_input(key=f"w_0_{s}").set_value(float(rng.randrange(40, 120, 5)))
+            at.number_input(key=f"r_0_{s}").set_value(rng.randint(5, 10))
+        _button(at, "💾 保存").click()
+        at.run()
+
+    def open_analysis():
+        # タブは毎回すべて描画されるので、分析タブを開く = スクリプトの再実行
+        at.run()
+
+    if not step("login", login):
+        return
+    step("browse_calendar", browse_calendar)
+    step("save_workout", save_workout)
+    step("open_analysis", open_analysis)
+
+
+def run(app_path: str, db_url: str, accounts: Sequence[Tuple[int, str]], password: str,
+        duration: float, concurrency: int, seed: int = 0) -> Tuple[List[Dict], Dict]:
+    """duration 秒間、concurrency 人が台本を繰り返す。(サンプル一覧, 接続数の統計) を返す。"""
+    rng = random.Random(seed)
+    samples: List[Dict] = []
+    lock = threading.Lock()
+    counter = ConnectionCounter()
+    start = time.monotonic()
+    deadline = start + duration
+    stop = threading.Event()
+
+    def record(step, seconds, ok):
+        with lock:
+            samples.append({"step": step, "latency": seconds, "ok": ok, "t": time.monotonic() - start})
+
+    def sampler():
+        while not stop.wait(0.5):
+            counter.sample()
+
+    def member(i: int):
+        local = random.Random(rng.random() + i)
+        while time.monotonic() < deadline:
+            _, email = local.choice(accounts)
+            member_session(app_path, db_url, email, password, local, record)
+
+    threading.Thread(target=sampler, daemon=True).start()
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(member, range(concurrency)))
+    finally:
+        stop.set()
+        counter.close()
+    samples_conn = counter.samples or [0]
+    return samples, {"peak": counter.peak, "mean": sum(samples_conn) / len(samples_conn)}